@@ -2,19 +2,30 @@ import streamlit as st
 import streamlit.components.v1 as components
 from streamlit_gsheets import GSheetsConnection
 import pandas as pd
+import numpy as np
 import datetime
 import time
 import base64
 import os
 import hashlib
+import logging
 import html
 import urllib.parse
 import re
 import random
 import unicodedata
 import json
+import copy
+import atexit
+import collections
+import sqlite3
+import contextlib
+import types
+import threading
 from zoneinfo import ZoneInfo
 
+LOGGER = logging.getLogger(__name__)
+
 # =========================================================
 # ♣ BLACK CLOVER WORKOUT — RIR Edition (perfis + planos)
 # =========================================================
@@ -1436,13 +1447,269 @@ div.stButton > button:first-child:hover{
 """, unsafe_allow_html=True)
 
 # --- 4. CONEXÃO E DADOS ---
-conn = st.connection("gsheets", type=GSheetsConnection)
+# --- 4.a Google Sheets offline (stand-in para benchmark / injeção de falhas) ---
+# Ativa-se em .streamlit/secrets.toml:
+#   [connections.gsheets]
+#   backend = "fake"
+#   worksheet = "Treinos"
+#   fake_path = "fake_gsheets.json"     # vazio = só memória
+#   fake_seed_csv = "offline_backup.csv" # dados iniciais se a folha ainda não existir
+#   fake_latency_ms = 150                # + fake_jitter_ms aleatório
+#   fake_quota_per_min = 60              # 429 com Retry-After ao passar o limite
+#   fake_error_429 = 0.02                # probabilidades de falha injetada por pedido
+#   fake_error_5xx = 0.01
+#   fake_error_net = 0.0
+#   fake_seed = 42                       # torna latência/falhas reproduzíveis
+
+def _fake_gs_error(msg: str, status: int | None = None, retry_after: float | None = None):
+    e = ConnectionError(msg) if status is None else RuntimeError(msg)
+    if status is not None:
+        headers = {"Retry-After": f"{retry_after:.0f}"} if retry_after is not None else {}
+        e.response = types.SimpleNamespace(status_code=status, headers=headers)
+    return e
+
+def _fake_gs_trim(rows: list) -> list:
+    """Como a API: sem células vazias no fim de cada linha nem linhas vazias no fim."""
+    out = []
+    for r in rows:
+        vals = ["" if x is None else str(x) for x in r]
+        while vals and vals[-1] == "":
+            vals.pop()
+        out.append(vals)
+    while out and not out[-1]:
+        out.pop()
+    return out
+
+def _fake_gs_col_index(letters: str) -> int:
+    n = 0
+    for ch in letters:
+        n = n * 26 + (ord(ch) - 64)
+    return n
+
+def _fake_gs_range(a1: str):
+    """'A5:V', 'A5:V5', '1:1', 'A1' -> (linha0, linha1|None, col0, col1|None), 1-based inclusivo."""
+    a1 = str(a1).split("!")[-1].strip().upper()
+    parts = a1.split(":")
+    m0 = re.fullmatch(r"([A-Z]*)(\d*)", parts[0])
+    m1 = re.fullmatch(r"([A-Z]*)(\d*)", parts[1]) if len(parts) > 1 else m0
+    if not m0 or not m1:
+        raise ValueError(f"Intervalo inválido: {a1}")
+    r0 = int(m0.group(2)) if m0.group(2) else 1
+    c0 = _fake_gs_col_index(m0.group(1)) if m0.group(1) else 1
+    r1 = int(m1.group(2)) if m1.group(2) else None
+    c1 = _fake_gs_col_index(m1.group(1)) if m1.group(1) else None
+    return r0, r1, c0, c1
+
+@st.cache_resource(show_spinner=False)
+def _fake_gsheets_connection(cfg_json: str):
+    """Substituto local do GSheetsConnection (conn.read/update + superfície gspread usada pela app).
+    Dados em memória (ou JSON em disco), com latência, quota por minuto, 429, 5xx e falhas de rede
+    configuráveis. Partilhado pelo processo, como a folha real.
+    """
+    cfg = json.loads(cfg_json)
+    rng = random.Random(cfg.get("fake_seed"))
+    path = str(cfg.get("fake_path") or "").strip()
+    default_ws = str(cfg.get("worksheet") or "Sheet1")
+    lock = threading.RLock()
+    state = {"sheets": {}, "calls": [], "stats": {}, "faults": {}}
+
+    if path and os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                state["sheets"] = {k: [list(map(str, r)) for r in v] for k, v in json.load(f).items()}
+        except Exception:
+            state["sheets"] = {}
+    seed_csv = str(cfg.get("fake_seed_csv") or "").strip()
+    if default_ws not in state["sheets"] and seed_csv and os.path.exists(seed_csv):
+        try:
+            dfs = pd.read_csv(seed_csv, dtype=str, keep_default_na=False)
+            state["sheets"][default_ws] = [list(dfs.columns)] + dfs.astype(str).values.tolist()
+        except Exception:
+            pass
+    state["sheets"].setdefault(default_ws, [])
+
+    def _persist():
+        if not path:
+            return
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state["sheets"], f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def _request(op: str):
+        """Um pedido à 'API': latência, quota e falhas injetadas (por esta ordem)."""
+        lat = float(cfg.get("fake_latency_ms", 0) or 0) + rng.random() * float(cfg.get("fake_jitter_ms", 0) or 0)
+        if lat > 0:
+            time.sleep(lat / 1000.0)
+        with lock:
+            now = time.time()
+            state["stats"][op] = state["stats"].get(op, 0) + 1
+            quota = int(cfg.get("fake_quota_per_min", 0) or 0)
+            calls = [t for t in state["calls"] if now - t < 60.0]
+            state["calls"] = calls
+            if quota and len(calls) >= quota:
+                state["faults"]["quota"] = state["faults"].get("quota", 0) + 1
+                raise _fake_gs_error("APIError: [429]: Quota exceeded for quota metric 'Read requests' (RATE_LIMIT_EXCEEDED)",
+                                     status=429, retry_after=max(1.0, 60.0 - (now - calls[0])))
+            calls.append(now)
+            roll = rng.random()
+            p429 = float(cfg.get("fake_error_429", 0) or 0)
+            p5xx = float(cfg.get("fake_error_5xx", 0) or 0)
+            pnet = float(cfg.get("fake_error_net", 0) or 0)
+            if roll < p429:
+                state["faults"]["429"] = state["faults"].get("429", 0) + 1
+                raise _fake_gs_error("APIError: [429]: RATE_LIMIT_EXCEEDED (injetado)", status=429, retry_after=5)
+            if roll < p429 + p5xx:
+                state["faults"]["5xx"] = state["faults"].get("5xx", 0) + 1
+                raise _fake_gs_error("APIError: [503]: The service is currently unavailable (injetado)", status=503)
+            if roll < p429 + p5xx + pnet:
+                state["faults"]["net"] = state["faults"].get("net", 0) + 1
+                raise _fake_gs_error("Connection aborted: Max retries exceeded (injetado)")
+
+    def _rows(name: str) -> list:
+        if name not in state["sheets"]:
+            raise LookupError(f"WorksheetNotFound: {name}")
+        return state["sheets"][name]
+
+    def _last_used_row(rows: list) -> int:
+        n = len(rows)
+        while n > 0 and not any(str(x) != "" for x in rows[n - 1]):
+            n -= 1
+        return n
+
+    def _write(rows: list, r0: int, c0: int, values: list):
+        for i, vals in enumerate(values):
+            ri = r0 - 1 + i
+            while len(rows) <= ri:
+                rows.append([])
+            row = rows[ri]
+            need = c0 - 1 + len(vals)
+            if len(row) < need:
+                row.extend([""] * (need - len(row)))
+            for j, v in enumerate(vals):
+                row[c0 - 1 + j] = "" if v is None else str(v)
+
+    def _worksheet(name: str):
+        def row_values(i):
+            _request("row_values")
+            with lock:
+                rows = _rows(name)
+                got = _fake_gs_trim([rows[i - 1]]) if 0 < i <= len(rows) else []
+            return got[0] if got else []
+
+        def col_values(c):
+            _request("col_values")
+            with lock:
+                vals = [(r[c - 1] if len(r) >= c else "") for r in _rows(name)]
+            while vals and vals[-1] == "":
+                vals.pop()
+            return vals
+
+        def get_all_values():
+            _request("get_all_values")
+            with lock:
+                rows = _fake_gs_trim(_rows(name))
+            width = max((len(r) for r in rows), default=0)
+            return [r + [""] * (width - len(r)) for r in rows]
+
+        def batch_get(ranges, **kwargs):
+            _request("batch_get")
+            out = []
+            with lock:
+                rows = _rows(name)
+                for a1 in ranges:
+                    r0, r1, c0, c1 = _fake_gs_range(a1)
+                    sel = rows[r0 - 1:(r1 if r1 is not None else len(rows))]
+                    out.append(_fake_gs_trim([r[c0 - 1:(c1 if c1 is not None else len(r))] for r in sel]))
+            return out
+
+        def update(range_name, values=None, **kwargs):
+            if isinstance(range_name, list):  # assinatura gspread 6: update(values, range_name)
+                range_name, values = (values or "A1"), range_name
+            _request("update")
+            with lock:
+                r0, _r1, c0, _c1 = _fake_gs_range(range_name)
+                _write(state["sheets"].setdefault(name, []), r0, c0, list(values or []))
+                _persist()
+            return {"updatedRange": str(range_name)}
+
+        def append_rows(values, **kwargs):
+            _request("append_rows")
+            with lock:
+                rows = state["sheets"].setdefault(name, [])
+                _write(rows, _last_used_row(rows) + 1, 1, list(values or []))
+                _persist()
+            return {"updates": {"updatedRows": len(values or [])}}
+
+        def append_row(values, **kwargs):
+            return append_rows([values], **kwargs)
+
+        return types.SimpleNamespace(
+            title=name, row_values=row_values, col_values=col_values, get_all_values=get_all_values,
+            batch_get=batch_get, update=update, append_rows=append_rows, append_row=append_row,
+        )
+
+    def _open(_key):
+        _request("open")
+
+        def worksheet(name):
+            _request("worksheet")
+            with lock:
+                _rows(name)
+            return _worksheet(name)
+
+        return types.SimpleNamespace(worksheet=worksheet, sheet1=_worksheet(default_ws))
+
+    def read(worksheet=None, ttl=None, **kwargs):
+        _request("conn_read")
+        with lock:
+            rows = _fake_gs_trim(_rows(str(worksheet or default_ws)))
+        if not rows:
+            return pd.DataFrame()
+        header = rows[0]
+        data = [r[:len(header)] + [""] * (len(header) - len(r[:len(header)])) for r in rows[1:] if r]
+        return pd.DataFrame(data, columns=header)
+
+    def update_frame(data=None, worksheet=None, **kwargs):
+        _request("conn_update")
+        df = data if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
+        values = [[str(c) for c in df.columns]] + [["" if pd.isna(v) else str(v) for v in r] for r in df.itertuples(index=False)]
+        with lock:
+            state["sheets"][str(worksheet or default_ws)] = values
+            _persist()
+        return df
+
+    def stats() -> dict:
+        with lock:
+            return {"requests": dict(state["stats"]), "faults": dict(state["faults"]),
+                    "rows": {k: len(v) for k, v in state["sheets"].items()}}
+
+    client = types.SimpleNamespace(open_by_url=_open, open_by_key=_open)
+    return types.SimpleNamespace(read=read, update=update_frame, _client=client, stats=stats, is_fake=True)
+
+def _gsheets_cfg():
+    try:
+        cfg = st.secrets.get("connections", {}).get("gsheets", {})
+    except Exception:
+        return {}
+    if str(cfg.get("backend", "") or "").strip().lower() == "fake":
+        cfg = dict(cfg)
+        cfg.setdefault("spreadsheet", "fake://bc")
+    return cfg
+
+def _gsheets_backend():
+    cfg = _gsheets_cfg()
+    if str(cfg.get("backend", "") or "").strip().lower() == "fake":
+        return _fake_gsheets_connection(json.dumps(dict(cfg), sort_keys=True, default=str))
+    return st.connection("gsheets", type=GSheetsConnection)
+
+conn = _gsheets_backend()
 
 SCHEMA_COLUMNS = [
     "Data","Perfil","Dia","Bloco","Plano_ID",
     "Exercício","Exercício_Key","Peso","Reps","RIR","Notas",
     "Aquecimento","Mobilidade","Cardio","Tendões","Core","Cooldown",
-    "XP","Streak","Checklist_OK"
+    "XP","Streak","Checklist_OK","Row_ID"
 ]
 
 PROFILES_WORKSHEET = "Perfis"
@@ -1452,10 +1719,24 @@ PROFILES_BACKUP_PATH = "offline_profiles.csv"
 
 BACKUP_PATH = "offline_backup.csv"
 DATA_CACHE_SECONDS = 45
+DATA_INCREMENTAL_READS = True  # refresh lê só as linhas novas (append-only) em vez da sheet inteira
+LOCAL_STORE_PATH = "bc_training.sqlite3"  # store local (fonte de verdade); a Sheet é espelho
+HISTORY_SNAPSHOT_PATH = "bc_snapshot.bin"  # histórico + perfis normalizados para o arranque a frio
+HISTORY_SNAPSHOT_SCHEMA = 2  # subir quando o conteúdo do snapshot muda (snapshots antigos são ignorados)
+HISTORY_SNAPSHOT_MIN_INTERVAL_S = 600  # o worker reescreve o snapshot no máximo a cada 10 min (e ao sair)
+SHEET_SYNC_INTERVAL_S = 20
+SHEET_SYNC_BATCH_WINDOW_S = 1.5  # junta gravações de várias sessões num só append_rows
+SHEETS_QUOTA_PER_MIN = 60  # orçamento de pedidos à API do Google Sheets (partilhado pelo processo)
+SHEETS_WRITE_RESERVE = 12  # tokens que leituras em background nunca gastam (ficam para gravações)
+SHEETS_BREAKER_FAILURES = 2  # falhas de rede seguidas que abrem o circuito (modo offline)
+SHEETS_BREAKER_COOLDOWN_S = 15  # espera até à primeira sonda; duplica a cada sonda falhada
+SHEETS_BREAKER_MAX_COOLDOWN_S = 120
 PROFILES_CACHE_SECONDS = 300
+EXERCISE_KEY_MEMO_MAX = 4096  # nome de exercício -> chave normalizada (LRU partilhada pelo processo)
 
 # --- YAMI: estado persistente (coach) ---
 YAMI_STATE_PATH = "yami_state.json"
+YAMI_MEMO_MAX = 512  # sugestões do coach em memória (LRU partilhada pelo processo)
 
 # --- TREINO PURO: persistência de sessão em curso (evita reset quando mobile suspende o browser) ---
 INPROGRESS_STATE_PATH = "_inprogress_sessions.json"
@@ -2156,11 +2437,47 @@ def _conn_read_worksheet(worksheet: str) -> pd.DataFrame:
 
 def _conn_update_worksheet(df: pd.DataFrame, worksheet: str):
     """Tenta atualizar uma worksheet específica. Se a lib não suportar worksheet=, levanta."""
-    return _retry(lambda: conn.update(data=df, worksheet=worksheet), tries=2)
+    return _retry(lambda: conn.update(data=df, worksheet=worksheet), tries=2, prio=GS_PRIO_WRITE)
+
+def _read_profiles_sheet() -> pd.DataFrame:
+    """Lê a worksheet 'Perfis' (schema garantido, sem duplicados/vazios) e guarda o backup offline."""
+    dfp = _conn_read_worksheet(PROFILES_WORKSHEET)
+    if dfp is None or dfp.empty:
+        dfp = pd.DataFrame(columns=PROFILES_COLUMNS)
+    for c in PROFILES_COLUMNS:
+        if c not in dfp.columns:
+            dfp[c] = None
+    dfp = dfp[PROFILES_COLUMNS].copy()
+    # limpa duplicados / vazios
+    dfp["Perfil"] = dfp["Perfil"].astype(str).str.strip()
+    dfp = dfp[dfp["Perfil"] != ""]
+    dfp = dfp.drop_duplicates(subset=["Perfil"], keep="last")
+    _save_offline_profiles(dfp)
+    return dfp
+
+
+@st.cache_resource(show_spinner=False)
+def _shared_profiles_cache(source_key: str) -> dict:
+    """Última leitura boa dos perfis, partilhada pelo processo (semeada pelo snapshot de arranque).
+    Sessões novas usam-na logo; se estiver velha, o worker relê a Sheet em background."""
+    return {"lock": threading.Lock(), "df": None, "ts": 0.0}
+
+
+def _profiles_shared() -> dict:
+    return _shared_profiles_cache(_history_source_key())
+
+
+def _profiles_shared_set(dfp: pd.DataFrame, ts: float | None = None) -> None:
+    shared = _profiles_shared()
+    with shared["lock"]:
+        shared["df"] = dfp[PROFILES_COLUMNS].copy()
+        shared["ts"] = time.time() if ts is None else float(ts)
+
 
 def get_profiles_df(force_refresh: bool = False):
     """Perfis ficam na worksheet 'Perfis'. Se não existir / sem permissão, faz fallback.
     Usa cache em sessão para evitar bater no limite de reads no mobile (timer faz muitos reruns).
+    Sem cache em sessão, usa a cópia partilhada pelo processo (ou a do snapshot) e relê em background.
     """
     try:
         if not force_refresh:
@@ -2173,19 +2490,30 @@ def get_profiles_df(force_refresh: bool = False):
     except Exception:
         pass
 
+    if not force_refresh:
+        try:
+            shared = _profiles_shared()
+            with shared["lock"]:
+                _pf, _pf_ts = shared["df"], float(shared["ts"])
+            if _pf is None:
+                snap = _snapshot_take("profiles")
+                if snap is not None:
+                    _profiles_shared_set(snap["df"], snap["ts"])
+                    _pf, _pf_ts = snap["df"][PROFILES_COLUMNS].copy(), float(snap["ts"])
+            if isinstance(_pf, pd.DataFrame):
+                if (time.time() - _pf_ts) >= PROFILES_CACHE_SECONDS:
+                    _sheet_sync_kick(profiles=True)
+                st.session_state["_profiles_cache_df"] = _pf.copy()
+                st.session_state["_profiles_cache_ts"] = time.time()
+                st.session_state["_profiles_cache_ok"] = True
+                st.session_state["_profiles_cache_err"] = ""
+                return _pf.copy(), True, ""
+        except Exception:
+            pass
+
     try:
-        dfp = _conn_read_worksheet(PROFILES_WORKSHEET)
-        if dfp is None or dfp.empty:
-            dfp = pd.DataFrame(columns=PROFILES_COLUMNS)
-        for c in PROFILES_COLUMNS:
-            if c not in dfp.columns:
-                dfp[c] = None
-        dfp = dfp[PROFILES_COLUMNS].copy()
-        # limpa duplicados / vazios
-        dfp["Perfil"] = dfp["Perfil"].astype(str).str.strip()
-        dfp = dfp[dfp["Perfil"] != ""]
-        dfp = dfp.drop_duplicates(subset=["Perfil"], keep="last")
-        _save_offline_profiles(dfp)
+        dfp = _read_profiles_sheet()
+        _profiles_shared_set(dfp)
         try:
             st.session_state["_profiles_cache_df"] = dfp.copy()
             st.session_state["_profiles_cache_ts"] = time.time()
@@ -2212,6 +2540,7 @@ def save_profiles_df(dfp: pd.DataFrame):
     try:
         _conn_update_worksheet(dfp[PROFILES_COLUMNS], PROFILES_WORKSHEET)
         _save_offline_profiles(dfp[PROFILES_COLUMNS])
+        _profiles_shared_set(dfp)
         try:
             st.session_state["_profiles_cache_df"] = dfp[PROFILES_COLUMNS].copy()
             st.session_state["_profiles_cache_ts"] = time.time()
@@ -2240,31 +2569,260 @@ def get_plan_id_for_profile(perfil: str, dfp: pd.DataFrame):
                 return pid
     return "Base"
 
-def _retry(fn, tries=3):
+# --- Governor de quota do Google Sheets (token bucket partilhado por todas as sessões) ---
+GS_PRIO_WRITE = 0       # gravações de treinos/perfis
+GS_PRIO_READ = 1        # leituras de que a sessão está à espera (arranque, perfis, refresh manual)
+GS_PRIO_BACKGROUND = 2  # pulls do worker de sincronização
+_GS_PRIO_FLOOR = {GS_PRIO_WRITE: 0.0, GS_PRIO_READ: 4.0, GS_PRIO_BACKGROUND: float(SHEETS_WRITE_RESERVE)}
+_GS_PRIO_MAX_WAIT = {GS_PRIO_WRITE: 20.0, GS_PRIO_READ: 6.0, GS_PRIO_BACKGROUND: 0.0}
+_GS_THROTTLED_TAG = "RATE_LIMIT (local)"
+_GS_CTX = threading.local()
+
+@st.cache_resource(show_spinner=False)
+def _sheets_governor() -> dict:
+    cap = float(SHEETS_QUOTA_PER_MIN)
+    return {
+        "cond": threading.Condition(),
+        "capacity": cap,
+        "tokens": cap,
+        "ts": time.time(),
+        "blocked_until": 0.0,
+        "strikes": 0,
+        "waiting": {GS_PRIO_WRITE: 0, GS_PRIO_READ: 0, GS_PRIO_BACKGROUND: 0},
+        "calls": 0,
+        "rate_limited": 0,
+        "rejected": 0,
+    }
+
+def _gs_refill(gov: dict, now: float) -> None:
+    gov["tokens"] = min(gov["capacity"], gov["tokens"] + (now - gov["ts"]) * gov["capacity"] / 60.0)
+    gov["ts"] = now
+
+def _gs_wait_hint(gov: dict, prio: int, now: float) -> float:
+    missing = _GS_PRIO_FLOOR[prio] + 1.0 - gov["tokens"]
+    by_tokens = max(0.0, missing) * 60.0 / max(gov["capacity"], 1.0)
+    return max(by_tokens, gov["blocked_until"] - now, 0.0)
+
+def _gs_acquire(prio: int) -> None:
+    """Espera por um token. Gravações podem gastar o balde todo; leituras deixam reserva
+    e as de background nunca esperam nem passam à frente de quem está na fila com prioridade maior.
+    """
+    gov = _sheets_governor()
+    deadline = time.time() + _GS_PRIO_MAX_WAIT[prio]
+    with gov["cond"]:
+        gov["waiting"][prio] += 1
+        try:
+            while True:
+                now = time.time()
+                _gs_refill(gov, now)
+                ahead = any(n > 0 for p, n in gov["waiting"].items() if p < prio)
+                if (not ahead) and now >= gov["blocked_until"] and gov["tokens"] - 1.0 >= _GS_PRIO_FLOOR[prio]:
+                    gov["tokens"] -= 1.0
+                    gov["calls"] += 1
+                    return
+                wait_s = _gs_wait_hint(gov, prio, now)
+                if now + wait_s > deadline or (ahead and now >= deadline):
+                    gov["rejected"] += 1
+                    raise RuntimeError(f"{_GS_THROTTLED_TAG}: quota do Google Sheets esgotada, nova tentativa em ~{max(1, int(wait_s + 0.5))}s.")
+                gov["cond"].wait(timeout=max(0.05, min(wait_s or 0.25, deadline - now)))
+        finally:
+            gov["waiting"][prio] -= 1
+            gov["cond"].notify_all()
+
+def _gs_error_info(e) -> tuple:
+    """(é rate limit?, retry-after em segundos ou None) a partir de um erro gspread/HTTP."""
+    txt = str(e)
+    resp = getattr(e, "response", None)
+    status = getattr(resp, "status_code", None)
+    retry_after = None
+    try:
+        headers = getattr(resp, "headers", None) or {}
+        ra = headers.get("Retry-After") if hasattr(headers, "get") else None
+        if ra is not None:
+            retry_after = float(ra)
+    except Exception:
+        retry_after = None
+    if retry_after is None:
+        m = re.search(r"retry[ _-]?(?:after|delay)\D{0,6}(\d+(?:\.\d+)?)", txt, flags=re.IGNORECASE)
+        if m:
+            retry_after = float(m.group(1))
+    up = txt.upper()
+    rate = (status == 429) or ("429" in txt) or ("RATE_LIMIT" in up) or ("QUOTA EXCEEDED" in up) or ("RESOURCE_EXHAUSTED" in up)
+    return bool(rate), retry_after
+
+def _gs_is_throttled(e) -> bool:
+    return _gs_error_info(e)[0]
+
+def _gs_note_rate_limit(retry_after=None) -> None:
+    """429 recebido: esvazia o balde e pausa todas as sessões até ao retry hint (ou backoff exponencial)."""
+    gov = _sheets_governor()
+    with gov["cond"]:
+        now = time.time()
+        if now - gov["blocked_until"] > 60:
+            gov["strikes"] = 0
+        gov["strikes"] += 1
+        pause = float(retry_after) if retry_after else min(60.0, 5.0 * (2 ** (gov["strikes"] - 1)))
+        gov["blocked_until"] = max(gov["blocked_until"], now + pause)
+        gov["tokens"] = 0.0
+        gov["ts"] = now
+        gov["rate_limited"] += 1
+        gov["cond"].notify_all()
+
+# --- Circuit breaker (closed -> open -> half_open -> closed), partilhado pelo processo ---
+_GS_CIRCUIT_TAG = "CIRCUIT_OPEN"
+
+@st.cache_resource(show_spinner=False)
+def _sheets_breaker() -> dict:
+    return {
+        "lock": threading.Lock(),
+        "state": "closed",
+        "failures": 0,
+        "cooldown": float(SHEETS_BREAKER_COOLDOWN_S),
+        "retry_at": 0.0,
+        "probe_since": 0.0,
+        "last_error": "",
+        "opened": 0,
+    }
+
+def _gs_is_outage(e) -> bool:
+    """Sheets inacessível (rede, timeout, 5xx). Respostas 4xx / worksheet inexistente provam que responde."""
+    if isinstance(e, (ConnectionError, TimeoutError, OSError)):
+        return True
+    status = getattr(getattr(e, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status >= 500
+    name = type(e).__name__
+    if "NotFound" in name or "Permission" in name:
+        return False
+    txt = str(e).lower()
+    return any(k in txt for k in ("timed out", "timeout", "connection", "max retries", "name resolution", "unavailable", "transporterror", " 50"))
+
+def _gs_circuit_refused(e) -> bool:
+    return str(e).startswith(_GS_CIRCUIT_TAG)
+
+def _gs_breaker_allow() -> bool:
+    """Circuito fechado deixa passar. Aberto recusa logo (sem sleeps); depois do cooldown só o worker
+    de sincronização faz a sonda half-open, para nenhuma sessão pagar a latência do teste.
+    """
+    br = _sheets_breaker()
+    with br["lock"]:
+        if br["state"] == "closed":
+            return True
+        now = time.time()
+        if not getattr(_GS_CTX, "worker", False) or now < br["retry_at"]:
+            return False
+        if br["state"] == "half_open" and now - br["probe_since"] < 30:
+            return False  # já há uma sonda em curso
+        br["state"] = "half_open"
+        br["probe_since"] = now
+        return True
+
+def _gs_breaker_record(ok: bool, err: str = "") -> None:
+    br = _sheets_breaker()
+    with br["lock"]:
+        now = time.time()
+        if ok:
+            br["state"] = "closed"
+            br["failures"] = 0
+            br["cooldown"] = float(SHEETS_BREAKER_COOLDOWN_S)
+            return
+        br["last_error"] = str(err or "")[:300]
+        br["failures"] += 1
+        if br["state"] == "half_open":
+            br["cooldown"] = min(float(SHEETS_BREAKER_MAX_COOLDOWN_S), br["cooldown"] * 2)
+        elif br["state"] == "open" or br["failures"] < SHEETS_BREAKER_FAILURES:
+            return
+        else:
+            br["opened"] += 1
+        br["state"] = "open"
+        br["retry_at"] = now + br["cooldown"]
+
+def _gs_breaker_probe_due() -> bool:
+    br = _sheets_breaker()
+    with br["lock"]:
+        return br["state"] != "closed" and time.time() >= br["retry_at"]
+
+def sheets_circuit_status() -> dict:
+    br = _sheets_breaker()
+    with br["lock"]:
+        return {
+            "state": br["state"],
+            "retry_in_s": max(0.0, br["retry_at"] - time.time()) if br["state"] != "closed" else 0.0,
+            "failures": int(br["failures"]),
+            "opened": int(br["opened"]),
+            "last_error": br["last_error"],
+        }
+
+def _gs_current_priority() -> int:
+    return getattr(_GS_CTX, "prio", GS_PRIO_READ)
+
+@contextlib.contextmanager
+def _gs_priority(prio: int):
+    """Prioridade por omissão das chamadas feitas nesta thread (o worker usa WRITE/BACKGROUND)."""
+    prev = getattr(_GS_CTX, "prio", None)
+    _GS_CTX.prio = prio
+    try:
+        yield
+    finally:
+        _GS_CTX.prio = prev if prev is not None else GS_PRIO_READ
+
+def _gs_call(fn, tries: int = 1, prio: int | None = None):
+    """Executa uma chamada à API do Google Sheets debaixo do governor de quota.
+    429 -> pausa global respeitando o retry hint; outros erros -> backoff simples.
+    """
+    prio = _gs_current_priority() if prio is None else prio
     last = None
-    for i in range(tries):
+    for i in range(max(1, int(tries))):
+        if not _gs_breaker_allow():
+            raise RuntimeError(f"{_GS_CIRCUIT_TAG}: Google Sheets inacessível (modo offline), nova verificação em ~{int(sheets_circuit_status()['retry_in_s']) + 1}s.")
+        _gs_acquire(prio)
         try:
-            return fn()
+            out = fn()
         except Exception as e:
             last = e
-            # backoff simples (rate limit / falhas transitórias)
-            time.sleep(0.6 * (2 ** i))
+            rate, retry_after = _gs_error_info(e)
+            if rate:
+                _gs_breaker_record(True)
+                _gs_note_rate_limit(retry_after)  # a próxima aquisição espera pela pausa (ou desiste)
+            elif _gs_is_outage(e):
+                _gs_breaker_record(False, str(e))
+                if sheets_circuit_status()["state"] != "closed":
+                    break  # circuito aberto: devolve já, sem mais tentativas nem sleeps
+                if i < tries - 1:
+                    time.sleep(0.6 * (2 ** i))
+            else:
+                _gs_breaker_record(True)
+                if i < tries - 1:
+                    time.sleep(0.6 * (2 ** i))
+            continue
+        _gs_breaker_record(True)
+        return out
     raise last
 
-def safe_read_sheet() -> pd.DataFrame:
-    try:
-        df = _retry(lambda: conn.read(ttl="0"), tries=2)
-        if df is None or df.empty:
-            return pd.DataFrame(columns=SCHEMA_COLUMNS)
-        return df
-    except Exception:
-        # fallback offline (evita app morrer)
-        return _load_offline_backup()
+def sheets_quota_status() -> dict:
+    """Orçamento restante para a UI avisar de throttling em vez de parecer pendurada."""
+    gov = _sheets_governor()
+    with gov["cond"]:
+        now = time.time()
+        _gs_refill(gov, now)
+        blocked_s = max(0.0, gov["blocked_until"] - now)
+        return {
+            "tokens": int(gov["tokens"]),
+            "capacity": int(gov["capacity"]),
+            "blocked_s": blocked_s,
+            "throttled": blocked_s > 0 or gov["tokens"] < float(SHEETS_WRITE_RESERVE),
+            "calls": gov["calls"],
+            "rate_limited": gov["rate_limited"],
+            "rejected": gov["rejected"],
+        }
+
+def _retry(fn, tries=3, prio=None):
+    return _gs_call(fn, tries=tries, prio=prio)
 
 def safe_update_sheet(df: pd.DataFrame):
     # tenta gravar na Sheet; se falhar, guarda backup local e devolve erro
     try:
-        _retry(lambda: conn.update(data=normalize_for_save(df)), tries=2)
+        _retry(lambda: conn.update(data=normalize_for_save(df)), tries=2, prio=GS_PRIO_WRITE)
         # espelha também localmente para não perder histórico se a Sheet cair depois
         _save_offline_backup(normalize_for_save(df))
         return True, ""
@@ -2284,11 +2842,222 @@ def _cell_to_gsheet(v):
         return "TRUE" if v else "FALSE"
     return str(v)
 
-def _gsheets_cfg():
-    try:
-        return st.secrets.get("connections", {}).get("gsheets", {})
+@st.cache_resource(show_spinner=False)
+def _gs_handle_pool(source_key: str) -> dict:
+    """Handles gspread partilhados pelo processo: a folha é aberta e o header validado uma vez,
+    não uma vez por sessão do browser.
+    """
+    return {"lock": threading.RLock(), "ws": None, "header": None, "schema": None, "opened": 0}
+
+def _gs_pool() -> dict:
+    return _gs_handle_pool(_history_source_key())
+
+def _gs_worksheet():
+    """Worksheet gspread do histórico (handle do pool do processo).
+    Reutilizada entre sessões para reduzir reads (quota do Google Sheets é baixa).
+    """
+    pool = _gs_pool()
+    with pool["lock"]:
+        if pool["ws"] is not None:
+            return pool["ws"]
+
+    # abrir a folha pode esperar pelo governor / retries: fora do lock, para não prender as outras sessões
+    client = getattr(conn, "_client", None)
+    if client is None:
+        client = getattr(getattr(conn, "client", None), "_client", None)
+    if client is None:
+        raise RuntimeError("Não foi possível obter cliente gspread (append).")
+
+    cfg = _gsheets_cfg()
+    spreadsheet = cfg.get("spreadsheet") or cfg.get("spreadsheet_url") or cfg.get("url")
+    worksheet = cfg.get("worksheet")
+
+    if not spreadsheet:
+        raise RuntimeError("Configuração gsheets sem 'spreadsheet' (URL ou key).")
+
+    sh = _gs_call(lambda: client.open_by_url(spreadsheet) if "http" in str(spreadsheet) else client.open_by_key(str(spreadsheet)))
+    ws = _gs_call(lambda: sh.worksheet(worksheet) if worksheet else sh.sheet1)
+    with pool["lock"]:
+        if pool["ws"] is None:  # outra thread pode ter aberto entretanto: fica o primeiro handle
+            pool["ws"] = ws
+            pool["opened"] += 1
+        return pool["ws"]
+
+def _gs_forget_worksheet():
+    try:
+        pool = _gs_pool()
+        with pool["lock"]:
+            pool["ws"] = None
+            pool["header"] = None
     except Exception:
-        return {}
+        pass
+
+def _gs_note_header(header: list) -> None:
+    """Header visto numa leitura: se já cobre o schema, o próximo append não precisa de o reler."""
+    header_clean = [h for h in (str(x).strip() for x in header) if h != ""]
+    pool = _gs_pool()
+    with pool["lock"]:
+        if header_clean and all(c in header_clean for c in SCHEMA_COLUMNS):
+            pool["header"] = header_clean
+            pool["schema"] = tuple(SCHEMA_COLUMNS)
+        else:
+            pool["header"] = None
+
+def _gs_sheet_header(ws) -> list:
+    """Header da sheet garantido/migrado para o schema atual (validado uma vez por processo;
+    volta a validar quando SCHEMA_COLUMNS muda ou o handle é descartado).
+    """
+    pool = _gs_pool()
+    schema = tuple(SCHEMA_COLUMNS)
+    with pool["lock"]:
+        if pool["header"] and pool["schema"] == schema:
+            return list(pool["header"])
+
+    # chamadas à API fora do lock (a migração é idempotente: duas threads escrevem o mesmo header)
+    header = [str(x).strip() for x in _gs_call(lambda: ws.row_values(1))]
+    if not header:
+        _gs_call(lambda: ws.update("A1", [SCHEMA_COLUMNS]), prio=GS_PRIO_WRITE)
+        header_clean = list(SCHEMA_COLUMNS)
+    else:
+        # Migração automática do header sem perder colunas antigas
+        header_clean = [h for h in header if str(h).strip() != ""]
+        missing = [c for c in SCHEMA_COLUMNS if c not in header_clean]
+        if missing:
+            header_clean = header_clean + missing
+            _gs_call(lambda: ws.update("A1", [header_clean]), prio=GS_PRIO_WRITE)
+    with pool["lock"]:
+        if not (pool["header"] and pool["schema"] == schema):
+            pool["header"] = header_clean
+            pool["schema"] = schema
+        return list(pool["header"])
+
+def _a1_col(n: int) -> str:
+    out = ""
+    n = int(n)
+    while n > 0:
+        n, r = divmod(n - 1, 26)
+        out = chr(65 + r) + out
+    return out
+
+def _sheet_values_trim(row, width: int | None = None) -> list:
+    vals = ["" if x is None else str(x) for x in list(row or [])]
+    if width is not None:
+        vals = vals[:width]
+    while vals and vals[-1].strip() == "":
+        vals.pop()
+    return vals
+
+def _sheet_rows_to_df(header: list, rows: list) -> pd.DataFrame:
+    """Valores crus da API (listas de strings, ragged) -> DataFrame com o header da sheet."""
+    width = len(header)
+    data = []
+    for r in rows:
+        vals = _sheet_values_trim(r, width)
+        if not vals:
+            continue  # linha vazia no meio da sheet
+        data.append(vals + [""] * (width - len(vals)))
+    df = pd.DataFrame(data, columns=header)
+    return df.loc[:, ~df.columns.duplicated()]
+
+def _gs_next_free_row(ws, header: list) -> tuple:
+    """(primeira linha livre no fim da worksheet, Row_IDs das linhas que podem ter entrado desde o último pull).
+    Parte da contagem conhecida do último pull e lê só o que veio depois (custo = linhas novas);
+    sem pista válida, cai para a coluna A inteira (e a coluna Row_ID inteira).
+    """
+    width = max(1, len(header))
+    last_col = _a1_col(width)
+    rid_ix = header.index("Row_ID") if "Row_ID" in header else None
+    try:
+        hint = int((_store_meta_get(_sheet_state_key()) or {}).get("rows", 0) or 0)
+    except Exception:
+        hint = 0
+    if hint > 0:
+        got = _gs_call(lambda: ws.batch_get([f"A{hint + 1}:{last_col}"]))
+        vals = list(got[0] or []) if got else []
+        if vals and _sheet_values_trim(vals[0]):
+            ids = {str(v[rid_ix]).strip() for v in vals if rid_ix is not None and len(v) > rid_ix}
+            return hint + 1 + len(vals), ids - {""}
+    start = len(_gs_call(lambda: ws.col_values(1))) + 1
+    ids = set(_gs_call(lambda: ws.col_values(rid_ix + 1))[1:]) if rid_ix is not None else set()
+    return start, {str(x).strip() for x in ids} - {""}
+
+def _read_sheet_full_values():
+    """Leitura completa via gspread; devolve (df, estado) com a contagem física de linhas."""
+    ws = _gs_worksheet()
+    values = _gs_call(lambda: ws.get_all_values())
+    header = [str(x).strip() for x in (values[0] if values else [])]
+    rows = values[1:]
+    _gs_note_header(header)
+    state = {
+        "header": header,
+        "rows": len(rows),
+        "tail": _sheet_values_trim(rows[-1], len(header)) if rows else [],
+        "delta_errors": 0,
+    }
+    return _sheet_rows_to_df(header, rows), state
+
+def _read_sheet_delta(state: dict):
+    """Lê só as linhas depois da última já ingerida (um único batch_get).
+    Devolve (df_novas, estado) ou None quando é preciso leitura completa
+    (header mudou ou a sheet encolheu/foi reescrita: a âncora já não bate certo).
+    """
+    header = list(state.get("header") or [])
+    n = int(state.get("rows", 0) or 0)
+    if not header:
+        return None
+    ws = _gs_worksheet()
+    last_col = _a1_col(len(header))
+    ranges = ["1:1", f"A{n + 2}:{last_col}"]
+    if n > 0:
+        ranges.append(f"A{n + 1}:{last_col}{n + 1}")
+    got = _gs_call(lambda: ws.batch_get(ranges))
+
+    hdr = [str(x).strip() for x in (got[0][0] if got[0] else [])]
+    _gs_note_header(hdr)
+    if _sheet_values_trim(hdr) != _sheet_values_trim(header):
+        return None
+    if n > 0:
+        anchor = got[2][0] if got[2] else []
+        if _sheet_values_trim(anchor, len(header)) != list(state.get("tail") or []):
+            return None
+
+    new_rows = list(got[1] or [])
+    new_state = dict(state)
+    new_state["delta_errors"] = 0
+    if new_rows:
+        new_state["rows"] = n + len(new_rows)
+        new_state["tail"] = _sheet_values_trim(new_rows[-1], len(header))
+    return _sheet_rows_to_df(header, new_rows), new_state
+
+def _load_history_from_sheet(sheet_state: dict | None, full: bool = False):
+    """Devolve (df_normalizado, estado_da_sheet, is_delta). Levanta se a Sheet não responder.
+    Em modo incremental só as linhas novas são lidas; se algo não bater certo faz leitura completa.
+    """
+    if DATA_INCREMENTAL_READS:
+        if sheet_state and not full and int(sheet_state.get("delta_errors", 0) or 0) < 2:
+            try:
+                delta = _read_sheet_delta(sheet_state)
+                if delta is not None:
+                    return _normalize_history_frame(delta[0]), delta[1], True
+            except Exception as e:
+                if _gs_is_throttled(e) or _gs_circuit_refused(e):
+                    raise  # sem quota / offline: não conta como falha do delta (não escala para leitura completa)
+                # falha transitória: mantém a cache atual e tenta de novo na próxima expiração
+                _gs_forget_worksheet()
+                kept = dict(sheet_state)
+                kept["delta_errors"] = int(kept.get("delta_errors", 0) or 0) + 1
+                return pd.DataFrame(columns=SCHEMA_COLUMNS), kept, True
+        try:
+            raw, state = _read_sheet_full_values()
+            return _normalize_history_frame(raw), state, False
+        except Exception as e:
+            if _gs_is_throttled(e) or _gs_circuit_refused(e):
+                raise
+            _gs_forget_worksheet()
+    df = _retry(lambda: conn.read(ttl="0"), tries=2)
+    if df is None or df.empty:
+        df = pd.DataFrame(columns=SCHEMA_COLUMNS)
+    return _normalize_history_frame(df), None, False
 
 def _append_offline_backup_rows(df: pd.DataFrame, file_name: str = "offline_backup.csv"):
     try:
@@ -2299,27 +3068,31 @@ def _append_offline_backup_rows(df: pd.DataFrame, file_name: str = "offline_back
         pass
 
 def try_sync_offline_backup_to_sheet():
-    """Tenta sincronizar linhas do backup local para a Google Sheet (append)."""
-    if not os.path.exists(BACKUP_PATH):
-        return False, "Sem backup local.", 0
+    """Importa o offline_backup.csv (gravações que falharam sem store local, ou legado) para o outbox.
+    Só entram linhas que o store ainda não tem; o worker envia depois apenas a cauda por sincronizar.
+    Corre no worker de sincronização. O ficheiro passa primeiro para .importing (linhas gravadas entretanto
+    vão para um CSV novo) e só vira .imported depois de importado; se falhar, fica para a volta seguinte.
+    """
+    importing = BACKUP_PATH + ".importing"
     try:
-        dfb = pd.read_csv(BACKUP_PATH, dtype=str, keep_default_na=False)
+        if not os.path.exists(importing):
+            if not os.path.exists(BACKUP_PATH):
+                return False, "Sem backup local.", 0
+            os.replace(BACKUP_PATH, importing)
+        dfb = pd.read_csv(importing, dtype=str, keep_default_na=False)
     except Exception as e:
         return False, str(e), 0
-    if dfb is None or dfb.empty:
-        return False, "Backup vazio.", 0
-    for c in SCHEMA_COLUMNS:
-        if c not in dfb.columns:
-            dfb[c] = None
-    dfb = dfb[SCHEMA_COLUMNS]
-    ok, err = safe_append_rows(dfb)
-    if ok:
+    n = 0
+    if dfb is not None and not dfb.empty:
         try:
-            os.remove(BACKUP_PATH)
-        except Exception:
-            pass
-        return True, "", len(dfb)
-    return False, err, len(dfb)
+            n = len(_store_insert_local(_normalize_history_frame(dfb), dedupe=True))
+        except Exception as e:
+            return False, str(e), 0
+    try:
+        os.replace(importing, BACKUP_PATH + ".imported")
+    except Exception:
+        pass
+    return True, "", n
 
 
 def _is_lower_exercise(ex_name: str) -> bool:
@@ -2713,177 +3486,980 @@ def _apply_prefill_payload_if_any(i: int):
         pass
 
 
-def safe_append_rows(df_rows: pd.DataFrame):
+def safe_append_rows(df_rows: pd.DataFrame, mirror: bool = False):
     """Append (seguro para uso simultâneo) em vez de reescrever a sheet inteira.
     Se falhar, grava em offline_backup.csv.
     - Faz retry automático (erros transitórios / quota).
     - Garante/migra header da sheet para o schema atual.
+    - mirror=True (envio do outbox): sem backup CSV nem reescrita completa; o outbox garante a entrega.
     """
     df_rows = normalize_for_save(df_rows)
 
-    def _get_ws():
-        # Reutiliza worksheet em sessão para reduzir reads (quota do Google Sheets é baixa)
+    try:
+        ws = _gs_worksheet()
+        header = _gs_sheet_header(ws)
+
+        rows_to_append = []
+        for _, r in df_rows.iterrows():
+            rows_to_append.append([_cell_to_gsheet(r.get(col, "")) for col in header])
+
+        # Uma só tentativa: repetir um append ambíguo (timeout com o ack perdido) duplicaria linhas.
+        # No envio do outbox o worker tenta de novo depois de puxar a Sheet; aqui o fallback abaixo
+        # confirma pelo Row_ID o que já entrou.
+        def _append():
+            if hasattr(ws, "append_rows"):
+                ws.append_rows(rows_to_append, value_input_option="RAW")
+            else:
+                for values in rows_to_append:
+                    ws.append_row(values, value_input_option="RAW")
+
+        _gs_call(_append, tries=1, prio=GS_PRIO_WRITE)
+        return True, ""
+    except Exception as e:
+        throttled = _gs_is_throttled(e) or _gs_circuit_refused(e)
+        if not throttled:
+            _gs_forget_worksheet()
+        if mirror:
+            return False, str(e)
+        if throttled:
+            # nunca perder treino; sem quota / offline, o fallback só gastaria mais pedidos
+            _append_offline_backup_rows(df_rows)
+            return False, str(e)
+
+        # Fallback final com custo limitado às linhas novas: sonda a próxima linha livre e escreve
+        # só esse intervalo (nunca reescreve a sheet inteira, que apagaria appends de outras sessões).
+        # O append pode ter entrado mesmo tendo falhado (ack perdido): linhas cujo Row_ID já lá está
+        # não se escrevem de novo.
         try:
-            ws_cached = st.session_state.get("_gs_ws_cache")
-            if ws_cached is not None:
-                return ws_cached
+            ws = _gs_worksheet()
+            header = _gs_sheet_header(ws)
+            start, ja_na_sheet = _gs_next_free_row(ws, header)
+            rid = df_rows["Row_ID"].astype(str).str.strip() if "Row_ID" in df_rows.columns else pd.Series("", index=df_rows.index)
+            falta = df_rows[~(rid.ne("") & rid.isin(ja_na_sheet))]
+            rows_to_write = [[_cell_to_gsheet(r.get(col, "")) for col in header] for _, r in falta.iterrows()]
+            if rows_to_write:
+                _gs_call(lambda: ws.update(f"A{start}", rows_to_write, value_input_option="RAW"), prio=GS_PRIO_WRITE)
+            return True, ""
         except Exception:
-            pass
+            _gs_forget_worksheet()
 
-        client = getattr(conn, "_client", None)
-        if client is None:
-            client = getattr(getattr(conn, "client", None), "_client", None)
-        if client is None:
-            raise RuntimeError("Não foi possível obter cliente gspread (append).")
+        # nunca perder treino (só as linhas que não chegaram à Sheet por nenhum dos caminhos)
+        _append_offline_backup_rows(df_rows)
+        return False, str(e)
 
-        cfg = _gsheets_cfg()
-        spreadsheet = cfg.get("spreadsheet") or cfg.get("spreadsheet_url") or cfg.get("url")
-        worksheet = cfg.get("worksheet")
 
-        if not spreadsheet:
-            raise RuntimeError("Configuração gsheets sem 'spreadsheet' (URL ou key).")
+def _to_bool(x):
+    s = str(x).strip().lower()
+    return s in ["true","1","yes","y","sim"]
 
-        sh = client.open_by_url(spreadsheet) if "http" in str(spreadsheet) else client.open_by_key(str(spreadsheet))
-        ws = sh.worksheet(worksheet) if worksheet else sh.sheet1
-        try:
-            st.session_state["_gs_ws_cache"] = ws
-        except Exception:
-            pass
-        return ws
+def _history_source_key() -> str:
+    cfg = _gsheets_cfg()
+    spreadsheet = cfg.get("spreadsheet") or cfg.get("spreadsheet_url") or cfg.get("url") or ""
+    return f"{spreadsheet}||{cfg.get('worksheet') or ''}"
 
-    def _ensure_header_schema(ws):
-        try:
-            cached_header = st.session_state.get("_gs_header_cache")
-            if isinstance(cached_header, list) and cached_header:
-                return cached_header
-        except Exception:
-            pass
 
-        header = [str(x).strip() for x in ws.row_values(1)]
-        if not header:
-            ws.update("A1", [SCHEMA_COLUMNS])
-            try:
-                st.session_state["_gs_header_cache"] = list(SCHEMA_COLUMNS)
-            except Exception:
-                pass
-            return list(SCHEMA_COLUMNS)
+# --- 4.0 STORE LOCAL (SQLite) ---
+# Fonte de verdade do histórico: cada rerun lê do disco local.
+# A Google Sheet passa a ser um espelho: as linhas novas saem por um outbox (em background)
+# e as linhas escritas por outros (ou à mão na Sheet) são puxadas por delta.
+# _sig = chave de idempotência da linha (Row_ID; linhas antigas sem Row_ID usam hash do conteúdo).
+_STORE_META_COLUMNS = ["_data_iso", "_origem", "_sheet_seen", "_sig"]
+
+
+def _sql_ident(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
 
-        # Migração automática do header sem perder colunas antigas
-        header_clean = [h for h in header if str(h).strip() != ""]
-        missing = [c for c in SCHEMA_COLUMNS if c not in header_clean]
-        if missing:
-            merged = header_clean + missing
-            ws.update("A1", [merged])
-            try:
-                st.session_state["_gs_header_cache"] = merged
-            except Exception:
-                pass
-            return merged
-        try:
-            st.session_state["_gs_header_cache"] = header_clean
-        except Exception:
-            pass
-        return header_clean
 
+def _store_init_schema(con) -> None:
+    cols_sql = ", ".join(f"{_sql_ident(c)} TEXT" for c in SCHEMA_COLUMNS)
+    con.execute(
+        f"CREATE TABLE IF NOT EXISTS treinos (seq INTEGER PRIMARY KEY AUTOINCREMENT, {cols_sql}, "
+        "_data_iso TEXT, _origem TEXT NOT NULL DEFAULT 'sheet', "
+        "_sheet_seen INTEGER NOT NULL DEFAULT 1, _sig TEXT)"
+    )
+    # migração: colunas novas do schema entram como TEXT vazio
+    have = {str(r[1]) for r in con.execute("PRAGMA table_info(treinos)").fetchall()}
+    for c in SCHEMA_COLUMNS:
+        if c not in have:
+            con.execute(f"ALTER TABLE treinos ADD COLUMN {_sql_ident(c)} TEXT DEFAULT ''")
+    con.execute(
+        f"CREATE INDEX IF NOT EXISTS ix_treinos_perfil_ex_data ON treinos "
+        f"({_sql_ident('Perfil')}, {_sql_ident('Exercício_Key')}, _data_iso)"
+    )
+    con.execute("CREATE INDEX IF NOT EXISTS ix_treinos_sig ON treinos (_sig)")
+    con.execute("CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT)")
+
+    # outbox: fila ordenada das linhas locais para a Sheet; tudo até à watermark já foi enviado
+    has_outbox = con.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'outbox'").fetchone()
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS outbox (seq INTEGER PRIMARY KEY AUTOINCREMENT, row_key TEXT NOT NULL UNIQUE, "
+        "treino_seq INTEGER NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, err TEXT NOT NULL DEFAULT '')"
+    )
+    if not has_outbox and "_mirrored" in have:
+        # store antigo (flag _mirrored por linha): o que estava por espelhar passa para o outbox
+        con.execute(
+            "INSERT OR IGNORE INTO outbox (row_key, treino_seq) "
+            "SELECT _sig, seq FROM treinos WHERE _origem = 'local' AND _mirrored = 0 ORDER BY seq"
+        )
+    con.commit()
+
+
+@st.cache_resource(show_spinner=False)
+def _local_store(path: str) -> dict:
+    """Ligação SQLite partilhada pelo processo (todas as sessões + worker de sincronização)."""
     try:
-        ws = _get_ws()
-        header = _ensure_header_schema(ws)
+        con = sqlite3.connect(path, check_same_thread=False, timeout=10.0)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        _store_init_schema(con)
+    except Exception:
+        # disco sem escrita: store em memória (reconstruído a partir da Sheet em cada arranque)
+        con = sqlite3.connect(":memory:", check_same_thread=False)
+        _store_init_schema(con)
+    return {
+        "con": con,
+        "lock": threading.RLock(),
+        "pull_lock": threading.RLock(),
+        "push_lock": threading.Lock(),
+        "version": 0,
+        "epoch": 0,
+    }
 
-        rows_to_append = []
-        for _, r in df_rows.iterrows():
-            rows_to_append.append([_cell_to_gsheet(r.get(col, "")) for col in header])
 
-        # Retry para erros transitórios (429 / 5xx / timeouts)
-        last_err = None
-        for attempt in range(3):
-            try:
-                if hasattr(ws, "append_rows"):
-                    ws.append_rows(rows_to_append, value_input_option="RAW")
-                else:
-                    for values in rows_to_append:
-                        ws.append_row(values, value_input_option="RAW")
-                _append_offline_backup_rows(df_rows)  # mantém backup local incremental
-                return True, ""
-            except Exception as e:
-                last_err = e
-                # pequeno backoff para quota/transitório
-                time.sleep(0.8 * (attempt + 1))
+def _store() -> dict:
+    return _local_store(LOCAL_STORE_PATH)
 
-        raise last_err if last_err else RuntimeError("Falha desconhecida ao fazer append.")
-    except Exception as e:
-        # nunca perder treino
-        _append_offline_backup_rows(df_rows)
+
+def _store_meta_get(key: str, default=None):
+    store = _store()
+    with store["lock"]:
+        row = store["con"].execute("SELECT v FROM meta WHERE k = ?", (key,)).fetchone()
+    if row is None:
+        return default
+    try:
+        return json.loads(row[0])
+    except Exception:
+        return default
+
+
+def _store_meta_set(key: str, value) -> None:
+    store = _store()
+    with store["lock"]:
+        store["con"].execute(
+            "INSERT INTO meta (k, v) VALUES (?, ?) ON CONFLICT(k) DO UPDATE SET v = excluded.v",
+            (key, json.dumps(value, ensure_ascii=False)),
+        )
+        store["con"].commit()
+
+
+def _sheet_rows_for_store(df: pd.DataFrame) -> pd.DataFrame:
+    """Linhas lidas da Sheet como lá estão: só checklist e listas normalizados (sem preencher datas)."""
+    d = df.copy()
+    for c in SCHEMA_COLUMNS:
+        if c not in d.columns:
+            d[c] = None
+    d = d[SCHEMA_COLUMNS].copy()
+    _normalize_cells_for_save(d)
+    for c in d.columns:
+        if d[c].isna().any():
+            d[c] = d[c].where(d[c].notna(), None)
+    return d
+
+
+def _store_rows(df: pd.DataFrame, from_sheet: bool = False) -> list:
+    """DataFrame -> tuplos (valores exatamente como vão para a Sheet) + data ISO + chave de idempotência.
+    from_sheet: valores já vindos da Sheet ficam como estão (data vazia/inválida -> _data_iso vazio)."""
+    if df is None or df.empty:
+        return []
+    d = _sheet_rows_for_store(df) if from_sheet else normalize_for_save(df)
+    iso = _parse_dates_dayfirst(d["Data"]).dt.strftime("%Y-%m-%d")
+    rid_ix = SCHEMA_COLUMNS.index("Row_ID")
+    out = []
+    for vals, day in zip(d.itertuples(index=False, name=None), iso.tolist()):
+        cells = [_cell_to_gsheet(v) for v in vals]
+        key = cells[rid_ix].strip() or hashlib.sha1("\x1f".join(cells).encode("utf-8")).hexdigest()
+        out.append((cells, day if isinstance(day, str) else "", key))
+    return out
+
+
+def _store_insert(rows: list, origem: str, seen: int) -> list:
+    store = _store()
+    cols = ", ".join(_sql_ident(c) for c in SCHEMA_COLUMNS + _STORE_META_COLUMNS)
+    marks = ", ".join("?" for _ in range(len(SCHEMA_COLUMNS) + len(_STORE_META_COLUMNS)))
+    seqs = []
+    with store["lock"]:
+        con = store["con"]
+        for cells, day, key in rows:
+            cur = con.execute(
+                f"INSERT INTO treinos ({cols}) VALUES ({marks})",
+                list(cells) + [day, origem, int(seen), key],
+            )
+            seqs.append(int(cur.lastrowid))
+        con.commit()
+        if seqs:
+            store["version"] += 1
+    return seqs
+
+
+def _store_insert_local(df_rows: pd.DataFrame, dedupe: bool = False) -> list:
+    """Commit local imediato de linhas gravadas nesta app + entrada no outbox.
+    dedupe=True ignora linhas cuja chave já existe no store ou se repete no lote (importações repetidas);
+    linhas legadas sem Row_ID (chave = hash do conteúdo, que muda com a formatação) também são
+    ignoradas se o store já tiver a mesma sessão: perfil, exercício, dia, pesos e reps.
+    """
+    store = _store()
+    rows = _store_rows(df_rows)
+    with store["lock"]:
+        con = store["con"]
+        if dedupe:
+            ix = {c: SCHEMA_COLUMNS.index(c) for c in ("Row_ID", "Perfil", "Exercício_Key", "Peso", "Reps")}
+            same_session = (
+                f"SELECT 1 FROM treinos WHERE {_sql_ident('Perfil')} = ? AND {_sql_ident('Exercício_Key')} = ? "
+                f"AND _data_iso = ? AND {_sql_ident('Peso')} = ? AND {_sql_ident('Reps')} = ? LIMIT 1"
+            )
+            seen, kept = set(), []
+            for cells, day, key in rows:
+                if key in seen or con.execute("SELECT 1 FROM treinos WHERE _sig = ? LIMIT 1", (key,)).fetchone() is not None:
+                    continue
+                if not cells[ix["Row_ID"]].strip() and day and con.execute(
+                    same_session, (cells[ix["Perfil"]], cells[ix["Exercício_Key"]], day, cells[ix["Peso"]], cells[ix["Reps"]])
+                ).fetchone() is not None:
+                    continue
+                seen.add(key)
+                kept.append((cells, day, key))
+            rows = kept
+        seqs = _store_insert(rows, "local", 0)
+        con.executemany(
+            "INSERT OR IGNORE INTO outbox (row_key, treino_seq) VALUES (?, ?)",
+            [(r[2], s) for r, s in zip(rows, seqs)],
+        )
+        con.commit()
+    return seqs
+
+
+def _store_ingest_sheet(df_sheet: pd.DataFrame, full: bool) -> int:
+    """Ingere linhas lidas da Sheet.
+    - linhas que esta app já enviou são reconhecidas pela chave (Row_ID) e não duplicam
+    - full: substitui tudo o que veio da Sheet; mantém as linhas locais ainda não vistas lá
+    """
+    store = _store()
+    rows = _store_rows(df_sheet, from_sheet=True)
+    with store["lock"]:
+        con = store["con"]
+        if full:
+            con.execute("DELETE FROM treinos WHERE _origem = 'sheet' OR _sheet_seen = 1")
+        fresh = []
+        for cells, day, key in rows:
+            hit = con.execute(
+                "SELECT seq FROM treinos WHERE _sig = ? AND _origem = 'local' AND _sheet_seen = 0 ORDER BY seq LIMIT 1",
+                (key,),
+            ).fetchone()
+            if hit is not None:
+                con.execute("UPDATE treinos SET _sheet_seen = 1 WHERE seq = ?", (int(hit[0]),))
+                continue
+            fresh.append((cells, day, key))
+        if full:
+            store["epoch"] += 1
+            store["version"] += 1
+        _store_insert(fresh, "sheet", 1)  # commit único (delete + insert)
+        con.commit()
+    return len(fresh)
+
+
+def _store_read_frame(after_seq: int = 0):
+    """Lê o histórico do store (só seq > after_seq). Devolve (df, max_seq, version, epoch), com a
+    versão e a época lidas sob o mesmo lock que as linhas (um pull completo não fica a meio)."""
+    store = _store()
+    cols = ", ".join(_sql_ident(c) for c in ["seq"] + SCHEMA_COLUMNS)
+    with store["lock"]:
+        version, epoch = store["version"], store["epoch"]
+        df = pd.read_sql_query(
+            f"SELECT {cols} FROM treinos WHERE seq > ? ORDER BY seq",
+            store["con"],
+            params=(int(after_seq),),
+        )
+    max_seq = int(df["seq"].max()) if not df.empty else int(after_seq)
+    return df[SCHEMA_COLUMNS], max_seq, version, epoch
+
+
+def _store_row_count() -> int:
+    store = _store()
+    with store["lock"]:
+        return int(store["con"].execute("SELECT COUNT(*) FROM treinos").fetchone()[0])
+
+
+def _outbox_watermark() -> int:
+    return int(_store_meta_get("outbox_synced_seq", 0) or 0)
+
+
+def _outbox_pending(limit: int = 500):
+    """Cauda por sincronizar do outbox (seq > watermark), por ordem.
+    Devolve (df_a_enviar, outbox_seqs, houve_falha): linhas cuja chave já está na Sheet (ack perdido,
+    eco já ingerido) ficam de fora do envio mas contam para avançar a watermark.
+    """
+    store = _store()
+    cols = ", ".join(f"t.{_sql_ident(c)}" for c in SCHEMA_COLUMNS)
+    with store["lock"]:
+        wm = _outbox_watermark()
+        ob = store["con"].execute(
+            "SELECT o.seq, o.row_key, t.seq, o.attempts FROM outbox o LEFT JOIN treinos t ON t.seq = o.treino_seq "
+            "WHERE o.seq > ? ORDER BY o.seq LIMIT ?",
+            (wm, int(limit)),
+        ).fetchall()
+        if not ob:
+            return pd.DataFrame(columns=SCHEMA_COLUMNS), [], False
+        keys = sorted({str(r[1]) for r in ob})
+        marks = ", ".join("?" for _ in keys)
+        # índice de hash (_sig) das linhas que já se sabe estarem na Sheet
+        in_sheet = {
+            str(r[0]) for r in store["con"].execute(
+                f"SELECT _sig FROM treinos WHERE _sheet_seen = 1 AND _sig IN ({marks})", keys
+            ).fetchall()
+        }
+        send_seqs = [int(r[2]) for r in ob if r[2] is not None and str(r[1]) not in in_sheet]
+        df = pd.DataFrame(columns=SCHEMA_COLUMNS)
+        if send_seqs:
+            marks = ", ".join("?" for _ in send_seqs)
+            df = pd.read_sql_query(
+                f"SELECT {cols} FROM treinos t WHERE t.seq IN ({marks}) ORDER BY t.seq",
+                store["con"],
+                params=send_seqs,
+            )
+    return df[SCHEMA_COLUMNS], [int(r[0]) for r in ob], any(int(r[3] or 0) > 0 for r in ob)
+
+
+def _outbox_advance(upto_seq: int) -> None:
+    store = _store()
+    with store["lock"]:
+        if int(upto_seq) > _outbox_watermark():
+            _store_meta_set("outbox_synced_seq", int(upto_seq))
+
+
+def _outbox_mark_failed(seqs: list, err: str) -> None:
+    if not seqs:
+        return
+    store = _store()
+    with store["lock"]:
+        store["con"].executemany(
+            "UPDATE outbox SET attempts = attempts + 1, err = ? WHERE seq = ?",
+            [(str(err or "")[:500], int(s)) for s in seqs],
+        )
+        store["con"].commit()
+
+
+def _outbox_pending_count() -> int:
+    store = _store()
+    with store["lock"]:
+        return int(store["con"].execute(
+            "SELECT COUNT(*) FROM outbox WHERE seq > ?", (_outbox_watermark(),)
+        ).fetchone()[0])
+
+
+def sheet_sync_status(perfil: str | None = None) -> dict:
+    """Estado do espelho para a UI (linhas gravadas nesta app):
+    pending = à espera do 1º envio, failed = envio falhou (o worker volta a tentar), synced = já na Sheet.
+    Com `perfil`, tudo (contagens e last_error) conta só as linhas desse perfil.
+    """
+    store = _store()
+    sql = (
+        "SELECT "
+        "COALESCE(SUM(CASE WHEN o.seq > ? AND o.attempts = 0 THEN 1 ELSE 0 END), 0), "
+        "COALESCE(SUM(CASE WHEN o.seq > ? AND o.attempts > 0 THEN 1 ELSE 0 END), 0), "
+        "COALESCE(SUM(CASE WHEN o.seq <= ? THEN 1 ELSE 0 END), 0) "
+        "FROM outbox o JOIN treinos t ON t.seq = o.treino_seq"
+    )
+    with store["lock"]:
+        wm = _outbox_watermark()
+        params = [wm, wm, wm]
+        if perfil is not None:
+            sql += f" WHERE t.{_sql_ident('Perfil')} = ?"
+            params.append(str(perfil))
+        pending, failed, synced = store["con"].execute(sql, params).fetchone()
+        last_err = ""
+        if failed:
+            # último erro das linhas deste perfil (o de outro perfil não aparece no aviso deste)
+            err_sql = (
+                "SELECT o.err FROM outbox o JOIN treinos t ON t.seq = o.treino_seq "
+                "WHERE o.seq > ? AND o.attempts > 0"
+            )
+            err_params = [wm]
+            if perfil is not None:
+                err_sql += f" AND t.{_sql_ident('Perfil')} = ?"
+                err_params.append(str(perfil))
+            row = store["con"].execute(err_sql + " ORDER BY o.seq DESC LIMIT 1", err_params).fetchone()
+            last_err = str(row[0] or "") if row else ""
+    return {"pending": int(pending), "failed": int(failed), "synced": int(synced), "last_error": last_err}
+
+
+def _sheet_state_key() -> str:
+    return f"sheet_state::{_history_source_key()}"
+
+
+def _sheet_pull(full: bool = False) -> int:
+    """Puxa da Sheet para o store (delta quando possível). Levanta se a Sheet falhar."""
+    store = _store()
+    with store["pull_lock"]:
+        state = None if full else _store_meta_get(_sheet_state_key())
+        df_new, state, is_delta = _load_history_from_sheet(state, full=full)
+        n = _store_ingest_sheet(df_new, full=not is_delta)
+        _store_meta_set(_sheet_state_key(), state)
+        _store_meta_set("bootstrapped", True)
+        return n
+
+
+def _sheet_push_pending() -> tuple:
+    """Envia a cauda por sincronizar do outbox, em lotes (um append_rows por lote). Devolve (ok, erro).
+    Idempotente: linhas cuja chave já está na Sheet não são reenviadas.
+    """
+    store = _store()
+    with store["push_lock"]:
+        while True:
+            df_rows, seqs, retried = _outbox_pending()
+            if not seqs:
+                return True, ""
+            if retried:
+                # a tentativa anterior falhou: o append pode ter entrado na mesma (ack perdido).
+                # Puxa o delta da Sheet primeiro para o índice de chaves saber o que já lá está.
+                try:
+                    _sheet_pull()
+                except Exception as e:
+                    _outbox_mark_failed(seqs, str(e))
+                    return False, str(e)
+                df_rows, seqs, _ = _outbox_pending()
+                if not seqs:
+                    return True, ""
+            if not df_rows.empty:
+                ok, err = safe_append_rows(df_rows, mirror=True)
+                if not ok:
+                    _outbox_mark_failed(seqs, err)
+                    return ok, err
+            _outbox_advance(max(seqs))
+
+
+def _store_bootstrap() -> None:
+    """Primeiro arranque com store vazio: importa o snapshot de arranque (e a Sheet em background)
+    ou, sem snapshot, a Sheet (bloqueante, uma vez) ou o backup offline."""
+    if _store_meta_get("bootstrapped", False):
+        return
+    store = _store()
+    with store["pull_lock"]:
+        if _store_meta_get("bootstrapped", False):
+            return
+        if _store_row_count() == 0 and _history_snapshot_seed():
+            # snapshot do disco serve já; a leitura completa da Sheet fica para o worker
+            _store_meta_set("bootstrapped", True)
+            _sheet_sync_kick(pull=True, now=True)
+            return
         try:
-            st.session_state.pop("_gs_ws_cache", None)
-            st.session_state.pop("_gs_header_cache", None)
+            _sheet_pull(full=True)
+            return
         except Exception:
             pass
+        if _store_row_count() == 0:
+            _store_ingest_sheet(_normalize_history_frame(_load_offline_backup()), full=True)
+        _store_meta_set("bootstrapped", True)
 
-        # Fallback final: tenta reescrever via conn.update (menos ideal para concorrência, mas evita bloqueio)
+
+def _sheet_sync_loop(worker: dict) -> None:
+    _GS_CTX.worker = True  # só esta thread faz a sonda half-open do circuit breaker
+    while True:
+        if worker["wake"].wait(timeout=SHEET_SYNC_INTERVAL_S):
+            # janela curta para agrupar gravações simultâneas de várias sessões
+            time.sleep(SHEET_SYNC_BATCH_WINDOW_S)
+        worker["wake"].clear()
+        _sheet_sync_step(worker)
+
+
+def _sheet_sync_step(worker: dict) -> None:
+    """Uma volta do worker: backup CSV -> outbox, envio do outbox, delta da Sheet, perfis, snapshot."""
+    if os.path.exists(BACKUP_PATH) or os.path.exists(BACKUP_PATH + ".importing"):
         try:
-            df_full = get_data()
-            df_final = pd.concat([df_full, df_rows], ignore_index=True)
-            conn.update(data=normalize_for_save(df_final))
-            return True, ""
-        except Exception:
-            pass
+            ok, err, _ = try_sync_offline_backup_to_sheet()
+            worker["last_backup_err"] = "" if ok else str(err or "")
+        except Exception as e:
+            worker["last_backup_err"] = str(e)
+    if _gs_breaker_probe_due():
+        worker["pull_wanted"] = True  # o pull serve de sonda; se passar, fecha o circuito
+    try:
+        if _outbox_pending_count() > 0:
+            with _gs_priority(GS_PRIO_WRITE):
+                ok, err = _sheet_push_pending()
+            worker["last_push_err"] = "" if ok else str(err or "")
+    except Exception as e:
+        worker["last_push_err"] = str(e)
+    if worker["pull_wanted"]:
+        worker["pull_wanted"] = False
+        try:
+            with _gs_priority(GS_PRIO_BACKGROUND):
+                _sheet_pull()
+            worker["last_pull_err"] = ""
+        except Exception as e:
+            worker["last_pull_err"] = str(e)
+        worker["last_pull"] = time.time()
+    if worker["profiles_wanted"]:
+        worker["profiles_wanted"] = False
+        try:
+            with _gs_priority(GS_PRIO_BACKGROUND):
+                _profiles_shared_set(_read_profiles_sheet())
+            worker["last_profiles_err"] = ""
+        except Exception as e:
+            worker["last_profiles_err"] = str(e)
+    try:
+        _history_snapshot_save(worker)
+    except Exception:
+        pass
 
-        return False, str(e)
 
+@st.cache_resource(show_spinner=False)
+def _sheet_sync_worker(source_key: str) -> dict:
+    """Thread única por processo: empurra linhas pendentes e puxa deltas da Sheet."""
+    worker = {
+        "wake": threading.Event(),
+        "pull_wanted": False,
+        "profiles_wanted": False,
+        "last_pull": time.time(),
+        "last_pull_err": "",
+        "last_push_err": "",
+        "last_profiles_err": "",
+        "last_backup_err": "",
+        "snapshot_key": None,
+        "snapshot_ts": 0.0,
+        "snapshot_lock": threading.Lock(),
+    }
+    t = threading.Thread(target=_sheet_sync_loop, args=(worker,), name="bc-sheet-sync", daemon=True)
+    t.start()
+    worker["thread"] = t
+    atexit.register(_history_snapshot_atexit, worker)
+    return worker
 
-def _to_bool(x):
-    s = str(x).strip().lower()
-    return s in ["true","1","yes","y","sim"]
 
-def get_data(force_refresh: bool = False):
-    """Lê a sheet e garante schema (migração RPE->RIR e Alongamento->Mobilidade).
-    Se a Google Sheet falhar, usa um backup local (offline_backup.csv).
-    Usa cache curta em sessão para reduzir quota de reads no Google Sheets.
-    """
+def _sheet_sync_kick(pull: bool = False, now: bool = False, profiles: bool = False) -> None:
+    """Acorda o worker (sem bloquear). pull=True pede um delta da Sheet se a última leitura expirou
+    (now=True: mesmo que não tenha expirado); profiles=True pede uma releitura dos perfis."""
     try:
-        if not force_refresh:
-            _dfc = st.session_state.get("_df_cache_data")
-            _ts = float(st.session_state.get("_df_cache_ts", 0.0) or 0.0)
-            if isinstance(_dfc, pd.DataFrame) and (time.time() - _ts) < DATA_CACHE_SECONDS:
-                return _dfc.copy()
+        worker = _sheet_sync_worker(_history_source_key())
+        if pull and (now or (time.time() - float(worker["last_pull"])) >= DATA_CACHE_SECONDS):
+            worker["pull_wanted"] = True
+        if profiles:
+            worker["profiles_wanted"] = True
+        worker["wake"].set()
     except Exception:
         pass
 
-    df = safe_read_sheet()
+
+@st.cache_resource(show_spinner=False)
+def _shared_history_cache(source_key: str) -> dict:
+    """Cache do histórico partilhada por TODAS as sessões do processo (um telemóvel = uma sessão).
+    - chaveada pela versão do store: só relê quando os dados mudam, e só as linhas novas
+    - single-flight: só uma sessão de cada vez carrega; as outras esperam ou usam a cópia antiga
+    """
+    return {
+        "lock": threading.Lock(),
+        "df": None,
+        "version": -1,
+        "epoch": -1,
+        "max_seq": 0,
+        "parsed": None,
+        "refreshing": None,
+        "hits": 0,
+        "stale_hits": 0,
+        "waits": 0,
+        "misses": 0,
+    }
+
+
+def _history_cache() -> dict:
+    return _shared_history_cache(_history_source_key())
+
+
+def get_data_cache_stats() -> dict:
+    """Contadores da cache partilhada (hits/misses) para diagnóstico."""
+    cache = _history_cache()
+    with cache["lock"]:
+        df = cache["df"]
+        return {
+            "version": int(cache["version"]),
+            "rows": int(len(df)) if isinstance(df, pd.DataFrame) else 0,
+            "refreshing": cache["refreshing"] is not None,
+            "hits": int(cache["hits"]),
+            "stale_hits": int(cache["stale_hits"]),
+            "waits": int(cache["waits"]),
+            "misses": int(cache["misses"]),
+        }
+
+
+# --- Snapshot de arranque a frio ---
+# Ficheiro .npz só com dados (lido com allow_pickle=False, nada do ficheiro é executado): um cabeçalho
+# JSON (magic, HISTORY_SNAPSHOT_SCHEMA, Sheet de origem, colunas, max_seq, ts dos perfis) e um array
+# por coluna do histórico e dos perfis (texto em unicode + máscara de vazios; bool/números como estão).
+# Os arrays da versão não vão no ficheiro: o get_data reconstrói-os a partir do histórico.
+# O worker reescreve-o no máximo a cada HISTORY_SNAPSHOT_MIN_INTERVAL_S e ao sair do processo;
+# cada processo lê-o uma vez, para o primeiro rerun não esperar pela Sheet nem pelo SQLite inteiro.
+_SNAPSHOT_MAGIC = "bc-snapshot"
+
+
+def _snapshot_pack_frame(df: pd.DataFrame, cols: list, prefix: str) -> dict:
+    out = {}
+    for j, c in enumerate(cols):
+        s = df[c]
+        if isinstance(s.dtype, np.dtype) and s.dtype.kind in "biuf":
+            out[f"{prefix}{j}"] = s.to_numpy()
+        else:
+            na = s.isna().to_numpy(dtype=bool)
+            out[f"{prefix}{j}"] = s.astype(object).where(~na, "").astype(str).to_numpy(dtype=str)
+            out[f"{prefix}{j}_na"] = na
+    return out
+
+
+def _snapshot_unpack_frame(z, cols: list, prefix: str, rows: int) -> pd.DataFrame:
+    data = {}
+    for j, c in enumerate(cols):
+        a = z[f"{prefix}{j}"]
+        if len(a) != rows:
+            raise ValueError(f"snapshot: coluna {c} com {len(a)} linhas, esperadas {rows}")
+        if a.dtype.kind == "U":
+            a = pd.Series(a.astype(object)).where(~z[f"{prefix}{j}_na"])
+        data[c] = a
+    return pd.DataFrame(data, columns=cols)
+
+
+def _snapshot_write(header: dict, arrays: dict) -> bool:
+    tmp = f"{HISTORY_SNAPSHOT_PATH}.tmp"
     try:
-        if df is None:
-            df = pd.DataFrame()
-        df = df.copy()
+        head = dict(header, magic=_SNAPSHOT_MAGIC, schema=int(HISTORY_SNAPSHOT_SCHEMA))
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, header=np.array(json.dumps(head, ensure_ascii=False)), **arrays)
+        os.replace(tmp, HISTORY_SNAPSHOT_PATH)  # troca atómica: um arranque nunca lê meio ficheiro
+        return True
+    except Exception:
+        return False
 
-        # migrações de colunas antigas
-        if "RPE" in df.columns and "RIR" not in df.columns:
-            df["RIR"] = df["RPE"]
-        if "Alongamento" in df.columns and "Mobilidade" not in df.columns:
-            df["Mobilidade"] = df["Alongamento"]
 
-        # garantir schema
-        for c in SCHEMA_COLUMNS:
-            if c not in df.columns:
-                df[c] = None
-        df = _ensure_exercise_key_column(df)
-        df = df[SCHEMA_COLUMNS]
+def _snapshot_read() -> dict:
+    """Snapshot do disco, ou {} se não existir / for de outro schema / de outra Sheet."""
+    try:
+        with np.load(HISTORY_SNAPSHOT_PATH, allow_pickle=False) as z:
+            head = json.loads(str(z["header"][()]))
+            if (
+                not isinstance(head, dict)
+                or head.get("magic") != _SNAPSHOT_MAGIC
+                or head.get("schema") != int(HISTORY_SNAPSHOT_SCHEMA)
+                or head.get("source") != _history_source_key()
+                or head.get("columns") != SCHEMA_COLUMNS
+                or head.get("profile_columns") != PROFILES_COLUMNS
+            ):
+                return {}
+            payload = {
+                "history": {
+                    "df": _snapshot_unpack_frame(z, SCHEMA_COLUMNS, "h", int(head["rows"])),
+                    "max_seq": int(head["max_seq"]),
+                },
+            }
+            if head.get("profiles_ts") is not None:
+                payload["profiles"] = {
+                    "df": _snapshot_unpack_frame(z, PROFILES_COLUMNS, "p", int(head["profiles_rows"])),
+                    "ts": float(head["profiles_ts"]),
+                }
+    except Exception:
+        return {}
+    return payload
+
+
+@st.cache_resource(show_spinner=False)
+def _history_snapshot_boot(source_key: str) -> dict:
+    """Snapshot lido uma vez por processo; histórico e perfis são consumidos por quem arranca primeiro."""
+    return {"lock": threading.Lock(), "payload": _snapshot_read()}
+
+
+def _snapshot_take(part: str):
+    """Tira ("history" / "profiles") do snapshot de arranque; None se não houver ou já foi usado."""
+    try:
+        boot = _history_snapshot_boot(_history_source_key())
+        with boot["lock"]:
+            return boot["payload"].pop(part, None)
+    except Exception:
+        return None
+
+
+def _history_snapshot_seed() -> bool:
+    """Store vazio (servidor novo): importa as linhas do snapshot como vindas da Sheet.
+    Se o store ficar igual ao snapshot, devolve-o ao arranque já com o max_seq novo."""
+    snap = _snapshot_take("history")
+    if not snap or not isinstance(snap.get("df"), pd.DataFrame) or snap["df"].empty:
+        return False
+    try:
+        _store_ingest_sheet(snap["df"], full=True)
+    except Exception:
+        return False
+    store = _store()
+    with store["lock"]:
+        n, max_seq = store["con"].execute("SELECT COUNT(*), COALESCE(MAX(seq), 0) FROM treinos").fetchone()
+    if int(n) == len(snap["df"]):
+        snap["max_seq"] = int(max_seq)
+        boot = _history_snapshot_boot(_history_source_key())
+        with boot["lock"]:
+            boot["payload"]["history"] = snap
+    return True
+
 
+def _history_snapshot_prime(cache: dict, store: dict) -> bool:
+    """Cache vazia (processo novo): usa o histórico do snapshot se ainda bater com o store.
+    Linhas com seq <= max_seq só podem sair do store (leitura completa), nunca entrar: basta a contagem.
+    O get_data a seguir lê só o delta (seq > max_seq) e reconstrói os arrays."""
+    with cache["lock"]:
+        if cache["df"] is not None:
+            return False
+    snap = _snapshot_take("history")
+    if not snap:
+        return False
+    try:
+        df, max_seq = snap["df"], int(snap["max_seq"])
+        epoch = store["epoch"]
+        with store["lock"]:
+            n = int(store["con"].execute("SELECT COUNT(*) FROM treinos WHERE seq <= ?", (max_seq,)).fetchone()[0])
+        if n != len(df):
+            return False
+    except Exception:
+        return False
+    with cache["lock"]:
+        if cache["df"] is not None:
+            return False
+        cache["df"] = df
+        cache["parsed"] = None
+        cache["epoch"] = epoch
+        cache["max_seq"] = max_seq
+    return True
+
+
+def _history_snapshot_save(worker: dict, force: bool = False) -> None:
+    """Reescreve o snapshot se a versão em cache ou os perfis mudaram desde o último (corre no worker).
+    No máximo uma vez a cada HISTORY_SNAPSHOT_MIN_INTERVAL_S; o primeiro e o da saída (force) não esperam."""
+    with worker["snapshot_lock"]:
+        if (
+            not force
+            and worker["snapshot_key"] is not None
+            and (time.time() - float(worker["snapshot_ts"])) < HISTORY_SNAPSHOT_MIN_INTERVAL_S
+        ):
+            return
+        cache = _history_cache()
+        with cache["lock"]:
+            df = cache["df"]
+            key = (cache["epoch"], cache["version"], cache["max_seq"])
+        if not isinstance(df, pd.DataFrame) or key[1] < 0:
+            return
+        shared = _profiles_shared()
+        with shared["lock"]:
+            dfp, pts = shared["df"], float(shared["ts"])
+        key = key + (pts,)
+        if worker["snapshot_key"] == key:
+            return
+        header = {
+            "source": _history_source_key(),
+            "columns": list(SCHEMA_COLUMNS),
+            "profile_columns": list(PROFILES_COLUMNS),
+            "rows": int(len(df)),
+            "max_seq": int(key[2]),
+            "profiles_ts": None,
+        }
+        arrays = _snapshot_pack_frame(df, SCHEMA_COLUMNS, "h")
+        if isinstance(dfp, pd.DataFrame):
+            arrays.update(_snapshot_pack_frame(dfp, PROFILES_COLUMNS, "p"))
+            header["profiles_rows"] = int(len(dfp))
+            header["profiles_ts"] = pts
+        if _snapshot_write(header, arrays):
+            worker["snapshot_key"] = key
+            worker["snapshot_ts"] = time.time()
+
+
+def _history_snapshot_atexit(worker: dict) -> None:
+    """Último snapshot ao sair do processo (o do worker pode estar retido pelo intervalo mínimo)."""
+    try:
+        _history_snapshot_save(worker, force=True)
+    except Exception:
+        pass
+
+
+def _normalize_history_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Garante schema (migração RPE->RIR e Alongamento->Mobilidade) e Exercício_Key."""
+    if df is None:
+        df = pd.DataFrame()
+    df = df.copy()
+
+    # migrações de colunas antigas
+    if "RPE" in df.columns and "RIR" not in df.columns:
+        df["RIR"] = df["RPE"]
+    if "Alongamento" in df.columns and "Mobilidade" not in df.columns:
+        df["Mobilidade"] = df["Alongamento"]
+
+    # garantir schema
+    for c in SCHEMA_COLUMNS:
+        if c not in df.columns:
+            df[c] = None
+    df = _ensure_exercise_key_column(df)
+    return _hist_detach(df[SCHEMA_COLUMNS])
+
+
+def _shared_history_peek():
+    """Devolve o histórico em cache (sem nunca ir à Sheet) ou None."""
+    cache = _history_cache()
+    with cache["lock"]:
+        df = cache["df"]
+        return df.copy() if isinstance(df, pd.DataFrame) else None
+
+
+def get_data(force_refresh: bool = False):
+    """Histórico completo (schema garantido), lido do store local (SQLite).
+    A Google Sheet é sincronizada em background (delta a cada DATA_CACHE_SECONDS);
+    force_refresh=True faz uma leitura completa da Sheet antes de devolver.
+    Cache partilhada entre sessões, chaveada pela versão do store, com carga single-flight.
+    """
+    store = _store()
+    try:
+        if force_refresh:
+            _sheet_pull(full=True)
+        else:
+            _store_bootstrap()
+    except Exception:
+        pass
+    _sheet_sync_kick(pull=True)
+
+    cache = _history_cache()
+    with cache["lock"]:
+        _dfc = cache["df"]
+        _fresh = (
+            isinstance(_dfc, pd.DataFrame)
+            and cache["version"] == store["version"]
+            and cache["epoch"] == store["epoch"]
+        )
+        if _fresh:
+            cache["hits"] += 1
+            return _dfc.copy()
+        ev = cache["refreshing"]
+        leader = ev is None
+        if leader:
+            ev = threading.Event()
+            cache["refreshing"] = ev
+            cache["misses"] += 1
+        elif isinstance(_dfc, pd.DataFrame):
+            # carga já em curso noutra sessão: serve a cópia anterior em vez de esperar
+            cache["stale_hits"] += 1
+            return _dfc.copy()
+        else:
+            cache["waits"] += 1
+
+    if not leader:
+        ev.wait(timeout=30.0)
+        with cache["lock"]:
+            _dfc = cache["df"]
+            if isinstance(_dfc, pd.DataFrame):
+                return _dfc.copy()
+        return pd.DataFrame(columns=SCHEMA_COLUMNS)
+
+    try:
+        if _history_snapshot_prime(cache, store):
+            _sheet_sync_kick(pull=True, now=True)
+        with cache["lock"]:
+            base = cache["df"]
+            base_epoch = cache["epoch"]
+            incremental = isinstance(base, pd.DataFrame) and base_epoch == store["epoch"]
+            after_seq = int(cache["max_seq"]) if incremental else 0
         try:
-            st.session_state["_df_cache_data"] = df.copy()
-            st.session_state["_df_cache_ts"] = time.time()
+            df_new, max_seq, version, epoch = _store_read_frame(after_seq)
+            if incremental and epoch != base_epoch:
+                # pull completo entre a decisão e a leitura: as seqs da base já não existem, lê tudo
+                incremental = False
+                df_new, max_seq, version, epoch = _store_read_frame(0)
+            df = pd.concat([base, df_new], ignore_index=True) if (incremental and not df_new.empty) else (base if incremental else _hist_detach(df_new))
         except Exception:
-            pass
-        return df
-    except Exception:
+            # leitura falhou: a cache fica como estava (versão por atualizar), a próxima chamada tenta de novo
+            return base.copy() if isinstance(base, pd.DataFrame) else pd.DataFrame(columns=SCHEMA_COLUMNS)
+        # Peso/Reps/RIR parsed uma vez por versão (só as linhas novas quando o histórico só cresceu)
+        tag = (str(_history_source_key()), int(epoch), int(version))
         try:
-            _df = pd.DataFrame(columns=SCHEMA_COLUMNS)
-            st.session_state["_df_cache_data"] = _df.copy()
-            st.session_state["_df_cache_ts"] = time.time()
-            return _df
+            _base = cache["parsed"] if incremental else None
+            if _base is not None and any(_base.get(k) is None for k in ("check", "rows", "sets", "metrics", "days", "weeks", "board", "prs")):
+                _base = None
+            # sem arrays da versão anterior (ex.: histórico vindo do snapshot) constrói-os para df inteiro
+            parsed = _ragged_build(df_new, tag, base=_base) if _base is not None else None
+            if parsed is None or parsed["n"] != len(df):
+                parsed = _ragged_build(df, tag)
         except Exception:
-            return pd.DataFrame(columns=SCHEMA_COLUMNS)
-
-
+            parsed = None
+        df.attrs["bc_hist"] = tag if parsed is not None else None
+        with cache["lock"]:
+            cache["df"] = df
+            cache["parsed"] = parsed
+            cache["version"] = version
+            cache["epoch"] = epoch
+            cache["max_seq"] = max_seq
+        return df.copy()
+    finally:
+        with cache["lock"]:
+            cache["refreshing"] = None
+        ev.set()
+
+
+
+
+def _server_warmup_run(state: dict) -> None:
+    """Enche as caches partilhadas: histórico (arrays, rollup, leaderboard, PRs), perfis, índice por
+    exercício e, por perfil, nomes de exercícios e streak. Regista a duração."""
+    t0 = time.perf_counter()
+
+    def _step(name, fn):
+        t = time.perf_counter()
+        try:
+            return fn()
+        except Exception as e:
+            state["errors"].append(f"{name}: {e}")
+            LOGGER.exception("warmup: passo %s falhou", name)
+            return None
+        finally:
+            state["steps"][name] = round((time.perf_counter() - t) * 1000)
+
+    df = _step("histórico", get_data)
+    state["history_ready"].set()  # o primeiro rerun espera só por isto; o resto continua em background
+    dfp = _step("perfis", _profiles_warm)
+    if isinstance(df, pd.DataFrame) and not df.empty:
+        _step("índices", lambda: (_hist_exercise_index(df), hist_leaderboard(df)))
+        perfis = set(df["Perfil"].dropna().astype(str).str.strip())
+        if isinstance(dfp, pd.DataFrame):
+            perfis |= set(dfp["Perfil"].dropna().astype(str).str.strip())
+        perfis.discard("")
+        _step("perfis_resumo", lambda: [(hist_exercise_labels(df, p), get_last_streak(df, p)) for p in sorted(perfis)])
+    state["ms"] = round((time.perf_counter() - t0) * 1000)
+    state["done"] = True
+    rows = len(df) if isinstance(df, pd.DataFrame) else 0
+    LOGGER.info("warmup: %d linhas em %d ms %s (%d erros)", rows, state["ms"], state["steps"], len(state["errors"]))
+
+
+def _profiles_warm() -> pd.DataFrame:
+    """Perfis para a cópia partilhada: já carregados, do snapshot, ou lidos da Sheet."""
+    shared = _profiles_shared()
+    with shared["lock"]:
+        dfp = shared["df"]
+    if dfp is not None:
+        return dfp
+    snap = _snapshot_take("profiles")
+    if snap is not None:
+        _profiles_shared_set(snap["df"], snap["ts"])
+        return snap["df"]
+    with _gs_priority(GS_PRIO_READ):
+        dfp = _read_profiles_sheet()
+    _profiles_shared_set(dfp)
+    return dfp
+
+
+@st.cache_resource(show_spinner=False)
+def _server_warmup(source_key: str) -> dict:
+    """Warmup único por processo, em background, lançado pelo primeiro rerun (o Streamlit não tem hook
+    de arranque do servidor): as sessões seguintes já encontram as caches cheias.
+    history_ready: o histórico já está na cache partilhada (o primeiro rerun usa-o em vez de carregar outro)."""
+    state = {"done": False, "ms": None, "steps": {}, "errors": [], "history_ready": threading.Event()}
+    t = threading.Thread(target=_server_warmup_run, args=(state,), name="bc-warmup", daemon=True)
+    t.start()
+    state["thread"] = t
+    return state
 
 
 # --- 4.1 HELPERS DE DADOS / XP / HISTÓRICO ---
@@ -2950,6 +4526,51 @@ def exercise_key(ex_name: str) -> str:
     return norm
 
 
+@st.cache_resource(show_spinner=False)
+def _exercise_key_memo() -> dict:
+    return {"lock": threading.Lock(), "lru": collections.OrderedDict(), "hits": 0, "misses": 0}
+
+
+def exercise_keys(values) -> pd.Series:
+    """exercise_key de uma coluna inteira: factoriza os nomes, calcula cada nome distinto uma vez
+    (memo partilhado pelo processo) e volta a espalhar pelo índice original."""
+    s = values if isinstance(values, pd.Series) else pd.Series(values, dtype=object)
+    if s.empty:
+        return s.apply(exercise_key)
+    arr = s.to_numpy(dtype=object)
+    codes, uniques = pd.factorize(arr)
+    names = [str(u or "") for u in uniques]
+    na = codes < 0
+    if na.any():
+        # None -> "" mas NaN -> "nan" (como str(x or "")); o factorize junta-os, por isso vão à parte
+        extra, inv = np.unique([str(x or "") for x in arr[na]], return_inverse=True)
+        codes = codes.copy()
+        codes[na] = len(names) + inv
+        names += extra.tolist()
+    memo = _exercise_key_memo()
+    todo = {}
+    with memo["lock"]:
+        keys = []
+        for name in names:
+            k = memo["lru"].get(name)
+            if k is None:
+                todo[name] = None
+            else:
+                memo["lru"].move_to_end(name)
+            keys.append(k)
+        memo["hits"] += len(names) - len(todo)
+        memo["misses"] += len(todo)
+    for name in todo:
+        todo[name] = exercise_key(name)
+    if todo:
+        with memo["lock"]:
+            memo["lru"].update(todo)
+            while len(memo["lru"]) > EXERCISE_KEY_MEMO_MAX:
+                memo["lru"].popitem(last=False)
+        keys = [todo[n] if k is None else k for n, k in zip(names, keys)]
+    return pd.Series(np.asarray(keys, dtype=object)[codes], index=s.index)
+
+
 def _ensure_exercise_key_column(df: pd.DataFrame) -> pd.DataFrame:
     if df is None:
         return pd.DataFrame(columns=SCHEMA_COLUMNS)
@@ -2961,12 +4582,12 @@ def _ensure_exercise_key_column(df: pd.DataFrame) -> pd.DataFrame:
         curr_key = out["Exercício_Key"].fillna("").astype(str).str.strip()
         mask = curr_key.eq("")
         if mask.any():
-            out.loc[mask, "Exercício_Key"] = base_ex.loc[mask].apply(exercise_key)
+            out.loc[mask, "Exercício_Key"] = exercise_keys(base_ex.loc[mask])
         else:
-            out["Exercício_Key"] = out["Exercício_Key"].apply(exercise_key)
+            out["Exercício_Key"] = exercise_keys(out["Exercício_Key"])
     except Exception:
         try:
-            out["Exercício_Key"] = out.get("Exercício", "").apply(exercise_key)
+            out["Exercício_Key"] = exercise_keys(out["Exercício"])
         except Exception:
             out["Exercício_Key"] = ""
     return out
@@ -2982,7 +4603,7 @@ def _exercise_label_map(df: pd.DataFrame) -> dict:
     if "Exercício" not in d.columns:
         return out
     try:
-        d["_label_dt"] = pd.to_datetime(d.get("Data"), dayfirst=True, errors="coerce")
+        d["_label_dt"] = hist_dates(df)
     except Exception:
         d["_label_dt"] = pd.NaT
     d = d.sort_values(["_label_dt"], ascending=False, na_position="last")
@@ -2995,43 +4616,593 @@ def _exercise_label_map(df: pd.DataFrame) -> dict:
     return out
 
 
-def _parse_num_list(v):
-    if v is None:
-        return []
-    if isinstance(v, (list, tuple)):
-        out=[]
-        for x in v:
-            try:
-                if pd.isna(x):
-                    continue
-            except Exception:
-                pass
-            sx = str(x).strip().replace(',', '.')
-            if sx == '':
-                continue
-            try:
-                out.append(float(sx))
-            except Exception:
-                pass
-        return out
-    s = str(v).strip()
-    if s == '' or s.lower() == 'nan':
-        return []
-    # prioridade: separador de listas é vírgula; decimal pode vir com ponto.
-    parts = [x.strip() for x in s.split(',')]
-    out=[]
-    for x in parts:
-        if x == '':
-            continue
-        x = x.replace(';', '').strip()
-        try:
-            out.append(float(x))
-        except Exception:
-            try:
-                out.append(float(x.replace(',', '.')))
-            except Exception:
-                pass
-    return out
+def _parse_num_list(v):
+    if v is None:
+        return []
+    if isinstance(v, (list, tuple)):
+        out=[]
+        for x in v:
+            try:
+                if pd.isna(x):
+                    continue
+            except Exception:
+                pass
+            sx = str(x).strip().replace(',', '.')
+            if sx == '':
+                continue
+            try:
+                out.append(float(sx))
+            except Exception:
+                pass
+        return out
+    s = str(v).strip()
+    if s == '' or s.lower() == 'nan':
+        return []
+    # prioridade: separador de listas é vírgula; decimal pode vir com ponto.
+    parts = [x.strip() for x in s.split(',')]
+    out=[]
+    for x in parts:
+        if x == '':
+            continue
+        x = x.replace(';', '').strip()
+        try:
+            out.append(float(x))
+        except Exception:
+            try:
+                out.append(float(x.replace(',', '.')))
+            except Exception:
+                pass
+    return out
+
+
+# --- Peso/Reps/RIR pré-parsed (arrays planos por versão do histórico) ---
+# Cada coluna fica {values: float64 plano, offsets: início de cada linha (n+1), counts: nº de valores}.
+# Frames devolvidos por get_data() levam df.attrs["bc_hist"]; o índice (RangeIndex do histórico
+# completo) dá a posição de cada linha, por isso filtros e cópias continuam a poder usar os arrays.
+# Como o pandas copia attrs para qualquer frame derivado, _hist_parsed_for confirma que os rótulos são
+# posições válidas e distintas e que as linhas batem com as guardadas (_HIST_CHECK_COLS); frames que
+# não são uma seleção de linhas (reset_index, concat...) perdem a tag em _hist_detach.
+_RAGGED_COLS = ("Peso", "Reps", "RIR")
+_HIST_CHECK_COLS = ("Perfil", "Data", "Peso", "Reps")
+_HIST_CHECK_SAMPLE = 64  # linhas comparadas por chamada
+
+
+def _hist_check_values(df: pd.DataFrame, c: str) -> np.ndarray:
+    return df[c].astype(object).where(df[c].notna(), "").astype(str).to_numpy(dtype=object)
+
+
+def _hist_detach(df: pd.DataFrame) -> pd.DataFrame:
+    """Cópia com RangeIndex novo e sem a tag do histórico (as posições deixaram de ser as do histórico)."""
+    out = df.reset_index(drop=True)
+    out.attrs.pop("bc_hist", None)
+    return out
+
+
+def _ragged_parse_column(s: pd.Series) -> dict:
+    """'80,82.5,85' por linha -> arrays planos; cada string distinta passa uma vez por _parse_num_list."""
+    s = s.astype(object)
+    codes, uniques = pd.factorize(s.where(s.notna(), ""), sort=False)
+    parsed_u = [_parse_num_list(u) for u in uniques]
+    cnt_u = np.array([len(v) for v in parsed_u], dtype=np.int64)
+    flat_u = np.array([x for v in parsed_u for x in v], dtype=np.float64)
+    start_u = np.zeros(len(parsed_u), dtype=np.int64)
+    if len(parsed_u) > 1:
+        start_u[1:] = np.cumsum(cnt_u)[:-1]
+    codes = np.asarray(codes, dtype=np.int64)
+    counts = cnt_u[codes] if len(codes) else np.zeros(0, dtype=np.int64)
+    offsets = np.zeros(len(codes) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    take = np.repeat(start_u[codes] - offsets[:-1], counts) + np.arange(int(offsets[-1]), dtype=np.int64) if len(codes) else np.zeros(0, dtype=np.int64)
+    return {"values": flat_u[take], "offsets": offsets, "counts": counts}
+
+
+def _ragged_concat(a: dict, b: dict) -> dict:
+    return {
+        "values": np.concatenate([a["values"], b["values"]]),
+        "offsets": np.concatenate([a["offsets"], b["offsets"][1:] + a["offsets"][-1]]),
+        "counts": np.concatenate([a["counts"], b["counts"]]),
+    }
+
+
+# Contexto por linha guardado com os arrays
+_RAGGED_ROW_COLS = ("Perfil", "Plano_ID", "Bloco", "Exercício_Key", "Dia")
+
+
+def _ragged_row_attrs(df: pd.DataFrame) -> dict:
+    """Perfil/Plano_ID/Bloco/Exercício_Key/Dia (str) e Data (datetime64) de cada linha de `df`."""
+    n = len(df)
+    d = _ensure_exercise_key_column(df) if n else df
+    out = {}
+    for c in _RAGGED_ROW_COLS:
+        col = d[c] if c in d.columns else pd.Series([""] * n, dtype=object)
+        out[c] = col.fillna("").astype(str).to_numpy(dtype=object)
+    if n and "Data" in d.columns:
+        out["Data"] = _parse_dates_dayfirst(d["Data"]).to_numpy(dtype="datetime64[ns]")
+    else:
+        out["Data"] = np.full(n, np.datetime64("NaT"), dtype="datetime64[ns]")
+    return out
+
+
+def _ragged_sets(cols: dict, row0: int = 0) -> dict:
+    """Uma entrada por série: Row (posição no histórico), Set (0, 1, ...), Peso, Reps, RIR.
+    Nº de séries da linha = maior das listas; Peso com 1 valor faz broadcast (como tonnage_row e
+    best_1rm_row), Reps/RIR ficam como vieram (NaN depois do fim da lista).
+    """
+    P, R, Q = cols["Peso"], cols["Reps"], cols["RIR"]
+    n = len(P["counts"])
+    n_sets = np.maximum.reduce([P["counts"], R["counts"], Q["counts"]]) if n else np.zeros(0, dtype=np.int64)
+    row = np.repeat(np.arange(n, dtype=np.int64), n_sets)
+    starts = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(n_sets, out=starts[1:])
+    i = np.arange(int(starts[-1]), dtype=np.int64) - np.repeat(starts[:-1], n_sets)
+
+    def _at(a, bcast):
+        cnt = a["counts"][row]
+        ok = (i < cnt) | ((cnt == 1) if bcast else False)
+        vals = np.full(len(row), np.nan)
+        vals[ok] = a["values"][a["offsets"][row[ok]] + np.where(cnt[ok] == 1, 0, i[ok])]
+        return vals
+
+    return {"Row": row + int(row0), "Set": i, "Peso": _at(P, True), "Reps": _at(R, False), "RIR": _at(Q, False)}
+
+
+def _ragged_profile_days(rows: dict, base: dict | None = None) -> dict:
+    """Perfil -> dias de treino (dias desde 1970-01-01), ordenados e sem repetidos.
+    Com `base`, só os perfis presentes em `rows` são atualizados."""
+    out = dict(base or {})
+    day = rows["Data"].astype("datetime64[D]")
+    ok = ~np.isnat(day)
+    perf, num = rows["Perfil"][ok], day[ok].astype(np.int64)
+    for p in pd.unique(perf):
+        new = np.unique(num[perf == p])
+        out[p] = np.union1d(out[p], new) if p in out else new
+    return out
+
+
+def _pr_update(base: dict | None, rows: dict, metrics: dict, row0: int = 0) -> dict:
+    """(Perfil, Exercício_Key) -> {"e1rm", "data", "row"}: melhor 1RM estimado e a linha/data onde
+    foi feito. Só as linhas novas são vistas; em empate fica o registo mais antigo."""
+    out = dict(base or {})
+    best = metrics["best_1rm"]
+    ok = best > 0
+    if not ok.any():
+        return out
+    d = pd.DataFrame({
+        "p": rows["Perfil"][ok],
+        "k": rows["Exercício_Key"][ok],
+        "neg": -best[ok],
+        "row": np.nonzero(ok)[0] + int(row0),
+        "data": rows["Data"][ok],
+    })
+    top = d.sort_values("neg", kind="stable").drop_duplicates(["p", "k"])
+    for p, k, neg, row, data in zip(top["p"], top["k"], top["neg"], top["row"], top["data"]):
+        cur = out.get((p, k))
+        if cur is None or -neg > cur["e1rm"]:
+            out[(p, k)] = {"e1rm": float(-neg), "data": pd.Timestamp(data), "row": int(row)}
+    return out
+
+
+def set_e1rm(peso, reps) -> float:
+    """1RM estimado (Epley, reps com cap de 15) de uma série; 0 se faltar peso ou reps."""
+    try:
+        w, r = float(peso), float(reps)
+    except Exception:
+        return 0.0
+    if w <= 0 or r <= 0:
+        return 0.0
+    return float(w * (1.0 + min(r, 15.0) / 30.0))
+
+
+def hist_pr(perfil: str, ex_key: str):
+    """PR atual de (perfil, exercise_key) na última versão do histórico em cache:
+    {"e1rm", "data", "row"} ou None. Não copia nem percorre o histórico."""
+    cache = _history_cache()
+    with cache["lock"]:
+        parsed = cache["parsed"]
+    prs = parsed.get("prs") if isinstance(parsed, dict) else None
+    if not prs:
+        return None
+    return prs.get((str(perfil), str(ex_key)))
+
+
+# --- Leaderboard (Ranking) mantido com o histórico ---
+# Por perfil: agregados por dia (XP, linhas, checklist OK, sessões, streak máx.) e somas acumuladas,
+# para Total / últimos N dias saírem de diferenças de prefixos. Linhas sem data ficam no "dia" NaT
+# (o menor int64, sempre à cabeça), que só entra no Total.
+_BOARD_SUM = ["xp", "linhas", "checklist", "sessoes"]
+
+
+def _board_update(base: dict | None, df: pd.DataFrame, rows: dict) -> dict:
+    """Junta as linhas de `df` (contexto em `rows`) ao leaderboard `base`; só os perfis tocados
+    são recalculados. Ignora linhas de setup, como o ranking."""
+    out = dict(base or {})
+    n = len(df)
+    if n == 0:
+        return out
+
+    def _col(c):
+        return df[c] if c in df.columns else pd.Series([""] * n, index=df.index)
+
+    ok = _col("Perfil").notna().to_numpy().copy()
+    for c in ("Bloco", "Dia", "Exercício"):
+        ok &= (_col(c).astype(str).str.lower() != "setup").to_numpy()
+    if not ok.any():
+        return out
+    d = pd.DataFrame({
+        "Perfil": _col("Perfil").astype(str).to_numpy(),
+        "dia": rows["Data"].astype("datetime64[D]").astype(np.int64),
+        "xp": pd.to_numeric(_col("XP"), errors="coerce").fillna(0).to_numpy(dtype=float),
+        "linhas": np.ones(n, dtype=np.int64),
+        "checklist": _col("Checklist_OK").astype(str).str.strip().str.lower().isin(["true", "1", "yes", "y", "sim"]).to_numpy().astype(np.int64),
+        "streak": pd.to_numeric(_col("Streak"), errors="coerce").fillna(0).to_numpy(dtype=float),
+        "Data": _col("Data").astype(str).to_numpy(),
+        "Dia": _col("Dia").astype(str).to_numpy(),
+    })[ok]
+    for perfil, g in d.groupby("Perfil", sort=False):
+        prev = out.get(perfil)
+        seen = prev["pares"] if prev is not None else frozenset()
+        # sessões = pares (Data, Dia) distintos; só contam os que o perfil ainda não tinha
+        pares = g.drop_duplicates(["Data", "Dia"])
+        pares = pares[[(a, b) not in seen for a, b in zip(pares["Data"], pares["Dia"])]]
+        agg = g.groupby("dia").agg(xp=("xp", "sum"), linhas=("linhas", "sum"), checklist=("checklist", "sum"), streak=("streak", "max"))
+        agg["sessoes"] = pares.groupby("dia").size().reindex(agg.index, fill_value=0)
+        if prev is not None:
+            agg = pd.concat([prev["dias"], agg]).groupby(level=0).agg({"xp": "sum", "linhas": "sum", "checklist": "sum", "sessoes": "sum", "streak": "max"})
+        agg = agg.sort_index()[_BOARD_SUM + ["streak"]]
+        cum = np.zeros((len(agg) + 1, len(_BOARD_SUM)))
+        np.cumsum(agg[_BOARD_SUM].to_numpy(dtype=float), axis=0, out=cum[1:])
+        out[perfil] = {
+            "pares": seen | frozenset(zip(pares["Data"], pares["Dia"])),
+            "dias": agg,
+            "dia": agg.index.to_numpy(dtype=np.int64),
+            "cum": cum,
+            "streak": agg["streak"].to_numpy(dtype=float),
+        }
+    return out
+
+
+def hist_leaderboard(df: pd.DataFrame, dias: int | None = None) -> pd.DataFrame:
+    """Ranking de perfis (Total, ou só os últimos `dias` dias), já ordenado por tier/score/XP.
+    Usa o leaderboard mantido com o histórico quando `df` é o histórico completo."""
+    parsed, pos = _hist_parsed_for(df)
+    if parsed is not None and parsed.get("board") is not None and len(pos) == parsed["n"]:
+        board = parsed["board"]
+    else:
+        df = pd.DataFrame(columns=SCHEMA_COLUMNS) if df is None else df
+        board = _board_update(None, df, {"Data": hist_dates(df).to_numpy(dtype="datetime64[ns]")})
+    cutoff = None
+    if dias is not None:
+        cutoff = int(np.datetime64((pd.Timestamp.today().normalize() - pd.Timedelta(days=int(dias))).date(), "D").astype(np.int64))
+    out = []
+    for perfil in sorted(board):
+        b = board[perfil]
+        i = 0 if cutoff is None else int(np.searchsorted(b["dia"], cutoff, side="left"))
+        xp, linhas, chk, sessoes = (b["cum"][-1] - b["cum"][i]).tolist()
+        if linhas <= 0:
+            continue
+        xp_total = int(xp)
+        streak_max = int(b["streak"][i:].max())
+        checklist_rate = float(chk / linhas)
+        sessoes = int(sessoes)
+
+        tier, subt = calcular_rank(xp_total, streak_max, checklist_rate)
+        tier_ord = {"💎 PLATINA": 4, "🥇 OURO": 3, "🥈 PRATA": 2, "🥉 BRONZE": 1}.get(tier, 0)
+        score = float(xp_total) + float(streak_max)*50.0 + float(checklist_rate)*500.0 + float(sessoes)*10.0
+        out.append({
+            "Perfil": str(perfil),
+            "Tier": tier,
+            "Score": round(score, 1),
+            "XP Total": xp_total,
+            "Streak Máx": streak_max,
+            "Checklist %": round(checklist_rate*100, 0),
+            "Sessões": sessoes,
+            "_tier_ord": tier_ord
+        })
+    if not out:
+        return pd.DataFrame(columns=["Perfil", "Tier", "Score", "XP Total", "Streak Máx", "Checklist %", "Sessões"])
+    rank_df = pd.DataFrame(out)
+    return rank_df.sort_values(["_tier_ord", "Score", "XP Total"], ascending=[False, False, False]).drop(columns=["_tier_ord"])
+
+
+def _ragged_build(df: pd.DataFrame, tag, base: dict | None = None, facts: bool = True) -> dict:
+    """Arrays de Peso/Reps/RIR para `df`; com `base`, `df` são só as linhas acrescentadas.
+    Com `facts`, também o contexto por linha, a tabela de séries, as métricas por linha, os dias de
+    treino por perfil, o rollup semanal, o leaderboard e os PRs (calculados só para as linhas novas
+    e juntos aos da base).
+    """
+    cols = {}
+    for c in _RAGGED_COLS:
+        col = df[c] if c in df.columns else pd.Series([""] * len(df), dtype=object)
+        cols[c] = _ragged_parse_column(col)
+    row0 = int(base["n"]) if base is not None else 0
+    rows = sets = days = metrics = weeks = board = prs = None
+    if facts:
+        rows = _ragged_row_attrs(df)
+        sets = _ragged_sets(cols, row0)
+        metrics = _sets_row_metrics(sets, cols, row0)
+        days = _ragged_profile_days(rows, base["days"] if base is not None else None)
+        weeks = _week_rollup(rows, metrics)
+        board = _board_update(base["board"] if base is not None else None, df, rows)
+        prs = _pr_update(base["prs"] if base is not None else None, rows, metrics, row0)
+        if base is not None:
+            rows = {k: np.concatenate([base["rows"][k], v]) for k, v in rows.items()}
+            sets = {k: np.concatenate([base["sets"][k], v]) for k, v in sets.items()}
+            metrics = {k: np.concatenate([base["metrics"][k], v]) for k, v in metrics.items()}
+            weeks = _week_rollup_merge(base["weeks"], weeks)
+    check = {c: (_hist_check_values(df, c) if c in df.columns else np.full(len(df), "", dtype=object)) for c in _HIST_CHECK_COLS}
+    if base is not None:
+        cols = {c: _ragged_concat(base[c], cols[c]) for c in _RAGGED_COLS}
+        check = {c: np.concatenate([base["check"][c], v]) for c, v in check.items()}
+    n = int(len(cols["Peso"]["counts"]))
+    return {
+        "tag": tag,
+        "n": n,
+        **cols,
+        "check": check,
+        "rows": rows,
+        "sets": sets,
+        "metrics": metrics,
+        "days": days,
+        "weeks": weeks,
+        "board": board,
+        "prs": prs,
+        "memo": {},
+        "memo_lock": threading.Lock(),
+    }
+
+
+def _hist_parsed_for(df: pd.DataFrame):
+    """(arrays da versão atual, posições das linhas de `df`) ou (None, None) se `df` não vier
+    do histórico atual (versão antiga, frame construído à mão, índice reposto...)."""
+    try:
+        tag = df.attrs.get("bc_hist")
+    except Exception:
+        return None, None
+    if tag is None:
+        return None, None
+    cache = _history_cache()
+    with cache["lock"]:
+        parsed = cache["parsed"]
+    if parsed is None or parsed["tag"] != tag:
+        return None, None
+    try:
+        pos = df.index.to_numpy()
+        if len(pos) > parsed["n"] or (len(pos) and (
+            pos.dtype.kind not in "iu" or int(pos.min()) < 0 or int(pos.max()) >= parsed["n"] or not df.index.is_unique
+        )):
+            return None, None
+        pos = pos.astype(np.int64, copy=False)
+        # rótulos válidos mas de outras linhas (reset_index/concat de um filtro com a tag copiada):
+        # uma amostra espalhada chega, porque nesses casos quase todas as linhas ficam trocadas
+        cols = [c for c in _HIST_CHECK_COLS if c in df.columns]
+        if not cols:
+            return None, None
+        if len(pos):
+            amostra = np.unique(np.linspace(0, len(pos) - 1, min(len(pos), _HIST_CHECK_SAMPLE)).astype(np.int64))
+            for c in cols:
+                vals = df[c].array[amostra]
+                got = np.array(["" if pd.isna(v) else str(v) for v in vals], dtype=object)
+                if not np.array_equal(got, parsed["check"][c][pos[amostra]]):
+                    return None, None
+    except Exception:
+        return None, None
+    return parsed, pos
+
+
+def _hist_memo(df: pd.DataFrame, name: str, build):
+    """Estrutura derivada do histórico atual, construída uma vez por versão: build(df_canónico, parsed).
+    Devolve (valor, posições das linhas de `df`) ou (None, None) se `df` não vier do histórico atual.
+    """
+    parsed, pos = _hist_parsed_for(df)
+    if parsed is None:
+        return None, None
+    memo = parsed["memo"]
+    if name not in memo:
+        with parsed["memo_lock"]:
+            if name not in memo:
+                cache = _history_cache()
+                with cache["lock"]:
+                    canon = cache["df"] if cache["parsed"] is parsed else None
+                if canon is None:
+                    return None, None
+                memo[name] = build(canon, parsed)
+    return memo[name], pos
+
+
+def _parse_dates_dayfirst(s: pd.Series) -> pd.Series:
+    """dd/mm/aaaa (formato gravado pela app), depois aaaa-mm-dd (ISO, que o dayfirst trocaria);
+    o resto linha a linha com dayfirst, sem inferir o formato da coluna inteira a partir da primeira linha."""
+    dt = pd.to_datetime(s, format="%d/%m/%Y", errors="coerce")
+    for fmt in ("%Y-%m-%d", "mixed"):
+        rest = dt.isna() & s.notna() & (s.astype(str).str.strip() != "")
+        if not rest.any():
+            break
+        dt.loc[rest] = pd.to_datetime(s.loc[rest], format=fmt, dayfirst=(fmt == "mixed"), errors="coerce")
+    return dt
+
+
+def _hist_build_exercise_index(canon: pd.DataFrame, parsed: dict) -> dict:
+    """(perfil, exercise_key) -> posições ordenadas da mais recente para a mais antiga
+    (data desc; no mesmo dia mantém a ordem de gravação, como o sort_values; datas inválidas no fim),
+    com sub-índices por plano e bloco. Usa o contexto por linha já guardado com os arrays."""
+    rows = parsed.get("rows")
+    if rows is None:
+        d = _ensure_exercise_key_column(canon)
+        n = len(d)
+        dt = _parse_dates_dayfirst(d["Data"]) if "Data" in d.columns else pd.Series([pd.NaT] * n)
+        rows = {c: (d[c] if c in d.columns else pd.Series([""] * n)).astype(str).to_numpy() for c in _RAGGED_ROW_COLS}
+    else:
+        n = parsed["n"]
+        dt = pd.Series(rows["Data"])
+    dt_i8 = dt.to_numpy(dtype="datetime64[ns]").astype(np.int64)
+    nat = dt.isna().to_numpy()
+    pos = np.arange(n, dtype=np.int64)
+    order = np.lexsort((pos, -np.where(nat, 0, dt_i8), nat))
+
+    def _col(c):
+        return rows[c][order]
+
+    s = pd.DataFrame({"p": _col("Perfil"), "k": _col("Exercício_Key"), "pl": _col("Plano_ID"), "b": _col("Bloco")})
+
+    def _groups(cols):
+        return {k: order[v] for k, v in s.groupby(cols, sort=False).indices.items()}
+
+    return {
+        "dt": dt.reset_index(drop=True),
+        "ex": _groups(["p", "k"]),
+        "plan": _groups(["p", "k", "pl"]),
+        "block": _groups(["p", "k", "b"]),
+        "plan_block": _groups(["p", "k", "pl", "b"]),
+    }
+
+
+def _hist_exercise_index(df: pd.DataFrame):
+    """Índice por exercício da versão de `df` e as posições de `df` (None, None se não houver)."""
+    return _hist_memo(df, "exercise_index", _hist_build_exercise_index)
+
+
+def _hist_index_rows(ix: dict, pos, sub: str, key) -> np.ndarray:
+    """Posições (já ordenadas por data desc) do grupo, restritas às linhas presentes em `df`."""
+    rows = ix[sub].get(key)
+    if rows is None:
+        return np.zeros(0, dtype=np.int64)
+    if len(pos) != len(ix["dt"]):
+        rows = rows[np.isin(rows, pos)]
+    return rows
+
+
+def _ragged_row_lists(parsed: dict, pos: int) -> tuple:
+    """(pesos, reps, rirs) de uma linha, iguais ao que _parse_num_list devolveria."""
+    out = []
+    for c in _RAGGED_COLS:
+        a = parsed[c]
+        o = int(a["offsets"][pos])
+        out.append(a["values"][o:o + int(a["counts"][pos])].tolist())
+    return tuple(out)
+
+
+def _sets_row_metrics(sets: dict, cols: dict, row0: int = 0) -> dict:
+    """Séries / tonnage / RIR médio / melhor 1RM das linhas row0.. de `cols` (mesma regra das funções *_row).
+    Os pares e o RIR saem do comprimento das listas: um 'nan' escrito na lista conta como nas funções
+    *_row (RIR médio NaN, inf×nan no tonnage), o NaN da tabela de séries depois do fim da lista não."""
+    P, R, Q = cols["Peso"], cols["Reps"], cols["RIR"]
+    n = len(P["counts"])
+    row, i, w, r = sets["Row"] - int(row0), sets["Set"], sets["Peso"], sets["Reps"]
+
+    series = np.bincount(row[r > 0], minlength=n).astype(np.int64)
+    q_row = np.repeat(np.arange(n, dtype=np.int64), Q["counts"])
+    avg_rir = np.bincount(q_row, weights=Q["values"], minlength=n) / np.maximum(Q["counts"], 1)
+
+    # pares peso×reps: min(len(pesos), len(reps)) (1 peso faz broadcast para as reps)
+    cnt_p, cnt_r = P["counts"][row], R["counts"][row]
+    pair = (i < cnt_r) & ((i < cnt_p) | (cnt_p == 1))
+    pr, w, r = row[pair], w[pair], r[pair]
+    with np.errstate(invalid="ignore"):
+        tonnage = np.bincount(pr, weights=np.where(w > 0, w, 0.0) * np.where(r > 0, r, 0.0), minlength=n)
+    est = np.where((w > 0) & (r > 0), w * (1.0 + np.minimum(r, 15.0) / 30.0), 0.0)
+    best = np.zeros(n, dtype=np.float64)
+    np.maximum.at(best, pr, est)
+    return {"series": series, "tonnage": tonnage, "avg_rir": avg_rir, "best_1rm": best}
+
+
+def _ragged_row_metrics(parsed: dict) -> dict:
+    """Métricas por linha de todo o histórico (mantidas com os arrays, só as linhas novas a cada versão)."""
+    if parsed.get("metrics") is None:
+        parsed["metrics"] = _sets_row_metrics(parsed["sets"], parsed)
+    return parsed["metrics"]
+
+
+# --- Rollup semanal (semana ISO) para o Histórico ---
+WEEK_ROLLUP_KEYS = ["Perfil", "Semana_ID", "Dia", "Bloco", "Exercício_Key"]
+_WEEK_ROLLUP_SUM = ["Linhas", "Séries", "Tonnage", "RIR_soma", "Fadiga"]
+
+
+def _iso_week_ids(dt) -> np.ndarray:
+    """'2024-W05' por data (vazio para datas inválidas)."""
+    dt = pd.Series(dt)
+    out = np.full(len(dt), "", dtype=object)
+    ok = dt.notna().to_numpy()
+    if ok.any():
+        iso = dt[ok].dt.isocalendar()
+        out[ok] = (iso["year"].astype(int).astype(str) + "-W" + iso["week"].astype(int).astype(str).str.zfill(2)).to_numpy()
+    return out
+
+
+def _week_rollup(rows: dict, metrics: dict) -> pd.DataFrame:
+    """(Perfil, Semana_ID, Dia, Bloco, Exercício_Key) -> Linhas, Séries, Tonnage, RIR_soma
+    (soma dos RIR médios das linhas), 1RM (máximo) e Fadiga (Σ séries × (4 − RIR médio)).
+    Só linhas com data válida, como o add_calendar_week."""
+    sem = _iso_week_ids(rows["Data"])
+    ok = sem != ""
+    rir = metrics["avg_rir"][ok]
+    d = pd.DataFrame({
+        "Perfil": rows["Perfil"][ok],
+        "Semana_ID": sem[ok],
+        "Dia": rows["Dia"][ok],
+        "Bloco": rows["Bloco"][ok],
+        "Exercício_Key": rows["Exercício_Key"][ok],
+        "Linhas": np.ones(int(ok.sum()), dtype=np.int64),
+        "Séries": metrics["series"][ok],
+        "Tonnage": metrics["tonnage"][ok],
+        "RIR_soma": rir,
+        "1RM": metrics["best_1rm"][ok],
+        "Fadiga": metrics["series"][ok] * (4 - np.clip(rir, 0, 4)),
+    })
+    return _week_rollup_merge(d)
+
+
+def _week_rollup_merge(*parts) -> pd.DataFrame:
+    d = pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+    agg = {c: "sum" for c in _WEEK_ROLLUP_SUM}
+    agg["1RM"] = "max"
+    return d.groupby(WEEK_ROLLUP_KEYS, sort=False, as_index=False).agg(agg)
+
+
+def hist_week_rollup(df: pd.DataFrame) -> pd.DataFrame:
+    """Rollup semanal das linhas de `df` (colunas WEEK_ROLLUP_KEYS + métricas, ver _week_rollup).
+    Para o histórico completo vem pronto (mantido a cada versão); para subconjuntos é calculado
+    a partir das métricas por linha já existentes."""
+    parsed, pos = _hist_parsed_for(df)
+    if parsed is not None and parsed.get("weeks") is not None:
+        if len(pos) == parsed["n"]:
+            return parsed["weeks"].copy()
+        rows = {k: v[pos] for k, v in parsed["rows"].items()}
+        metrics = {k: v[pos] for k, v in _ragged_row_metrics(parsed).items()}
+        return _week_rollup(rows, metrics)
+    if df is None:
+        df = pd.DataFrame(columns=SCHEMA_COLUMNS)
+    return _ragged_build(_hist_detach(df), None)["weeks"]
+
+
+def hist_dates(df: pd.DataFrame) -> pd.Series:
+    """Coluna Data de `df` em datetime (NaT se inválida), com o índice de `df`.
+    Vem dos arrays da versão (parse único, dd/mm/aaaa com fallback) quando `df` sai de get_data().
+    """
+    if df is None or "Data" not in getattr(df, "columns", []):
+        return pd.Series(pd.NaT, index=getattr(df, "index", None), dtype="datetime64[ns]")
+    parsed, pos = _hist_parsed_for(df)
+    if parsed is not None and parsed.get("rows") is not None:
+        return pd.Series(parsed["rows"]["Data"][pos], index=df.index)
+    return _parse_dates_dayfirst(df["Data"])
+
+
+def _profile_rows(df: pd.DataFrame, perfil: str) -> pd.DataFrame:
+    """Linhas do perfil sem as linhas de setup (o que o Histórico mostra)."""
+    d = df[df["Perfil"].astype(str) == str(perfil)]
+    return d[d["Bloco"].astype(str).str.lower() != "setup"]
+
+
+def hist_exercise_labels(df: pd.DataFrame, perfil: str) -> dict:
+    """Exercício_Key -> nome mais recente nas linhas do perfil em `df` (sem setup).
+    Para o histórico completo fica em memo na versão (o warmup preenche-o para todos os perfis)."""
+    if df is None or df.empty:
+        return {}
+    parsed, pos = _hist_parsed_for(df)
+    if parsed is not None and len(pos) == parsed["n"]:
+        labels, _ = _hist_memo(df, ("exercise_labels", str(perfil)), lambda canon, p: _exercise_label_map(_profile_rows(canon, perfil)))
+        if labels is not None:
+            return dict(labels)
+    return _exercise_label_map(_profile_rows(df, perfil))
 
 
 def _join_num_list(vals, decimals=1):
@@ -3050,6 +5221,37 @@ def _join_num_list(vals, decimals=1):
     return ','.join(out)
 
 
+def _normalize_cells_for_save(df: pd.DataFrame) -> None:
+    """Checklist (texto -> bool) e Peso/Reps/RIR (listas/números -> texto), no próprio `df`."""
+    bool_cols = ["Aquecimento","Mobilidade","Cardio","Tendões","Core","Cooldown","Checklist_OK"]
+    for c in bool_cols:
+        low = df[c].astype(str).str.strip().str.lower()
+        col = df[c].astype(object)
+        col[low.isin(['true','1','yes','sim']).to_numpy()] = True
+        col[low.isin(['false','0','no','não','nao']).to_numpy()] = False
+        df[c] = col.infer_objects()
+
+    # normalizar colunas de listas (só as células que não são já texto passam por Python)
+    for c in ["Peso","Reps","RIR"]:
+        vals = df[c].to_numpy(dtype=object)
+        is_str = np.fromiter((isinstance(x, str) for x in vals), dtype=bool, count=len(vals))
+        if not is_str.all():
+            vals = vals.copy()
+            for ix in np.nonzero(~is_str)[0].tolist():
+                x = vals[ix]
+                if isinstance(x, (list, tuple)):
+                    vals[ix] = _join_num_list(x, decimals=0 if c == 'Reps' else 1)
+                    continue
+                try:
+                    if pd.isna(x):
+                        vals[ix] = ''
+                        continue
+                except Exception:
+                    pass
+                vals[ix] = str(x)
+        df[c] = pd.Series(vals, index=df.index)
+
+
 def normalize_for_save(df: pd.DataFrame) -> pd.DataFrame:
     df = pd.DataFrame() if df is None else df.copy()
     df = _ensure_exercise_key_column(df)
@@ -3057,49 +5259,54 @@ def normalize_for_save(df: pd.DataFrame) -> pd.DataFrame:
         if c not in df.columns:
             df[c] = None
     df = df[SCHEMA_COLUMNS].copy()
+    if df.empty:
+        return df.where(pd.notnull(df), None)
     if 'Exercício' in df.columns:
-        df['Exercício'] = df['Exercício'].apply(lambda x: '' if pd.isna(x) else str(x).strip())
+        _ex = df['Exercício']
+        df['Exercício'] = _ex.astype(str).str.strip().where(_ex.notna(), '')
     if 'Exercício_Key' in df.columns:
-        df['Exercício_Key'] = df.apply(lambda r: exercise_key(r.get('Exercício_Key') or r.get('Exercício')), axis=1)
-
-    bool_cols = ["Aquecimento","Mobilidade","Cardio","Tendões","Core","Cooldown","Checklist_OK"]
-    for c in bool_cols:
-        df[c] = df[c].apply(lambda x: True if str(x).strip().lower() in ['true','1','yes','sim'] else (False if str(x).strip().lower() in ['false','0','no','não','nao'] else x))
+        _ek = df['Exercício_Key']
+        df['Exercício_Key'] = exercise_keys(_ek.where(_ek.fillna('').astype(str) != '', df['Exercício']))
 
-    # normalizar colunas de listas
-    for c in ["Peso","Reps","RIR"]:
-        def _norm_cell(x):
-            if isinstance(x, (list, tuple)):
-                if c == 'Reps':
-                    return _join_num_list(x, decimals=0)
-                return _join_num_list(x, decimals=1)
-            try:
-                if pd.isna(x):
-                    return ''
-            except Exception:
-                pass
-            return str(x)
-        df[c] = df[c].apply(_norm_cell)
+    _normalize_cells_for_save(df)
 
-    # datas em dd/mm/aaaa
+    # datas em dd/mm/aaaa: parse único com o formato da app; o resto (ISO, sem zeros, lixo) célula a célula
     if 'Data' in df.columns:
+        hoje = _lisbon_today_date().strftime('%d/%m/%Y')
+
         def _norm_date(x):
             try:
                 if pd.isna(x):
-                    return _lisbon_today_date().strftime('%d/%m/%Y')
+                    return hoje
             except Exception:
                 pass
             sx=str(x).strip()
             if not sx:
-                return _lisbon_today_date().strftime('%d/%m/%Y')
+                return hoje
             dt = pd.to_datetime(sx, dayfirst=True, errors='coerce')
             if pd.notna(dt):
                 return dt.strftime('%d/%m/%Y')
             return sx
-        df['Data'] = df['Data'].apply(_norm_date)
 
-    # evitar NaN para gravação
-    return df.where(pd.notnull(df), None)
+        vals = df['Data'].to_numpy(dtype=object)
+        is_str = np.fromiter((isinstance(x, str) for x in vals), dtype=bool, count=len(vals))
+        # cada texto distinto é tratado uma vez (um histórico tem poucas datas diferentes)
+        codes, uniq = pd.factorize(pd.Series(np.where(is_str, vals, ''), dtype=object).str.strip())
+        uniq = pd.Series(uniq, dtype=object)
+        dt = pd.to_datetime(uniq, format='%d/%m/%Y', errors='coerce')
+        fmt = dt.dt.strftime('%d/%m/%Y').to_numpy(dtype=object)
+        for j in np.nonzero(dt.isna().to_numpy())[0].tolist():
+            fmt[j] = _norm_date(uniq[j])
+        out = fmt[codes]
+        for ix in np.nonzero(~is_str)[0].tolist():
+            out[ix] = _norm_date(vals[ix])
+        df['Data'] = pd.Series(out, index=df.index)
+
+    # evitar NaN para gravação (só nas colunas que os têm)
+    for c in df.columns:
+        if df[c].isna().any():
+            df[c] = df[c].where(df[c].notna(), None)
+    return df
 
 
 def checklist_xp(req: dict, justificativa: str = ""):
@@ -3126,59 +5333,75 @@ def _unique_profile_dates(df: pd.DataFrame, perfil: str):
     d = df[df['Perfil'].astype(str) == str(perfil)].copy()
     if d.empty or 'Data' not in d.columns:
         return []
-    dt = pd.to_datetime(d['Data'], dayfirst=True, errors='coerce').dropna().dt.date.unique().tolist()
+    dt = hist_dates(d).dropna().dt.date.unique().tolist()
     dt = sorted(dt)
     return dt
 
 
+_EPOCH_DATE = datetime.date(1970, 1, 1)
+
+
+def _profile_day_numbers(df: pd.DataFrame, perfil: str) -> np.ndarray:
+    """Dias de treino do perfil (dias desde 1970-01-01, ordenados): da estrutura mantida com o
+    histórico quando `df` é o histórico completo, senão calculados a partir de `df`."""
+    parsed, pos = _hist_parsed_for(df)
+    if parsed is not None and parsed.get("days") is not None and len(pos) == parsed["n"]:
+        return parsed["days"].get(str(perfil), np.zeros(0, dtype=np.int64))
+    return np.array([(d - _EPOCH_DATE).days for d in _unique_profile_dates(df, perfil)], dtype=np.int64)
+
+
+def _streak_ending_at(days: np.ndarray, day: int) -> int:
+    """Dias seguidos de treino que terminam em `day` (0 se não treinou nesse dia)."""
+    i = int(np.searchsorted(days, day))
+    if i >= len(days) or int(days[i]) != int(day):
+        return 0
+    k = i
+    while k > 0 and int(days[k - 1]) == int(days[k]) - 1:
+        k -= 1
+    return i - k + 1
+
+
 def get_last_streak(df: pd.DataFrame, perfil: str) -> int:
-    dates = _unique_profile_dates(df, perfil)
-    if not dates:
+    days = _profile_day_numbers(df, perfil)
+    if len(days) == 0:
         return 0
-    streak = 1
-    cur = dates[-1]
-    seen = set(dates)
-    while True:
-        prev = cur - datetime.timedelta(days=1)
-        if prev in seen:
-            streak += 1
-            cur = prev
-        else:
-            break
-    return streak
+    return _streak_ending_at(days, int(days[-1]))
 
 
 def _compute_streak_if_add_today(df: pd.DataFrame, perfil: str, day: datetime.date) -> int:
-    dates = set(_unique_profile_dates(df, perfil))
-    dates.add(day)
-    if day not in dates:
-        return 0
-    streak = 1
-    cur = day
-    while (cur - datetime.timedelta(days=1)) in dates:
-        cur = cur - datetime.timedelta(days=1)
-        streak += 1
-    return streak
+    days = _profile_day_numbers(df, perfil)
+    return 1 + _streak_ending_at(days, (day - _EPOCH_DATE).days - 1)
 
 
 def get_historico_detalhado(df: pd.DataFrame, perfil: str, ex: str):
     if df is None or df.empty:
         return None, 0.0, 2.0, '—'
-    d = _ensure_exercise_key_column(df)
     ex_key = exercise_key(ex)
-    d = d[d['Perfil'].astype(str) == str(perfil)].copy()
-    if ex_key:
-        d = d[d['Exercício_Key'].astype(str) == str(ex_key)]
+    ix, pos = _hist_exercise_index(df) if ex_key else (None, None)
+    if ix is not None:
+        rows = _hist_index_rows(ix, pos, "ex", (str(perfil), str(ex_key)))
+        if len(rows) == 0:
+            return None, 0.0, 2.0, '—'
+        d = df.loc[rows[:1]]
     else:
-        d = d[d['Exercício'].astype(str) == str(ex)]
-    if d.empty:
-        return None, 0.0, 2.0, '—'
-    d['_dt'] = pd.to_datetime(d['Data'], dayfirst=True, errors='coerce')
-    d = d.sort_values('_dt', ascending=False, na_position='last')
+        d = _ensure_exercise_key_column(df)
+        d = d[d['Perfil'].astype(str) == str(perfil)].copy()
+        if ex_key:
+            d = d[d['Exercício_Key'].astype(str) == str(ex_key)]
+        else:
+            d = d[d['Exercício'].astype(str) == str(ex)]
+        if d.empty:
+            return None, 0.0, 2.0, '—'
+        d['_dt'] = hist_dates(d)
+        d = d.sort_values('_dt', ascending=False, na_position='last')
     row = d.iloc[0]
-    pesos = _parse_num_list(row.get('Peso'))
-    reps = _parse_num_list(row.get('Reps'))
-    rirs = _parse_num_list(row.get('RIR'))
+    parsed, _ = _hist_parsed_for(d)
+    if parsed is not None:
+        pesos, reps, rirs = _ragged_row_lists(parsed, int(row.name))
+    else:
+        pesos = _parse_num_list(row.get('Peso'))
+        reps = _parse_num_list(row.get('Reps'))
+        rirs = _parse_num_list(row.get('RIR'))
     n = max(len(pesos), len(reps), len(rirs))
     if n == 0:
         return None, 0.0, 2.0, str(row.get('Data', '—'))
@@ -3289,6 +5512,121 @@ def _parse_rep_scheme(rep_text: str, series_hint: int | None = None) -> dict:
     return out
 
 
+def _ragged_take(parsed: dict, rows) -> dict:
+    """Linhas `rows` (posições) dos arrays pré-parsed, no mesmo formato de _ragged_build."""
+    rows = np.asarray(rows, dtype=np.int64)
+    out = {}
+    for c in _RAGGED_COLS:
+        a = parsed[c]
+        cnt = a["counts"][rows]
+        off = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(cnt, out=off[1:])
+        take = np.repeat(a["offsets"][rows] - off[:-1], cnt) + np.arange(int(off[-1]), dtype=np.int64)
+        out[c] = {"values": a["values"][take], "offsets": off, "counts": cnt}
+    return out
+
+
+def _resumos_sessoes(d: pd.DataFrame, rg: dict) -> list:
+    """Resumo de todas as sessões (linhas de `d`, pela ordem de `d`) de uma vez, sobre a tabela de séries.
+
+    Regras do cálculo linha a linha: n_sets = maior lista; lista com 1 valor faz broadcast, as outras
+    ficam vazias depois do fim; valores não finitos contam como vazios; reps arredondadas a inteiro;
+    Epley com cap de 15 reps (e reps até à falha = reps + RIR, mínimo 1).
+    """
+    n = len(d)
+    P, R, Q = rg["Peso"], rg["Reps"], rg["RIR"]
+    n_sets = np.maximum.reduce([P["counts"], R["counts"], Q["counts"]]) if n else np.zeros(0, dtype=np.int64)
+    rows = np.repeat(np.arange(n, dtype=np.int64), n_sets)
+    starts = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(n_sets, out=starts[1:])
+    i = np.arange(int(starts[-1]), dtype=np.int64) - np.repeat(starts[:-1], n_sets)
+
+    def _bcast(a):
+        cnt = a["counts"][rows]
+        ok = (cnt > 0) & ((cnt == 1) | (i < cnt))
+        vals = np.full(len(rows), np.nan)
+        vals[ok] = a["values"][a["offsets"][rows[ok]] + np.where(cnt[ok] == 1, 0, i[ok])]
+        vals[~np.isfinite(vals)] = np.nan
+        return vals
+
+    w = _bcast(P)
+    r = _bcast(R)
+    q = _bcast(Q)
+    w_ok = w > 0
+    r_int = np.where(r > 0, np.round(r), np.nan)
+    r_ok = r_int > 0
+    q_ok = ~np.isnan(q)
+
+    cnt_w = np.bincount(rows[w_ok], minlength=n)
+    cnt_r = np.bincount(rows[r_ok], minlength=n)
+    cnt_q = np.bincount(rows[q_ok], minlength=n)
+    peso_medio = np.bincount(rows[w_ok], weights=w[w_ok], minlength=n) / np.maximum(cnt_w, 1)
+    reps_media = np.bincount(rows[r_ok], weights=r_int[r_ok], minlength=n) / np.maximum(cnt_r, 1)
+    rir_media = np.bincount(rows[q_ok], weights=q[q_ok], minlength=n) / np.maximum(cnt_q, 1)
+
+    w_work = np.zeros(n)
+    np.maximum.at(w_work, rows[w_ok], w[w_ok])
+    reps_min = np.full(n, np.inf)
+    reps_max = np.zeros(n)
+    np.minimum.at(reps_min, rows[r_ok], r_int[r_ok])
+    np.maximum.at(reps_max, rows[r_ok], r_int[r_ok])
+
+    pair = w_ok & r_ok
+    tonnage = np.bincount(rows[pair], weights=w[pair] * r_int[pair], minlength=n)
+    e1rm_simple = np.zeros(n)
+    np.maximum.at(e1rm_simple, rows[pair], w[pair] * (1.0 + (np.minimum(15.0, r_int[pair]) / 30.0)))
+    pair_q = pair & q_ok
+    rtf = np.maximum(1.0, r_int[pair_q] + q[pair_q])
+    e1rm_rir = np.zeros(n)
+    np.maximum.at(e1rm_rir, rows[pair_q], w[pair_q] * (1.0 + (np.minimum(15.0, rtf) / 30.0)))
+    e1rm_rir = np.where(e1rm_rir > 0, e1rm_rir, e1rm_simple)
+
+    # listas por sessão: um tolist() por coluna e fatias pelos offsets
+    w_all, r_all, q_all = w[w_ok].tolist(), r_int[r_ok].astype(np.int64).tolist(), q[q_ok].tolist()
+    w_off = np.concatenate(([0], np.cumsum(cnt_w))).tolist()
+    r_off = np.concatenate(([0], np.cumsum(cnt_r))).tolist()
+    q_off = np.concatenate(([0], np.cumsum(cnt_q))).tolist()
+
+    def _col(c, default):
+        return d[c].tolist() if c in d.columns else [default] * n
+
+    datas, dts, blocos, planos = _col('Data', '—'), _col('_dt', None), _col('Bloco', ''), _col('Plano_ID', '')
+    n_sets_l, cnt_r_l, cnt_q_l = n_sets.tolist(), cnt_r.tolist(), cnt_q.tolist()
+    peso_medio, reps_media, rir_media = peso_medio.tolist(), reps_media.tolist(), rir_media.tolist()
+    reps_min, reps_max = reps_min.tolist(), reps_max.tolist()
+    w_work, tonnage, e1rm_simple, e1rm_rir = w_work.tolist(), tonnage.tolist(), e1rm_simple.tolist(), e1rm_rir.tolist()
+    out = []
+    for k in np.nonzero(n_sets > 0)[0].tolist():
+        has_r = cnt_r_l[k] > 0
+        out.append({
+            'data': datas[k],
+            'dt': dts[k],
+            'peso_medio': peso_medio[k],
+            'reps_media': reps_media[k],
+            'reps_min': int(reps_min[k]) if has_r else 0,
+            'reps_max': int(reps_max[k]) if has_r else 0,
+            'rirs_media': rir_media[k] if cnt_q_l[k] else None,
+            'n_sets': n_sets_l[k],
+
+            # compat
+            'pesos': w_all[w_off[k]:w_off[k + 1]],
+            'reps': r_all[r_off[k]:r_off[k + 1]],
+            'rirs': q_all[q_off[k]:q_off[k + 1]],
+
+            # contexto
+            'bloco': str(blocos[k] or ''),
+            'plano_id': str(planos[k] or ''),
+
+            # novos sinais
+            'w_work': w_work[k],
+            'tonnage': tonnage[k],
+            'e1rm_simple': e1rm_simple[k],
+            'e1rm_rir': e1rm_rir[k],
+            'has_rir': cnt_q_l[k] > 0,
+        })
+    return out
+
+
 def _historico_resumos_exercicio(df: pd.DataFrame, perfil: str, ex: str,
                                  bloco: str | None = None,
                                  plano_id: str | None = None) -> list:
@@ -3307,188 +5645,91 @@ def _historico_resumos_exercicio(df: pd.DataFrame, perfil: str, ex: str,
     """
     if df is None or getattr(df, 'empty', True):
         return []
-    d = _ensure_exercise_key_column(df)
-    if 'Perfil' not in d.columns or 'Exercício' not in d.columns:
+    if 'Perfil' not in df.columns or 'Exercício' not in df.columns:
         return []
     ex_key = exercise_key(ex)
-    d = d[d['Perfil'].astype(str) == str(perfil)].copy()
-    if ex_key:
-        d = d[d['Exercício_Key'].astype(str) == str(ex_key)].copy()
-    else:
-        d = d[d['Exercício'].astype(str) == str(ex)].copy()
-    if d.empty:
-        return []
-
-    has_plan = 'Plano_ID' in d.columns
-    has_block = 'Bloco' in d.columns
     plano_id = None if plano_id is None else str(plano_id)
     bloco = None if bloco is None else str(bloco)
-
-    d_scope = d
-    try:
+    ix, pos = _hist_exercise_index(df) if ex_key else (None, None)
+    if ix is not None:
+        # mesmo escopo que o caminho por filtros, mas com os grupos do índice (já ordenados por data)
+        k = (str(perfil), str(ex_key))
+        rows = _hist_index_rows(ix, pos, "ex", k)
+        if len(rows) == 0:
+            return []
+        scope = rows
+        has_plan = 'Plano_ID' in df.columns
+        has_block = 'Bloco' in df.columns
         if has_plan and plano_id:
-            d_plan_block = d[(d['Plano_ID'].astype(str) == plano_id)].copy()
-            if has_block and bloco:
-                d_plan_block = d_plan_block[d_plan_block['Bloco'].astype(str) == bloco].copy()
-            if len(d_plan_block) >= 2:
-                d_scope = d_plan_block
-            elif len(d_plan_block) == 1:
-                d_plan = d[(d['Plano_ID'].astype(str) == plano_id)].copy()
-                d_scope = d_plan if len(d_plan) >= 2 else d_plan_block
-            else:
-                d_plan = d[(d['Plano_ID'].astype(str) == plano_id)].copy()
-                if len(d_plan) >= 2:
-                    d_scope = d_plan
-                elif has_block and bloco:
-                    d_block = d[d['Bloco'].astype(str) == bloco].copy()
-                    if len(d_block) >= 2:
-                        d_scope = d_block
+            r_plan = _hist_index_rows(ix, pos, "plan", k + (plano_id,))
+            r_plan_block = _hist_index_rows(ix, pos, "plan_block", k + (plano_id, bloco)) if (has_block and bloco) else r_plan
+            if len(r_plan_block) >= 2:
+                scope = r_plan_block
+            elif len(r_plan_block) == 1:
+                scope = r_plan if len(r_plan) >= 2 else r_plan_block
+            elif len(r_plan) >= 2:
+                scope = r_plan
+            elif has_block and bloco:
+                r_block = _hist_index_rows(ix, pos, "block", k + (bloco,))
+                if len(r_block) >= 2:
+                    scope = r_block
         elif has_block and bloco:
-            d_block = d[d['Bloco'].astype(str) == bloco].copy()
-            if len(d_block) >= 2:
-                d_scope = d_block
-    except Exception:
-        d_scope = d
-
-    d = d_scope.copy()
-    if d.empty:
-        return []
-    d['_dt'] = pd.to_datetime(d.get('Data'), dayfirst=True, errors='coerce')
-    d = d.sort_values('_dt', ascending=False, na_position='last')
+            r_block = _hist_index_rows(ix, pos, "block", k + (bloco,))
+            if len(r_block) >= 2:
+                scope = r_block
+        d = df.loc[scope].copy()
+        d['_dt'] = ix["dt"].to_numpy()[scope]
+    else:
+        d = _ensure_exercise_key_column(df)
+        d = d[d['Perfil'].astype(str) == str(perfil)].copy()
+        if ex_key:
+            d = d[d['Exercício_Key'].astype(str) == str(ex_key)].copy()
+        else:
+            d = d[d['Exercício'].astype(str) == str(ex)].copy()
+        if d.empty:
+            return []
 
-    def _safe_float(x, default=None):
-        try:
-            if x is None:
-                return default
-            if isinstance(x, str) and x.strip() == '':
-                return default
-            fx = float(x)
-            try:
-                if pd.isna(fx):
-                    return default
-            except Exception:
-                pass
-            if fx == float('inf') or fx == float('-inf'):
-                return default
-            return fx
-        except Exception:
-            return default
+        has_plan = 'Plano_ID' in d.columns
+        has_block = 'Bloco' in d.columns
 
-    def _epley_1rm(w: float, reps_to_fail: float) -> float:
+        d_scope = d
         try:
-            w = float(w)
-            reps_to_fail = float(reps_to_fail)
+            if has_plan and plano_id:
+                d_plan_block = d[(d['Plano_ID'].astype(str) == plano_id)].copy()
+                if has_block and bloco:
+                    d_plan_block = d_plan_block[d_plan_block['Bloco'].astype(str) == bloco].copy()
+                if len(d_plan_block) >= 2:
+                    d_scope = d_plan_block
+                elif len(d_plan_block) == 1:
+                    d_plan = d[(d['Plano_ID'].astype(str) == plano_id)].copy()
+                    d_scope = d_plan if len(d_plan) >= 2 else d_plan_block
+                else:
+                    d_plan = d[(d['Plano_ID'].astype(str) == plano_id)].copy()
+                    if len(d_plan) >= 2:
+                        d_scope = d_plan
+                    elif has_block and bloco:
+                        d_block = d[d['Bloco'].astype(str) == bloco].copy()
+                        if len(d_block) >= 2:
+                            d_scope = d_block
+            elif has_block and bloco:
+                d_block = d[d['Bloco'].astype(str) == bloco].copy()
+                if len(d_block) >= 2:
+                    d_scope = d_block
         except Exception:
-            return 0.0
-        if w <= 0 or reps_to_fail <= 0:
-            return 0.0
-        r = min(15.0, reps_to_fail)  # cap para evitar exageros com reps altas
-        return float(w) * (1.0 + (r / 30.0))
-
-    out = []
-    for _, row in d.iterrows():
-        pesos_raw = _parse_num_list(row.get('Peso'))
-        reps_raw = _parse_num_list(row.get('Reps'))
-        rirs_raw = _parse_num_list(row.get('RIR'))
-
-        pesos_raw = [_safe_float(x, None) for x in pesos_raw]
-        reps_raw = [_safe_float(x, None) for x in reps_raw]
-        rirs_raw = [_safe_float(x, None) for x in rirs_raw]
-
-        # tamanho real do exercício (broadcast simples para listas com 1 valor)
-        n_sets = max(len(pesos_raw), len(reps_raw), len(rirs_raw))
-        if n_sets <= 0:
-            continue
-
-        def _get(arr, i):
-            if not arr:
-                return None
-            if len(arr) == 1:
-                return arr[0]
-            return arr[i] if i < len(arr) else None
-
-        pesos = []
-        reps = []
-        rirs = []
-        for i in range(n_sets):
-            w = _get(pesos_raw, i)
-            r = _get(reps_raw, i)
-            rr = _get(rirs_raw, i)
-            pesos.append(float(w) if (w is not None and w > 0) else None)
-            reps.append(int(round(float(r))) if (r is not None and r > 0) else None)
-            rirs.append(float(rr) if (rr is not None) else None)
-
-        pesos_num = [w for w in pesos if isinstance(w, (int, float)) and pd.notna(w) and float(w) > 0]
-        reps_num = [r for r in reps if isinstance(r, (int, float)) and pd.notna(r) and float(r) > 0]
-        rirs_num = [rr for rr in rirs if isinstance(rr, (int, float)) and pd.notna(rr)]
-
-        peso_medio = float(sum(pesos_num) / len(pesos_num)) if pesos_num else 0.0
-        reps_media = float(sum(reps_num) / len(reps_num)) if reps_num else 0.0
-        rir_media = float(sum(rirs_num) / len(rirs_num)) if rirs_num else None
-
-        # trabalho (top set) e volume
-        w_work = float(max(pesos_num)) if pesos_num else 0.0
-        tonnage = 0.0
-        for i in range(n_sets):
-            w = pesos[i]
-            r = reps[i]
-            if isinstance(w, (int, float)) and isinstance(r, (int, float)) and w > 0 and r > 0:
-                tonnage += float(w) * float(r)
-
-        # e1RM (Epley)
-        e1rm_simple = 0.0
-        e1rm_rir = 0.0
-        for i in range(n_sets):
-            w = pesos[i]
-            r = reps[i]
-            rr = rirs[i]
-            if not (isinstance(w, (int, float)) and isinstance(r, (int, float))):
-                continue
-            if w <= 0 or r <= 0:
-                continue
-
-            e1 = _epley_1rm(w, r)
-            if e1 > e1rm_simple:
-                e1rm_simple = e1
-
-            # se tiver RIR, melhora a estimativa (reps até falha ≈ reps + RIR)
-            if isinstance(rr, (int, float)) and pd.notna(rr):
-                e1r = _epley_1rm(w, max(1.0, float(r) + float(rr)))
-                if e1r > e1rm_rir:
-                    e1rm_rir = e1r
+            d_scope = d
 
-        if e1rm_rir <= 0:
-            e1rm_rir = e1rm_simple
+        d = d_scope.copy()
+        if d.empty:
+            return []
+        d['_dt'] = hist_dates(d)
+        d = d.sort_values('_dt', ascending=False, na_position='last')
 
-        out.append({
-            'data': row.get('Data', '—'),
-            'dt': row.get('_dt'),
-            'peso_medio': float(peso_medio),
-            'reps_media': float(reps_media),
-            'reps_min': int(min([x for x in reps_num if x is not None])) if reps_num else 0,
-            'reps_max': int(max([x for x in reps_num if x is not None])) if reps_num else 0,
-            'rirs_media': float(rir_media) if rir_media is not None else None,
-            'n_sets': int(n_sets),
-
-            # compat
-            'pesos': [w for w in pesos_num],
-            'reps': [int(x) for x in reps_num],
-            'rirs': [float(x) for x in rirs_num],
-
-            # contexto
-            'bloco': str(row.get('Bloco', '') or ''),
-            'plano_id': str(row.get('Plano_ID', '') or ''),
+    parsed, pos = _hist_parsed_for(d)
+    rg = _ragged_take(parsed, pos) if parsed is not None else _ragged_build(d, None, facts=False)
+    return _resumos_sessoes(d, rg)
 
-            # novos sinais
-            'w_work': float(w_work),
-            'tonnage': float(tonnage),
-            'e1rm_simple': float(e1rm_simple),
-            'e1rm_rir': float(e1rm_rir),
-            'has_rir': bool(len(rirs_num) > 0),
-        })
-    return out
 
-def yami_coach_sugestao(df_hist: pd.DataFrame, perfil: str, ex: str, item: dict, bloco: str, semana: int, plano_id: str) -> dict:
+def _yami_coach_sugestao_calc(df_hist: pd.DataFrame, perfil: str, ex: str, item: dict, bloco: str, semana: int, plano_id: str) -> dict:
     """Coach de progressão ('Yami'): sugere carga e explica o porquê, com heurística mais robusta."""
     yami_mode = str(st.session_state.get('yami_mode', 'Brutal'))
 
@@ -4228,6 +6469,57 @@ def yami_coach_sugestao(df_hist: pd.DataFrame, perfil: str, ex: str, item: dict,
     }
 
 
+@st.cache_resource(show_spinner=False)
+def _yami_memo_store() -> dict:
+    return {"lock": threading.Lock(), "lru": collections.OrderedDict(), "hits": 0, "misses": 0}
+
+
+def _yami_memo_key(df_hist: pd.DataFrame, perfil: str, ex: str, item: dict, bloco: str, semana: int, plano_id: str):
+    """Tudo o que a sugestão lê: versão do histórico + argumentos + prontidão, sinais do corpo,
+    knobs do Yami e modo. None quando o histórico não é o frame completo de get_data()."""
+    parsed, pos = _hist_parsed_for(df_hist)
+    if parsed is None or len(pos) != parsed["n"]:
+        return None
+    ss = st.session_state
+    read = ss.get("yami_readiness", {}) or {}
+    return (
+        parsed["tag"],
+        str(perfil), str(ex), str(bloco), str(semana), str(plano_id),
+        tuple(sorted((str(k), repr(v)) for k, v in dict(item or {}).items())),
+        tuple(sorted((str(k), repr(v)) for k, v in dict(read).items())),
+        tuple(bool(ss.get(k, False)) for k in ("sig_dor_joelho", "sig_dor_cotovelo", "sig_dor_ombro", "sig_dor_lombar")),
+        tuple(sorted(yami_get_ctrl().items())),
+        str(ss.get("yami_mode", "Brutal")),
+    )
+
+
+def yami_coach_sugestao(df_hist: pd.DataFrame, perfil: str, ex: str, item: dict, bloco: str, semana: int, plano_id: str) -> dict:
+    """Coach de progressão ('Yami') com memo: num rerun em que nada mudou (timer, checkboxes)
+    a sugestão vem da LRU em vez de ser recalculada. Devolve sempre uma cópia.
+    """
+    try:
+        key = _yami_memo_key(df_hist, perfil, ex, item, bloco, semana, plano_id)
+    except Exception:
+        key = None
+    if key is None:
+        return _yami_coach_sugestao_calc(df_hist, perfil, ex, item, bloco, semana, plano_id)
+    memo = _yami_memo_store()
+    with memo["lock"]:
+        hit = memo["lru"].get(key)
+        if hit is not None:
+            memo["lru"].move_to_end(key)
+            memo["hits"] += 1
+            return copy.deepcopy(hit)
+        memo["misses"] += 1
+    out = _yami_coach_sugestao_calc(df_hist, perfil, ex, item, bloco, semana, plano_id)
+    with memo["lock"]:
+        memo["lru"][key] = copy.deepcopy(out)
+        memo["lru"].move_to_end(key)
+        while len(memo["lru"]) > YAMI_MEMO_MAX:
+            memo["lru"].popitem(last=False)
+    return out
+
+
 def yami_definir_descanso_s(base_s: int, rir_obtido: float | None, rir_alvo: float, reps_obtidas: int | None,
                             reps_low: int | None = None, reps_high: int | None = None,
                             reps_prev: int | None = None, is_composto: bool = True) -> int:
@@ -4301,10 +6593,11 @@ def salvar_sets_agrupados(perfil, dia, bloco, ex, lista_sets, req, justificativa
         return False
 
     # anti-duplo-toque simples (mobile)
+    sig = ''
+    now_ts = time.time()
     try:
         payload_sig = f"{perfil}|{dia}|{bloco}|{ex}|{[(round(float(s.get('peso',0)),2), int(s.get('reps',0)), round(float(s.get('rir',0)),1)) for s in lista_sets]}"
         sig = hashlib.sha1(payload_sig.encode('utf-8')).hexdigest()
-        now_ts = time.time()
         if st.session_state.get('_last_save_sig') == sig and (now_ts - float(st.session_state.get('_last_save_sig_ts', 0))) < 4.0:
             st.session_state['last_save_status'] = 'warn_duplicate'
             return False
@@ -4320,7 +6613,7 @@ def salvar_sets_agrupados(perfil, dia, bloco, ex, lista_sets, req, justificativa
     today = _lisbon_today_date()
     data_str = today.strftime('%d/%m/%Y')
     # NÃO forçar leitura da Google Sheet no momento do save (evita 429 durante o treino em mobile)
-    df_now = st.session_state.get("_df_cache_data")
+    df_now = _shared_history_peek()
     if not isinstance(df_now, pd.DataFrame):
         try:
             df_now = _load_offline_backup()
@@ -4353,23 +6646,39 @@ def salvar_sets_agrupados(perfil, dia, bloco, ex, lista_sets, req, justificativa
         'XP': int(xp),
         'Streak': int(streak),
         'Checklist_OK': bool(checklist_ok),
+        # chave de idempotência: mesma assinatura do anti-duplo-toque + instante da gravação
+        'Row_ID': hashlib.sha1(f"{sig}|{perfil}|{data_str}|{now_ts:.6f}".encode('utf-8')).hexdigest()[:20],
     }
     df_row = pd.DataFrame([row], columns=SCHEMA_COLUMNS)
-    ok, err = safe_append_rows(df_row)
 
-    # atualiza cache local em sessão para evitar reads imediatas à API
+    # PR nesta gravação: melhor série contra o índice de PRs do histórico em cache (sem o percorrer)
+    pr_info = None
     try:
-        if ok:
-            _cached = st.session_state.get('_df_cache_data')
-            if isinstance(_cached, pd.DataFrame):
-                st.session_state['_df_cache_data'] = pd.concat([_cached, df_row], ignore_index=True)
-                st.session_state['_df_cache_ts'] = time.time()
+        _pr_prev = hist_pr(str(perfil), row['Exercício_Key'])
+        _e1 = max([set_e1rm(w, r) for w, r in zip(pesos, repss)] + [0.0])
+        if _pr_prev is not None and _e1 > float(_pr_prev['e1rm']) + 1e-9:
+            pr_info = {'ex': str(ex), 'e1rm': float(_e1), 'antes': float(_pr_prev['e1rm'])}
+    except Exception:
+        pr_info = None
+    st.session_state['last_save_pr'] = None
+
+    # write-behind: commit no store local e volta já à UI; o worker espelha na Sheet em background
+    try:
+        _store_insert_local(df_row)
+        _sheet_sync_kick()
+        st.session_state['last_save_status'] = 'queued'
+        st.session_state['last_save_error_msg'] = ''
+        st.session_state['last_save_pr'] = pr_info
+        return True
     except Exception:
         pass
 
+    # sem store local: append direto (bloqueante), como antes
+    ok, err = safe_append_rows(df_row)
     if ok:
         st.session_state['last_save_status'] = 'ok'
         st.session_state['last_save_error_msg'] = ''
+        st.session_state['last_save_pr'] = pr_info
         return True
     else:
         st.session_state['last_save_status'] = 'error'
@@ -4401,7 +6710,7 @@ def add_calendar_week(df: pd.DataFrame) -> pd.DataFrame:
     if df is None or df.empty:
         return pd.DataFrame(columns=list(df.columns) + ['Data_dt','Semana_ID']) if isinstance(df, pd.DataFrame) else pd.DataFrame()
     out = df.copy()
-    out['Data_dt'] = pd.to_datetime(out['Data'], dayfirst=True, errors='coerce')
+    out['Data_dt'] = hist_dates(out)
     out = out.dropna(subset=['Data_dt']).copy()
     if out.empty:
         return out
@@ -4456,6 +6765,19 @@ def best_1rm_row(row):
     return float(best)
 
 
+_ROW_METRIC_FNS = {"series": series_count_row, "tonnage": tonnage_row, "avg_rir": avg_rir_row, "best_1rm": best_1rm_row}
+
+
+def hist_row_metric(df: pd.DataFrame, name: str) -> pd.Series:
+    """Equivalente a df.apply(<name>_row, axis=1), lido dos arrays pré-parsed quando `df` vem do histórico."""
+    parsed, pos = _hist_parsed_for(df)
+    if parsed is not None and parsed.get("sets") is not None:
+        return pd.Series(_ragged_row_metrics(parsed)[name][pos], index=df.index)
+    if df is None or df.empty:
+        return pd.Series(dtype=float)
+    return df.apply(_ROW_METRIC_FNS[name], axis=1)
+
+
 
 
 def _session_block_state_key(block: dict) -> str:
@@ -5780,6 +8102,11 @@ def gerar_treino_do_dia(dia, week, treinos_dict=None, plan_id="Base"):
 # --- 6. INTERFACE SIDEBAR ---
 # topo decorativo da sidebar removido (UI mais limpa)
 
+try:
+    # o warmup carrega o histórico (uma só carga a frio); este rerun espera por ele e lê da cache
+    _server_warmup(_history_source_key())["history_ready"].wait(timeout=30.0)
+except Exception:
+    LOGGER.exception("warmup do servidor não arrancou")
 df_all = get_data()
 
 st.sidebar.markdown("""
@@ -5854,6 +8181,18 @@ st.sidebar.markdown("<h3>Perfil</h3>", unsafe_allow_html=True)
 
 df_profiles, profiles_ok, profiles_err = get_profiles_df()
 
+try:
+    _circuit = sheets_circuit_status()
+    _quota = sheets_quota_status()
+    if _circuit["state"] != "closed":
+        st.sidebar.caption(f"📴 Google Sheets inacessível — modo offline com os dados locais; nova verificação automática em ~{int(_circuit['retry_in_s']) + 1}s.")
+    elif _quota["blocked_s"] > 0:
+        st.sidebar.caption(f"⏳ Google Sheets em limite de quota — a app continua com os dados locais; sincronização retoma em ~{int(_quota['blocked_s']) + 1}s.")
+    elif _quota["throttled"]:
+        st.sidebar.caption(f"⏳ Quota do Google Sheets quase esgotada ({_quota['tokens']}/{_quota['capacity']}) — sincronização em espera.")
+except Exception:
+    pass
+
 # lista de perfis (preferencialmente da worksheet Perfis)
 perfis = []
 if df_profiles is not None and not df_profiles.empty:
@@ -5982,13 +8321,6 @@ if plano_id_sel not in PLANOS:
     plano_id_sel = "Base"
 st.session_state["plano_id_sel"] = plano_id_sel
 # UI móvel limpa: esconder utilitários de plano/perfis/Google Sheets (funcionam em background)
-_ok_conn, _err_conn = True, ""
-try:
-    _ = conn.read(ttl="0")
-except Exception as _e:
-    _ok_conn, _err_conn = False, str(_e)
-
-bk_df = _load_offline_backup()
 pass  # sidebar divider removido
 
 # DIA
@@ -6247,7 +8579,7 @@ if not is_ineix:
             return ""
 
         try:
-            dfh["_data_dt"] = pd.to_datetime(dfh["Data"], dayfirst=True, errors="coerce")
+            dfh["_data_dt"] = hist_dates(dfh)
             dfh = dfh.dropna(subset=["_data_dt"])
         except Exception:
             return ""
@@ -6559,93 +8891,110 @@ except Exception:
     pass
 
 # --- 8. CORPO PRINCIPAL ---
-tab_painel, tab_treino, tab_historico, tab_ranking = st.tabs(["🏰 Painel", "🔥 Treino", "📊 Histórico", "🏅 Ranking"])
+def _main_tabs(labels: list):
+    """Separadores principais com execução lazy (on_change="rerun"): só o separador aberto corre.
+    Em versões do Streamlit sem esse suporte, todos correm como antes."""
+    try:
+        return st.tabs(labels, key="main_tab", on_change="rerun")
+    except TypeError:
+        return st.tabs(labels)
+
+
+def _tab_open(tab) -> bool:
+    """False só quando o Streamlit sabe que o separador está escondido (sem .open: corre sempre)."""
+    return getattr(tab, "open", None) is not False
+
+
+# Painel, Histórico e Ranking só calculam quando abertos; o Treino corre sempre (o estado dos
+# widgets de séries/timer perde-se se não forem desenhados num rerun)
+tab_painel, tab_treino, tab_historico, tab_ranking = _main_tabs(["🏰 Painel", "🔥 Treino", "📊 Histórico", "🏅 Ranking"])
 
 with tab_painel:
-    try:
-        _pid = str(st.session_state.get("plano_id_sel", "Base"))
-        _plan_label = _PLAN_LABEL_BY_ID.get(_pid, _pid)
-        _cfg_dash = gerar_treino_do_dia(dia, semana, treinos_dict=treinos_dict, plan_id=_pid)
-        _prot_dash = _cfg_dash.get("protocolos", {}) if isinstance(_cfg_dash, dict) else {}
-        _exs_dash = list(_cfg_dash.get("exercicios", []) or []) if isinstance(_cfg_dash, dict) else []
-        _sets_total_dash = int(sum(int(x.get("series", 0) or 0) for x in _exs_dash))
-        _flow_dash, _flow_done_dash, _flow_total_dash, _flow_pending_dash = _session_flow_stats(_cfg_dash, _prot_dash, perfil_sel, dia)
-        _pct_dash = (_flow_done_dash / max(1, _flow_total_dash)) * 100.0
-        _read = st.session_state.get("yami_readiness", {}) or {}
-        _read_label = str(_read.get("label", "Normal") or "Normal")
-        _streak = int(get_last_streak(df_all, perfil_sel)) if isinstance(df_all, pd.DataFrame) else 0
-        _bloco_dash = str(_cfg_dash.get("bloco", "—") or "—") if isinstance(_cfg_dash, dict) else "—"
-        _sessao_dash = str(_cfg_dash.get("sessao", "—") or "—") if isinstance(_cfg_dash, dict) else "—"
-
-        st.markdown("""
-        <div class='he-command'>
-          <div class='he-command-title'>Painel de missão</div>
-          <div class='he-note'>Resumo do que interessa antes de começares a carregar ferro como se a gravidade te devesse dinheiro.</div>
-        </div>
-        """, unsafe_allow_html=True)
-
-        st.markdown(f"""
-        <div class='he-grid'>
-          <div class='he-card accent'>
-            <div class='he-label'>Plano</div>
-            <div class='he-value'>{html.escape(str(_plan_label).split('—')[0].strip())}</div>
-            <div class='he-note'>{html.escape(str(_plan_label))}</div>
-          </div>
-          <div class='he-card blue'>
-            <div class='he-label'>Sessão</div>
-            <div class='he-value'>{html.escape(str(dia).split('—')[0].strip())}</div>
-            <div class='he-note'>{html.escape(_bloco_dash)} · {html.escape(_sessao_dash)}</div>
-          </div>
-          <div class='he-card green'>
-            <div class='he-label'>Volume</div>
-            <div class='he-value'>{len(_exs_dash)} ex · {_sets_total_dash} séries</div>
-            <div class='he-note'>Volume do treino selecionado</div>
-          </div>
-          <div class='he-card'>
-            <div class='he-label'>Estado</div>
-            <div class='he-value'>{html.escape(_read_label)}</div>
-            <div class='he-note'>Streak: {_streak} dias · Semana {int(semana)}</div>
-          </div>
-        </div>
-        """, unsafe_allow_html=True)
+    if _tab_open(tab_painel):
+        try:
+            _pid = str(st.session_state.get("plano_id_sel", "Base"))
+            _plan_label = _PLAN_LABEL_BY_ID.get(_pid, _pid)
+            _cfg_dash = gerar_treino_do_dia(dia, semana, treinos_dict=treinos_dict, plan_id=_pid)
+            _prot_dash = _cfg_dash.get("protocolos", {}) if isinstance(_cfg_dash, dict) else {}
+            _exs_dash = list(_cfg_dash.get("exercicios", []) or []) if isinstance(_cfg_dash, dict) else []
+            _sets_total_dash = int(sum(int(x.get("series", 0) or 0) for x in _exs_dash))
+            _flow_dash, _flow_done_dash, _flow_total_dash, _flow_pending_dash = _session_flow_stats(_cfg_dash, _prot_dash, perfil_sel, dia)
+            _pct_dash = (_flow_done_dash / max(1, _flow_total_dash)) * 100.0
+            _read = st.session_state.get("yami_readiness", {}) or {}
+            _read_label = str(_read.get("label", "Normal") or "Normal")
+            _streak = int(get_last_streak(df_all, perfil_sel)) if isinstance(df_all, pd.DataFrame) else 0
+            _bloco_dash = str(_cfg_dash.get("bloco", "—") or "—") if isinstance(_cfg_dash, dict) else "—"
+            _sessao_dash = str(_cfg_dash.get("sessao", "—") or "—") if isinstance(_cfg_dash, dict) else "—"
+
+            st.markdown("""
+            <div class='he-command'>
+              <div class='he-command-title'>Painel de missão</div>
+              <div class='he-note'>Resumo do que interessa antes de começares a carregar ferro como se a gravidade te devesse dinheiro.</div>
+            </div>
+            """, unsafe_allow_html=True)
 
-        st.markdown(f"""
-        <div class='he-command'>
-          <div class='he-command-title'>Progresso da sessão: {_flow_done_dash}/{_flow_total_dash} blocos</div>
-          <div class='he-progress-track'><div class='he-progress-fill' style='width:{_pct_dash:.1f}%'></div></div>
-          <div class='he-note'>Inclui aquecimento, exercícios e blocos finais. Sim, até aquecer conta. Finalmente uma ideia decente.</div>
-        </div>
-        """, unsafe_allow_html=True)
+            st.markdown(f"""
+            <div class='he-grid'>
+              <div class='he-card accent'>
+                <div class='he-label'>Plano</div>
+                <div class='he-value'>{html.escape(str(_plan_label).split('—')[0].strip())}</div>
+                <div class='he-note'>{html.escape(str(_plan_label))}</div>
+              </div>
+              <div class='he-card blue'>
+                <div class='he-label'>Sessão</div>
+                <div class='he-value'>{html.escape(str(dia).split('—')[0].strip())}</div>
+                <div class='he-note'>{html.escape(_bloco_dash)} · {html.escape(_sessao_dash)}</div>
+              </div>
+              <div class='he-card green'>
+                <div class='he-label'>Volume</div>
+                <div class='he-value'>{len(_exs_dash)} ex · {_sets_total_dash} séries</div>
+                <div class='he-note'>Volume do treino selecionado</div>
+              </div>
+              <div class='he-card'>
+                <div class='he-label'>Estado</div>
+                <div class='he-value'>{html.escape(_read_label)}</div>
+                <div class='he-note'>Streak: {_streak} dias · Semana {int(semana)}</div>
+              </div>
+            </div>
+            """, unsafe_allow_html=True)
 
-        _week_items = list(treinos_dict.keys()) if isinstance(treinos_dict, dict) else []
-        if _week_items:
-            st.markdown("<div class='he-command-title'>Semana do plano</div>", unsafe_allow_html=True)
-            _cards = []
-            for _name in _week_items[:8]:
-                try:
-                    _cfg_w = gerar_treino_do_dia(_name, semana, treinos_dict=treinos_dict, plan_id=_pid)
-                    _n_ex = len(_cfg_w.get("exercicios", []) or []) if isinstance(_cfg_w, dict) else 0
-                    _bl = str(_cfg_w.get("bloco", "—") or "—") if isinstance(_cfg_w, dict) else "—"
-                except Exception:
-                    _n_ex, _bl = 0, "—"
-                _cls = "he-mini-card current" if str(_name) == str(dia) else "he-mini-card"
-                _cards.append(
-                    f"<div class='{_cls}'><div class='he-mini-title'>{html.escape(str(_name))}</div>"
-                    f"<div class='he-mini-sub'>{html.escape(_bl)} · {_n_ex} exercícios</div></div>"
-                )
-            st.markdown("<div class='he-week-grid'>" + "".join(_cards) + "</div>", unsafe_allow_html=True)
+            st.markdown(f"""
+            <div class='he-command'>
+              <div class='he-command-title'>Progresso da sessão: {_flow_done_dash}/{_flow_total_dash} blocos</div>
+              <div class='he-progress-track'><div class='he-progress-fill' style='width:{_pct_dash:.1f}%'></div></div>
+              <div class='he-note'>Inclui aquecimento, exercícios e blocos finais. Sim, até aquecer conta. Finalmente uma ideia decente.</div>
+            </div>
+            """, unsafe_allow_html=True)
+
+            _week_items = list(treinos_dict.keys()) if isinstance(treinos_dict, dict) else []
+            if _week_items:
+                st.markdown("<div class='he-command-title'>Semana do plano</div>", unsafe_allow_html=True)
+                _cards = []
+                for _name in _week_items[:8]:
+                    try:
+                        _cfg_w = gerar_treino_do_dia(_name, semana, treinos_dict=treinos_dict, plan_id=_pid)
+                        _n_ex = len(_cfg_w.get("exercicios", []) or []) if isinstance(_cfg_w, dict) else 0
+                        _bl = str(_cfg_w.get("bloco", "—") or "—") if isinstance(_cfg_w, dict) else "—"
+                    except Exception:
+                        _n_ex, _bl = 0, "—"
+                    _cls = "he-mini-card current" if str(_name) == str(dia) else "he-mini-card"
+                    _cards.append(
+                        f"<div class='{_cls}'><div class='he-mini-title'>{html.escape(str(_name))}</div>"
+                        f"<div class='he-mini-sub'>{html.escape(_bl)} · {_n_ex} exercícios</div></div>"
+                    )
+                st.markdown("<div class='he-week-grid'>" + "".join(_cards) + "</div>", unsafe_allow_html=True)
 
-        st.markdown("---")
-        c1, c2, c3 = st.columns(3)
-        c1.metric("Exercícios", len(_exs_dash))
-        c2.metric("Séries totais", _sets_total_dash)
-        c3.metric("Blocos feitos", f"{_flow_done_dash}/{_flow_total_dash}")
+            st.markdown("---")
+            c1, c2, c3 = st.columns(3)
+            c1.metric("Exercícios", len(_exs_dash))
+            c2.metric("Séries totais", _sets_total_dash)
+            c3.metric("Blocos feitos", f"{_flow_done_dash}/{_flow_total_dash}")
 
-        if not _exs_dash:
-            st.info("Hoje não há treino principal neste plano. Mobilidade, passos, sono e não inventar dores novas. Uma agenda revolucionária.")
-    except Exception as _dash_e:
-        st.warning("O painel high-end não conseguiu renderizar, mas o treino continua disponível. Pequenas humilhações digitais.")
-        st.caption(str(_dash_e)[:260])
+            if not _exs_dash:
+                st.info("Hoje não há treino principal neste plano. Mobilidade, passos, sono e não inventar dores novas. Uma agenda revolucionária.")
+        except Exception as _dash_e:
+            st.warning("O painel high-end não conseguiu renderizar, mas o treino continua disponível. Pequenas humilhações digitais.")
+            st.caption(str(_dash_e)[:260])
 
 with tab_treino:
 
@@ -7282,6 +9631,9 @@ Dor articular pontiaguda = troca variação no dia.
         req = _get_req_state_from_session()
         justificativa = ""
         _save_status = st.session_state.get("last_save_status")
+        _pr_flash = st.session_state.pop("last_save_pr", None)
+        if _pr_flash:
+            st.success(f"🏆 Novo PR em {_pr_flash['ex']}: 1RM estimado {_pr_flash['e1rm']:.1f} kg (antes {_pr_flash['antes']:.1f} kg)")
         if _save_status == "error":
             _save_err_msg = str(st.session_state.get("last_save_error_msg", "") or "")
             msg = "Último exercício não foi para a Google Sheet (ficou em backup local)."
@@ -7290,6 +9642,25 @@ Dor articular pontiaguda = troca variação no dia.
             st.warning(msg)
         elif _save_status == "ok":
             st.caption("✅ Último exercício guardado na Google Sheet.")
+        elif _save_status == "queued":
+            try:
+                _sync = sheet_sync_status(perfil_sel)
+            except Exception:
+                _sync = {"pending": 0, "failed": 0, "synced": 0, "last_error": ""}
+            if _sync["failed"] > 0:
+                _sync_err = str(_sync.get("last_error", "") or "")
+                msg = f"💾 Guardado no servidor. {_sync['failed']} registo(s) ainda não foram para a Google Sheet — nova tentativa automática."
+                if ("429" in _sync_err) or ("RATE_LIMIT" in _sync_err):
+                    msg += " Quota do Google Sheets excedida (espera ~1 min)."
+                elif _GS_CIRCUIT_TAG in _sync_err:
+                    msg += " Google Sheets inacessível (modo offline)."
+                st.warning(msg)
+                if st.button("🔄 Sincronizar agora", key="sheet_sync_now"):
+                    _sheet_sync_kick()
+            elif _sync["pending"] > 0:
+                st.caption(f"💾 Guardado no servidor · ⏳ {_sync['pending']} a sincronizar com a Google Sheet…")
+            else:
+                st.caption("✅ Último exercício guardado e sincronizado com a Google Sheet.")
         elif _save_status == "warn_duplicate":
             st.caption("⚠️ Toque duplicado bloqueado (não gravou de novo).")
 
@@ -7652,6 +10023,17 @@ Dor articular pontiaguda = troca variação no dia.
                                     st.session_state[series_key] = novos_sets
                                     st.session_state[f"rest_{i}"] = int(item["descanso_s"])
 
+                                    # PR ao vivo: esta série contra o PR do histórico e as séries anteriores desta ronda
+                                    try:
+                                        _pr = hist_pr(perfil_sel, exercise_key(ex))
+                                        if _pr is not None:
+                                            _e1 = set_e1rm(peso, reps)
+                                            _ref = max([float(_pr["e1rm"])] + [set_e1rm(x.get("peso"), x.get("reps")) for x in pending_sets])
+                                            if _e1 > _ref + 1e-9:
+                                                st.toast(f"🏆 PR! {ex}: 1RM estimado {_e1:.1f} kg (antes {_ref:.1f} kg)")
+                                    except Exception:
+                                        pass
+
                                     # snapshot (para não perder estado em mobile)
                                     try:
                                         _plano_active = str(st.session_state.get('plano_id_sel','Base'))
@@ -7986,207 +10368,183 @@ Dor articular pontiaguda = troca variação no dia.
                     st.rerun()
         
 with tab_historico:
-    st.header("Histórico do perfil 📊")
-
-    df = get_data()
-    dfp = df[df["Perfil"].astype(str) == str(perfil_sel)].copy()
+    if _tab_open(tab_historico):
+        st.header("Histórico do perfil 📊")
 
-    # ignora linhas de setup de perfis
-    dfp = dfp[dfp["Bloco"].astype(str).str.lower() != "setup"]
+        df = get_data()
+        dfp = df[df["Perfil"].astype(str) == str(perfil_sel)].copy()
 
-    if dfp.empty:
-        st.info("Ainda sem registos neste perfil.")
-    else:
-        # Filtros (mobile-first: empilhados)
-        dias_opts = sorted(dfp["Dia"].dropna().astype(str).unique().tolist())
-        blocos_opts = sorted(dfp["Bloco"].dropna().astype(str).unique().tolist())
-
-        dfp = _ensure_exercise_key_column(dfp)
-        dias_filtrados = st.multiselect("Dia", dias_opts, default=[])
-        blocos_filtrados = st.multiselect("Bloco", blocos_opts, default=[])
-        ex_label_map = _exercise_label_map(dfp)
-        ex_opts = sorted(ex_label_map.keys(), key=lambda k: ex_label_map.get(k, k))
-        ex_filtro = st.multiselect("Exercício", ex_opts, default=[], format_func=lambda k: ex_label_map.get(k, k))
-
-        datas_dt = pd.to_datetime(dfp["Data"], dayfirst=True, errors="coerce").dropna()
-        if not datas_dt.empty:
-            dmin = datas_dt.min().date()
-            dmax = datas_dt.max().date()
-            intervalo = st.date_input("Datas", value=(dmin, dmax))
-            try:
-                if isinstance(intervalo, (list, tuple)) and len(intervalo) == 2:
-                    di, df_ = intervalo[0], intervalo[1]
-                    dfp["_Data_dt"] = pd.to_datetime(dfp["Data"], dayfirst=True, errors="coerce")
-                    dfp = dfp.dropna(subset=["_Data_dt"])
-                    dfp = dfp[(dfp["_Data_dt"].dt.date >= di) & (dfp["_Data_dt"].dt.date <= df_)]
-                    dfp = dfp.drop(columns=["_Data_dt"])
-            except Exception:
-                pass
-
-        if dias_filtrados:
-            dfp = dfp[dfp["Dia"].astype(str).isin([str(x) for x in dias_filtrados])]
-        if blocos_filtrados:
-            dfp = dfp[dfp["Bloco"].astype(str).isin([str(x) for x in blocos_filtrados])]
-        if ex_filtro:
-            dfp = dfp[dfp["Exercício_Key"].astype(str).isin([str(x) for x in ex_filtro])]
+        # ignora linhas de setup de perfis
+        dfp = dfp[dfp["Bloco"].astype(str).str.lower() != "setup"]
 
         if dfp.empty:
-            st.info("Sem registos com esses filtros.")
-            st.stop()
+            st.info("Ainda sem registos neste perfil.")
+        else:
+            # Filtros (mobile-first: empilhados)
+            dias_opts = sorted(dfp["Dia"].dropna().astype(str).unique().tolist())
+            blocos_opts = sorted(dfp["Bloco"].dropna().astype(str).unique().tolist())
+
+            dfp = _ensure_exercise_key_column(dfp)
+            dias_filtrados = st.multiselect("Dia", dias_opts, default=[])
+            blocos_filtrados = st.multiselect("Bloco", blocos_opts, default=[])
+            ex_label_map = hist_exercise_labels(df, perfil_sel)
+            ex_opts = sorted(ex_label_map.keys(), key=lambda k: ex_label_map.get(k, k))
+            ex_filtro = st.multiselect("Exercício", ex_opts, default=[], format_func=lambda k: ex_label_map.get(k, k))
+
+            datas_dt = hist_dates(dfp).dropna()
+            datas_cortadas = False  # o intervalo de datas tirou linhas com data -> rollup só destas linhas
+            if not datas_dt.empty:
+                dmin = datas_dt.min().date()
+                dmax = datas_dt.max().date()
+                intervalo = st.date_input("Datas", value=(dmin, dmax))
+                try:
+                    if isinstance(intervalo, (list, tuple)) and len(intervalo) == 2:
+                        di, df_ = intervalo[0], intervalo[1]
+                        dfp["_Data_dt"] = hist_dates(dfp)
+                        dfp = dfp.dropna(subset=["_Data_dt"])
+                        n_datadas = len(dfp)
+                        dfp = dfp[(dfp["_Data_dt"].dt.date >= di) & (dfp["_Data_dt"].dt.date <= df_)]
+                        dfp = dfp.drop(columns=["_Data_dt"])
+                        datas_cortadas = len(dfp) < n_datadas
+                except Exception:
+                    pass
 
-        xp_total = int(pd.to_numeric(dfp["XP"], errors="coerce").fillna(0).sum())
-        streak_max = int(pd.to_numeric(dfp["Streak"], errors="coerce").fillna(0).max())
-        checklist_rate = float(dfp["Checklist_OK"].apply(_to_bool).mean())
-        rank, subtitulo = calcular_rank(xp_total, streak_max, checklist_rate)
+            if dias_filtrados:
+                dfp = dfp[dfp["Dia"].astype(str).isin([str(x) for x in dias_filtrados])]
+            if blocos_filtrados:
+                dfp = dfp[dfp["Bloco"].astype(str).isin([str(x) for x in blocos_filtrados])]
+            if ex_filtro:
+                dfp = dfp[dfp["Exercício_Key"].astype(str).isin([str(x) for x in ex_filtro])]
 
-        a,b,c = st.columns(3)
-        a.metric("🏅 Rank Atual", rank)
-        b.metric("✨ XP Total", xp_total)
-        c.metric("✅ Checklist", f"{checklist_rate*100:.0f}%")
-        st.caption(f"Status: **{subtitulo}** | 🔥 Streak Máx: **{streak_max}** dias")
+            if dfp.empty:
+                st.info("Sem registos com esses filtros.")
+                st.stop()
 
-        pass  # divider removed
+            xp_total = int(pd.to_numeric(dfp["XP"], errors="coerce").fillna(0).sum())
+            streak_max = int(pd.to_numeric(dfp["Streak"], errors="coerce").fillna(0).max())
+            checklist_rate = float(dfp["Checklist_OK"].apply(_to_bool).mean())
+            rank, subtitulo = calcular_rank(xp_total, streak_max, checklist_rate)
 
-        dfw_all = add_calendar_week(dfp)
-        if not dfw_all.empty:
-            # coluna derivada necessária para PRs (evita KeyError)
-            dfw_all["1RM Estimado"] = dfw_all.apply(best_1rm_row, axis=1)
-        if dfw_all.empty:
-            st.warning("Há registos, mas sem datas válidas (esperado: dd/mm/aaaa).")
-        else:
-            semanas = sorted(dfw_all["Semana_ID"].unique())
-            semana_sel = st.selectbox("Seleciona a semana (ISO):", semanas, index=len(semanas)-1)
+            a,b,c = st.columns(3)
+            a.metric("🏅 Rank Atual", rank)
+            b.metric("✨ XP Total", xp_total)
+            c.metric("✅ Checklist", f"{checklist_rate*100:.0f}%")
+            st.caption(f"Status: **{subtitulo}** | 🔥 Streak Máx: **{streak_max}** dias")
 
-            dfw = dfw_all[dfw_all["Semana_ID"] == semana_sel].copy()
-            dfw["Séries"] = dfw.apply(series_count_row, axis=1)
-            dfw["Tonnage"] = dfw.apply(tonnage_row, axis=1)
-            dfw["RIR_médio"] = dfw.apply(avg_rir_row, axis=1)
-            dfw["1RM Estimado"] = dfw.apply(best_1rm_row, axis=1)
+            pass  # divider removed
 
-            k1,k2,k3 = st.columns(3)
-            k1.metric("Séries na Semana", f"{int(dfw['Séries'].sum())}")
-            k2.metric("Tonnage na Semana", f"{float(dfw['Tonnage'].sum()):.0f} kg")
-            k3.metric("RIR Médio (linhas)", f"{float(dfw['RIR_médio'].mean() if len(dfw) else 0.0):.1f}")
+            # rollup semanal já materializado (filtrado pelas mesmas colunas); só se o intervalo de datas
+            # cortar linhas é recalculado para as linhas de dfp
+            if datas_cortadas:
+                roll = hist_week_rollup(dfp)
+            else:
+                roll = hist_week_rollup(df)
+                roll = roll[(roll["Perfil"] == str(perfil_sel)) & (roll["Bloco"].str.lower() != "setup")]
+                if dias_filtrados:
+                    roll = roll[roll["Dia"].isin([str(x) for x in dias_filtrados])]
+                if blocos_filtrados:
+                    roll = roll[roll["Bloco"].isin([str(x) for x in blocos_filtrados])]
+                if ex_filtro:
+                    roll = roll[roll["Exercício_Key"].isin([str(x) for x in ex_filtro])]
+            if roll.empty:
+                st.warning("Há registos, mas sem datas válidas (esperado: dd/mm/aaaa).")
+            else:
+                semanas = sorted(roll["Semana_ID"].unique())
+                semana_sel = st.selectbox("Seleciona a semana (ISO):", semanas, index=len(semanas)-1)
 
-            pass  # divider removed
+                rw = roll[roll["Semana_ID"] == semana_sel]
+                linhas_sem = int(rw["Linhas"].sum())
+                rir_sem = float(rw["RIR_soma"].sum() / linhas_sem) if linhas_sem else 0.0
 
-            st.subheader("📌 Volume por Bloco (semana)")
-            vol_bloco = dfw.groupby("Bloco")["Séries"].sum().sort_values(ascending=False)
-            st.bar_chart(vol_bloco)
+                k1,k2,k3 = st.columns(3)
+                k1.metric("Séries na Semana", f"{int(rw['Séries'].sum())}")
+                k2.metric("Tonnage na Semana", f"{float(rw['Tonnage'].sum()):.0f} kg")
+                k3.metric("RIR Médio (linhas)", f"{rir_sem:.1f}")
 
-            st.subheader("⚠️ Índice de Fadiga (simples)")
-            dfw["Fadiga"] = dfw["Séries"] * (4 - dfw["RIR_médio"].clip(lower=0, upper=4))
-            fadiga = float(dfw["Fadiga"].sum())
-            st.metric("Fadiga (Σ Séries × (4−RIR))", f"{fadiga:.1f}")
-            if fadiga >= 90 or float(dfw["RIR_médio"].mean()) <= 1.2:
-                st.warning("Esforço alto. Se sono/stress estiverem maus: considera deload / mantém RIR mais alto.")
-            else:
-                st.success("Sinais OK. Mantém progressão e técnica.")
+                pass  # divider removed
 
-            pass  # divider removed
+                st.subheader("📌 Volume por Bloco (semana)")
+                vol_bloco = rw.groupby("Bloco")["Séries"].sum().sort_values(ascending=False)
+                st.bar_chart(vol_bloco)
 
-            st.subheader("🏆 PRs por Exercício (1RM Estimado)")
-            dfw_all = _ensure_exercise_key_column(dfw_all)
-            dfw = _ensure_exercise_key_column(dfw)
-            _hist_label_map = _exercise_label_map(dfw_all)
-            best_hist = dfw_all.groupby("Exercício_Key")["1RM Estimado"].max()
-            best_week = dfw.groupby("Exercício_Key")["1RM Estimado"].max()
-            prs = []
-            for ex_key, val_week in best_week.items():
-                val_hist = float(best_hist.get(ex_key, 0))
-                if val_week > 0 and abs(val_week - val_hist) < 1e-9:
-                    prs.append((_hist_label_map.get(str(ex_key), str(ex_key)), val_week))
-            if prs:
-                st.success("Novos PRs detetados nesta semana:")
-                st.dataframe(pd.DataFrame(prs, columns=["Exercício","1RM Estimado (PR)"]), hide_index=True, width='stretch')
-            else:
-                st.info("Sem PRs nesta semana.")
+                st.subheader("⚠️ Índice de Fadiga (simples)")
+                fadiga = float(rw["Fadiga"].sum())
+                st.metric("Fadiga (Σ Séries × (4−RIR))", f"{fadiga:.1f}")
+                if fadiga >= 90 or rir_sem <= 1.2:
+                    st.warning("Esforço alto. Se sono/stress estiverem maus: considera deload / mantém RIR mais alto.")
+                else:
+                    st.success("Sinais OK. Mantém progressão e técnica.")
+
+                pass  # divider removed
+
+                st.subheader("🏆 PRs por Exercício (1RM Estimado)")
+                dfp_datado = dfp[hist_dates(dfp).notna()]
+                _hist_label_map = _exercise_label_map(dfp_datado)
+                best_hist = roll.groupby("Exercício_Key")["1RM"].max()
+                best_week = rw.groupby("Exercício_Key")["1RM"].max()
+                prs = []
+                for ex_key, val_week in best_week.items():
+                    val_hist = float(best_hist.get(ex_key, 0))
+                    if val_week > 0 and abs(val_week - val_hist) < 1e-9:
+                        prs.append((_hist_label_map.get(str(ex_key), str(ex_key)), val_week))
+                if prs:
+                    st.success("Novos PRs detetados nesta semana:")
+                    st.dataframe(pd.DataFrame(prs, columns=["Exercício","1RM Estimado (PR)"]), hide_index=True, width='stretch')
+                else:
+                    st.info("Sem PRs nesta semana.")
 
-            pass  # divider removed
+                pass  # divider removed
 
-            st.subheader("📈 Progressão de Força (1RM Estimado)")
-            lista_exercicios = sorted(_hist_label_map.keys(), key=lambda k: _hist_label_map.get(k, k))
-            filtro_ex = st.selectbox("Escolhe um Exercício:", lista_exercicios, format_func=lambda k: _hist_label_map.get(k, k))
-            df_chart = dfw_all[dfw_all["Exercício_Key"].astype(str) == str(filtro_ex)].copy()
-            df_chart["1RM Estimado"] = df_chart.apply(best_1rm_row, axis=1)
-            df_chart = df_chart.sort_values("Data_dt")
+                st.subheader("📈 Progressão de Força (1RM Estimado)")
+                lista_exercicios = sorted(_hist_label_map.keys(), key=lambda k: _hist_label_map.get(k, k))
+                filtro_ex = st.selectbox("Escolhe um Exercício:", lista_exercicios, format_func=lambda k: _hist_label_map.get(k, k))
+                df_chart = add_calendar_week(dfp_datado[dfp_datado["Exercício_Key"].astype(str) == str(filtro_ex)])
+                df_chart["1RM Estimado"] = hist_row_metric(df_chart, "best_1rm")
+                df_chart = df_chart.sort_values("Data_dt")
 
-            st.line_chart(df_chart, x="Data_dt", y="1RM Estimado")
+                st.line_chart(df_chart, x="Data_dt", y="1RM Estimado")
 
-            st.markdown("### Registos filtrados")
-            st.dataframe(
-                df_chart.sort_values("Data_dt", ascending=False)[
-                    ["Data","Dia","Bloco","Exercício","Peso","Reps","RIR","XP","Checklist_OK","Notas"]
-                ],
-                width='stretch', hide_index=True
-            )
+                st.markdown("### Registos filtrados")
+                st.dataframe(
+                    df_chart.sort_values("Data_dt", ascending=False)[
+                        ["Data","Dia","Bloco","Exercício","Peso","Reps","RIR","XP","Checklist_OK","Notas"]
+                    ],
+                    width='stretch', hide_index=True
+                )
 
 
 with tab_ranking:
-    st.header("Ranking de perfis 🏅")
-
-    rank_window = st.selectbox("Período do ranking", ["Total", "30 dias", "90 dias"], index=0)
+    if _tab_open(tab_ranking):
+        st.header("Ranking de perfis 🏅")
 
-    df_rank_all = get_data().copy()
-    # ignora linhas de setup/ruído
-    df_rank_all = df_rank_all[df_rank_all["Bloco"].astype(str).str.lower() != "setup"]
-    df_rank_all = df_rank_all[df_rank_all["Dia"].astype(str).str.lower() != "setup"]
-    df_rank_all = df_rank_all[df_rank_all["Exercício"].astype(str).str.lower() != "setup"]
+        rank_window = st.selectbox("Período do ranking", ["Total", "30 dias", "90 dias"], index=0)
 
-    if rank_window != "Total" and not df_rank_all.empty:
-        dias = 30 if rank_window == "30 dias" else 90
-        df_rank_all["_dt"] = pd.to_datetime(df_rank_all["Data"], dayfirst=True, errors="coerce")
-        cutoff = pd.Timestamp.today().normalize() - pd.Timedelta(days=dias)
-        df_rank_all = df_rank_all[df_rank_all["_dt"] >= cutoff].drop(columns=["_dt"], errors="ignore")
+        # leaderboard mantido com o histórico (ignora linhas de setup); períodos por somas acumuladas
+        rank_dias = None if rank_window == "Total" else (30 if rank_window == "30 dias" else 90)
+        rank_df = hist_leaderboard(get_data(), rank_dias)
 
-    if df_rank_all.empty:
-        st.info("Ainda não há registos suficientes para criar ranking.")
-    else:
-        rows = []
-        for perfil, d in df_rank_all.groupby("Perfil"):
-            d = d.copy()
-            xp_total = int(pd.to_numeric(d["XP"], errors="coerce").fillna(0).sum())
-            streak_max = int(pd.to_numeric(d["Streak"], errors="coerce").fillna(0).max()) if "Streak" in d.columns else 0
-            checklist_rate = float(d["Checklist_OK"].apply(_to_bool).mean()) if "Checklist_OK" in d.columns else 0.0
-            sessoes = int(d[["Data","Dia"]].drop_duplicates().shape[0])
-
-            tier, subt = calcular_rank(xp_total, streak_max, checklist_rate)
-            tier_ord = {"💎 PLATINA": 4, "🥇 OURO": 3, "🥈 PRATA": 2, "🥉 BRONZE": 1}.get(tier, 0)
-
-            score = float(xp_total) + float(streak_max)*50.0 + float(checklist_rate)*500.0 + float(sessoes)*10.0
-
-            rows.append({
-                "Perfil": str(perfil),
-                "Tier": tier,
-                "Score": round(score, 1),
-                "XP Total": xp_total,
-                "Streak Máx": streak_max,
-                "Checklist %": round(checklist_rate*100, 0),
-                "Sessões": sessoes,
-                "_tier_ord": tier_ord
-            })
+        if rank_df.empty:
+            st.info("Ainda não há registos suficientes para criar ranking.")
+        else:
+            rank_df.insert(0, "Posição", range(1, len(rank_df)+1))
+
+            # pódio (empilhado para ficar legível em mobile)
+            top3 = rank_df.head(3)
+            if not top3.empty:
+                if len(top3) >= 1:
+                    st.metric("🥇 #1", top3.iloc[0]["Perfil"], f"{top3.iloc[0]['Tier']} • {top3.iloc[0]['XP Total']} XP")
+                if len(top3) >= 2:
+                    st.metric("🥈 #2", top3.iloc[1]["Perfil"], f"{top3.iloc[1]['Tier']} • {top3.iloc[1]['XP Total']} XP")
+                if len(top3) >= 3:
+                    st.metric("🥉 #3", top3.iloc[2]["Perfil"], f"{top3.iloc[2]['Tier']} • {top3.iloc[2]['XP Total']} XP")
 
-        rank_df = pd.DataFrame(rows)
-        rank_df = rank_df.sort_values(["_tier_ord", "Score", "XP Total"], ascending=[False, False, False]).drop(columns=["_tier_ord"])
-        rank_df.insert(0, "Posição", range(1, len(rank_df)+1))
-
-        # pódio (empilhado para ficar legível em mobile)
-        top3 = rank_df.head(3)
-        if not top3.empty:
-            if len(top3) >= 1:
-                st.metric("🥇 #1", top3.iloc[0]["Perfil"], f"{top3.iloc[0]['Tier']} • {top3.iloc[0]['XP Total']} XP")
-            if len(top3) >= 2:
-                st.metric("🥈 #2", top3.iloc[1]["Perfil"], f"{top3.iloc[1]['Tier']} • {top3.iloc[1]['XP Total']} XP")
-            if len(top3) >= 3:
-                st.metric("🥉 #3", top3.iloc[2]["Perfil"], f"{top3.iloc[2]['Tier']} • {top3.iloc[2]['XP Total']} XP")
-
-        st.dataframe(
-            rank_df[["Posição","Perfil","Tier","Score","XP Total","Streak Máx","Checklist %","Sessões"]],
-            width='stretch',
-            hide_index=True
-        )
+            st.dataframe(
+                rank_df[["Posição","Perfil","Tier","Score","XP Total","Streak Máx","Checklist %","Sessões"]],
+                width='stretch',
+                hide_index=True
+            )
 
-        st.caption("Score = XP + (Streak×50) + (Checklist×500) + (Sessões×10). Isto é só para ranking — não muda o teu treino.")
+            st.caption("Score = XP + (Streak×50) + (Checklist×500) + (Sessões×10). Isto é só para ranking — não muda o teu treino.")
 
 
 # espaço de segurança para barras flutuantes (mobile)
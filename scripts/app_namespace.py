@@ -0,0 +1,32 @@
+"""Carrega as funções e constantes de app.py sem correr a interface.
+
+app.py é um script Streamlit (desenha a UI ao ser importado). Aqui só entram os imports, as
+definições (def/class) e as constantes em maiúsculas do topo do ficheiro; o resto é ignorado.
+Usado pelos testes (tests/) e pelos benchmarks (scripts/bench_history.py).
+"""
+import ast
+import pathlib
+
+APP_PATH = pathlib.Path(__file__).resolve().parent.parent / "app.py"
+
+
+def _is_constant(node) -> bool:
+    return isinstance(node, ast.Assign) and all(
+        isinstance(t, ast.Name) and t.id.lstrip("_")[:1].isupper() for t in node.targets
+    )
+
+
+def load_app(source: str | None = None, filename: str | None = None) -> dict:
+    """Namespace com as definições de `source` (por omissão, o app.py atual)."""
+    if source is None:
+        source = APP_PATH.read_text(encoding="utf-8")
+    filename = filename or str(APP_PATH)
+    ns = {"__name__": "bc_app"}
+    for node in ast.parse(source).body:
+        if not (isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.ClassDef)) or _is_constant(node)):
+            continue
+        try:
+            exec(compile(ast.Module(body=[node], type_ignores=[]), filename, "exec"), ns)
+        except Exception:
+            pass  # constante que depende de algo que não foi carregado
+    return ns
@@ -0,0 +1,161 @@
+"""Tempos antes/depois das otimizações do histórico, medidos com um histórico sintético.
+
+    python scripts/bench_history.py                  # todos os benchmarks
+    python scripts/bench_history.py resumos keys     # só alguns (ver BENCHMARKS)
+    python scripts/bench_history.py resumos --before <rev> --repeat 3
+
+"Antes" é o app.py do commit anterior ao do pedido (primeiro commit com a tag [user-0xx] no git log),
+ou o de --before; "depois" é o app.py da árvore atual. Cada tempo é a mediana de --repeat corridas
+(uma só quando a primeira passa de SLOW_MS). Os dois lados recebem o mesmo frame, já normalizado.
+"""
+import argparse
+import pathlib
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+import pandas as pd
+import streamlit as st
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+
+from app_namespace import APP_PATH, load_app  # noqa: E402
+from synthetic_history import EXERCICIOS, synthetic_history  # noqa: E402
+
+REPO = APP_PATH.parent
+SLOW_MS = 5000.0
+
+
+def _git(*args) -> str:
+    return subprocess.run(["git", *args], cwd=REPO, check=True, capture_output=True, text=True).stdout.strip()
+
+
+def _before_rev(request_id: str) -> str:
+    shas = _git("log", "--reverse", "--format=%H", "--fixed-strings", f"--grep=[{request_id}]").split()
+    if not shas:
+        raise SystemExit(f"sem commit [{request_id}] no git log; usar --before REV")
+    return f"{shas[0]}^"
+
+
+def _apps(request_id: str, before: str | None) -> tuple:
+    rev = _git("rev-parse", "--short", before or _before_rev(request_id))
+    old = load_app(_git("show", f"{rev}:app.py"), filename=f"{rev}:app.py")
+    return rev, old, load_app()
+
+
+def _ms(fn, repeat: int, reset=None) -> float:
+    out = []
+    for _ in range(max(1, repeat)):
+        if reset is not None:
+            reset()
+        t = time.perf_counter()
+        fn()
+        out.append((time.perf_counter() - t) * 1000.0)
+        if out[0] > SLOW_MS:
+            break
+    return statistics.median(out)
+
+
+def _row(label: str, before_ms: float, after_ms: float) -> None:
+    print(f"  {label:<28} {before_ms:>10.1f} ms {after_ms:>10.1f} ms   x{before_ms / max(after_ms, 1e-9):.1f}")
+
+
+def _header(title: str, rev: str) -> None:
+    print(f"\n{title}\n  antes = {rev}, depois = árvore atual")
+    print(f"  {'':<28} {'antes':>13} {'depois':>13}")
+
+
+def bench_resumos(args) -> None:
+    """[user-014] _historico_resumos_exercicio: um perfil e um exercício com N sessões (frame simples).
+    Só datas dd/mm/aaaa: o app.py anterior lia as ISO com dayfirst (corrigido noutro pedido)."""
+    rev, old, new = _apps("user-014", args.before)
+    _header("_historico_resumos_exercicio", rev)
+    for n in args.sessions:
+        df = new["_normalize_history_frame"](synthetic_history(n, iso_every=0).assign(Perfil="Gui", Exercício=EXERCICIOS[0]))
+        a = old["_historico_resumos_exercicio"](df, "Gui", EXERCICIOS[0])
+        b = new["_historico_resumos_exercicio"](df, "Gui", EXERCICIOS[0])
+        assert a == b, "resultados diferentes"
+        _row(f"{n} sessões", _ms(lambda: old["_historico_resumos_exercicio"](df, "Gui", EXERCICIOS[0]), args.repeat),
+             _ms(lambda: new["_historico_resumos_exercicio"](df, "Gui", EXERCICIOS[0]), args.repeat))
+
+
+def _name_variants(df, seed: int = 3):
+    """Exercício com as variantes que aparecem na Sheet (maiúsculas, espaços, sem acentos, vazio/None)."""
+    rng = random.Random(seed)
+    variants = [str.upper, lambda x: f"  {x} ", lambda x: x.replace("ç", "c").replace("º", ""), lambda x: x]
+    names = [rng.choice(variants)(x) for x in df["Exercício"]]
+    for i in range(0, len(names), 97):
+        names[i] = None if i % 2 else ""
+    return df.assign(Exercício=names)
+
+
+def bench_keys(args) -> None:
+    """[user-021] exercise_key por linha vs por nome distinto (memo partilhado), em `--rows` linhas."""
+    rev, old, new = _apps("user-021", args.before)
+    n = args.rows
+    blank = _name_variants(synthetic_history(n))  # Exercício_Key por preencher
+    # todas as chaves gravadas: o _ensure_exercise_key_column renormaliza-as todas
+    filled = blank.assign(**{"Exercício_Key": blank["Exercício"].where(blank["Exercício"].fillna("") != "", EXERCICIOS[0])})
+    print(f"\n{n} linhas, {blank['Exercício'].nunique(dropna=False)} nomes distintos")
+    _header("exercise_key", rev)
+    cold = st.cache_resource.clear
+    pd.testing.assert_series_equal(blank["Exercício"].apply(lambda x: old["exercise_key"](str(x or ""))), new["exercise_keys"](blank["Exercício"]), check_names=False)
+    _row("apply -> exercise_keys (frio)", _ms(lambda: blank["Exercício"].apply(lambda x: old["exercise_key"](str(x or ""))), args.repeat),
+         _ms(lambda: new["exercise_keys"](blank["Exercício"]), args.repeat, reset=cold))
+    _row("apply -> exercise_keys (memo)", _ms(lambda: blank["Exercício"].apply(lambda x: old["exercise_key"](str(x or ""))), args.repeat),
+         _ms(lambda: new["exercise_keys"](blank["Exercício"]), args.repeat))
+    for label, df in (("ensure_key (chaves vazias)", blank), ("ensure_key (chaves gravadas)", filled)):
+        pd.testing.assert_frame_equal(old["_ensure_exercise_key_column"](df), new["_ensure_exercise_key_column"](df))
+        _row(label, _ms(lambda: old["_ensure_exercise_key_column"](df), args.repeat),
+             _ms(lambda: new["_ensure_exercise_key_column"](df), args.repeat, reset=cold))
+
+
+def _save_frame(n: int):
+    """Linhas como chegam ao normalize_for_save: texto da Sheet com bools, listas e datas ISO à mistura."""
+    df = synthetic_history(n).astype(object)
+    df.loc[df.index % 5 == 0, "Cardio"] = True
+    df.loc[df.index % 17 == 0, "Peso"] = pd.Series([[80, 82.5, 85]] * len(df), index=df.index)
+    df.loc[df.index % 23 == 0, "Data"] = None
+    return df
+
+
+def bench_normalize(args) -> None:
+    """[user-022] normalize_for_save em 1k / 10k / 100k linhas (o "antes" a 100k demora ~40 s)."""
+    rev, old, new = _apps("user-022", args.before)
+    _header("normalize_for_save", rev)
+    for n in args.save_rows:
+        df = _save_frame(n)
+        a, b = old["normalize_for_save"](df), new["normalize_for_save"](df)
+        pd.testing.assert_frame_equal(a, b)
+        _row(f"{n} linhas", _ms(lambda: old["normalize_for_save"](df), args.repeat),
+             _ms(lambda: new["normalize_for_save"](df), args.repeat))
+
+
+BENCHMARKS = {
+    "resumos": bench_resumos,
+    "keys": bench_keys,
+    "normalize": bench_normalize,
+}
+
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("which", nargs="*", help=f"benchmarks a correr ({', '.join(BENCHMARKS)}); por omissão todos")
+    ap.add_argument("--before", help="revisão git do app.py 'antes' (por omissão: a anterior ao pedido)")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--sessions", type=int, nargs="+", default=[100, 1000, 10000])
+    ap.add_argument("--rows", type=int, default=50000, help="linhas do benchmark keys")
+    ap.add_argument("--save-rows", type=int, nargs="+", default=[1000, 10000, 100000], help="linhas do benchmark normalize")
+    args = ap.parse_args(argv)
+    unknown = sorted(set(args.which) - set(BENCHMARKS))
+    if unknown:
+        ap.error(f"benchmark desconhecido: {', '.join(unknown)}")
+    for name in args.which or BENCHMARKS:
+        st.cache_resource.clear()
+        BENCHMARKS[name](args)
+
+
+if __name__ == "__main__":
+    main()
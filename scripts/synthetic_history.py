@@ -0,0 +1,60 @@
+"""Histórico sintético (schema da Sheet) para testes e benchmarks."""
+import datetime
+import random
+
+import pandas as pd
+
+COLUMNS = [
+    "Data", "Perfil", "Dia", "Bloco", "Plano_ID",
+    "Exercício", "Exercício_Key", "Peso", "Reps", "RIR", "Notas",
+    "Aquecimento", "Mobilidade", "Cardio", "Tendões", "Core", "Cooldown",
+    "XP", "Streak", "Checklist_OK", "Row_ID",
+]
+PERFIS = ["Principal", "Gui", "Bruno", "Ineix"]
+EXERCICIOS = [
+    "Supino Inclinado c/ Halteres", "Puxada na Polia (pegada neutra)", "Leg Press 45º",
+    "Elevação Lateral Polia", "Hip Thrust", "RDL", "Remada Curvada", "Agachamento",
+]
+
+
+def synthetic_history(n: int, seed: int = 7, start: datetime.date = datetime.date(2023, 1, 1),
+                      iso_every: int = 37) -> pd.DataFrame:
+    """`n` linhas como a app grava (listas "80,80,80"), com alguns casos reais à mistura:
+    datas ISO (uma a cada `iso_every` linhas; 0 = nenhuma), um só peso para várias séries,
+    RIR vazio, Exercício_Key por preencher."""
+    rng = random.Random(seed)
+    out = []
+    for i in range(n):
+        d = start + datetime.timedelta(days=i // 6)
+        k = rng.randint(1, 4)
+        peso = [round(rng.uniform(20, 120) / 2.5) * 2.5 for _ in range(k)]
+        reps = [rng.randint(5, 15) for _ in range(k)]
+        rir = [rng.choice([0, 1, 1.5, 2, 3]) for _ in range(k)]
+        if i % 11 == 0:
+            peso = peso[:1]
+        if i % 13 == 0:
+            rir = []
+        out.append({
+            "Data": d.strftime("%Y-%m-%d") if iso_every and i % iso_every == 0 else d.strftime("%d/%m/%Y"),
+            "Perfil": rng.choice(PERFIS),
+            "Dia": "Segunda — Upper",
+            "Bloco": rng.choice(["Força", "Hipertrofia", "PUSH"]),
+            "Plano_ID": "Base",
+            "Exercício": rng.choice(EXERCICIOS),
+            "Exercício_Key": "",
+            "Peso": ",".join(f"{x:g}" for x in peso),
+            "Reps": ",".join(map(str, reps)),
+            "RIR": ",".join(f"{x:g}" for x in rir),
+            "Notas": "",
+            "Aquecimento": rng.choice(["TRUE", "FALSE", ""]),
+            "Mobilidade": "TRUE",
+            "Cardio": "FALSE",
+            "Tendões": "TRUE",
+            "Core": "",
+            "Cooldown": "FALSE",
+            "XP": str(rng.randint(10, 30)),
+            "Streak": str(rng.randint(1, 5)),
+            "Checklist_OK": rng.choice(["TRUE", "FALSE"]),
+            "Row_ID": f"r{seed}-{i}",
+        })
+    return pd.DataFrame(out, columns=COLUMNS)
@@ -0,0 +1,31 @@
+import pathlib
+import sys
+
+import pytest
+import streamlit as st
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / "scripts"))
+
+from app_namespace import load_app  # noqa: E402
+from synthetic_history import synthetic_history  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """Funções de app.py com store/snapshot num diretório temporário e sem worker de sincronização."""
+    monkeypatch.chdir(tmp_path)
+    st.cache_resource.clear()
+    ns = load_app()
+    ns["LOCAL_STORE_PATH"] = str(tmp_path / "store.sqlite3")
+    ns["HISTORY_SNAPSHOT_PATH"] = str(tmp_path / "snapshot.bin")
+    ns["_sheet_sync_kick"] = lambda *a, **k: None
+    yield ns
+    st.cache_resource.clear()
+
+
+@pytest.fixture
+def store_history(app):
+    """Store local já com 300 linhas sintéticas (como depois do primeiro import da Sheet)."""
+    app["_store_ingest_sheet"](app["_normalize_history_frame"](synthetic_history(300)), full=True)
+    app["_store_meta_set"]("bootstrapped", True)
+    return app
@@ -0,0 +1,31 @@
+import threading
+import time
+import types
+
+
+def test_worksheet_open_does_not_hold_pool_lock(app):
+    app["_gsheets_cfg"] = lambda: {"spreadsheet": "sheet-key"}
+    pool = app["_gs_pool"]()
+    seen = {"lock_free": [], "opens": 0}
+
+    class SlowClient:
+        def open_by_key(self, key):
+            seen["opens"] += 1
+            # outra sessão consegue usar o pool enquanto esta espera pela API
+            probe = threading.Thread(target=lambda: seen["lock_free"].append(pool["lock"].acquire(timeout=0.2) and (pool["lock"].release() or True)))
+            probe.start()
+            probe.join()
+            time.sleep(0.1)
+            return types.SimpleNamespace(sheet1=object())
+
+    app["conn"] = types.SimpleNamespace(_client=SlowClient())
+    got = []
+    threads = [threading.Thread(target=lambda: got.append(app["_gs_worksheet"]())) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert seen["lock_free"] and all(seen["lock_free"])
+    assert len(got) == 2 and got[0] is got[1] is pool["ws"]
+    assert pool["opened"] == 1
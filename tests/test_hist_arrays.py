@@ -0,0 +1,57 @@
+import pandas as pd
+import pytest
+from synthetic_history import synthetic_history
+
+
+def _expected_dates(app, df):
+    return app["_parse_dates_dayfirst"](df["Data"])
+
+
+@pytest.mark.parametrize("derive", [
+    lambda d: d[d["Perfil"] == "Gui"].reset_index(drop=True),
+    lambda d: pd.concat([d.iloc[200:], d.iloc[:50]]).reset_index(drop=True),
+    lambda d: d.iloc[::-1].reset_index(drop=True),
+])
+def test_rows_of_derived_frames_are_not_read_from_wrong_positions(store_history, derive):
+    app = store_history
+    sub = derive(app["get_data"]())
+    pd.testing.assert_series_equal(app["hist_dates"](sub), _expected_dates(app, sub), check_names=False)
+    pd.testing.assert_series_equal(
+        app["hist_row_metric"](sub, "tonnage"), sub.apply(app["tonnage_row"], axis=1), check_names=False,
+    )
+
+
+def test_plain_selections_use_cached_arrays(store_history):
+    app = store_history
+    df = app["get_data"]()
+    sub = df[df["Perfil"] == "Gui"]
+    parsed, pos = app["_hist_parsed_for"](sub)
+    assert parsed is not None
+    assert list(pos) == list(sub.index)
+    assert app["_hist_parsed_for"](sub.reset_index(drop=True)) == (None, None)
+    assert app["_hist_parsed_for"](app["_normalize_history_frame"](sub)) == (None, None)
+
+
+NON_FINITE = [
+    ("80,nan", "10,8", "1,nan"),
+    ("inf", "nan,5", "inf"),
+    ("nan,60", "8,8", "2,2"),
+    ("inf,70", "nan,0", "nan"),
+    ("-inf", "5,inf", "1,-inf,inf"),
+    ("100", "inf,nan,3", ""),
+    ("nan", "10", "nan,nan"),
+]
+
+
+@pytest.mark.parametrize("name", ["series", "tonnage", "avg_rir", "best_1rm"])
+def test_row_metrics_match_row_functions_on_non_finite_tokens(app, name):
+    base = app["_normalize_history_frame"](synthetic_history(40))
+    for i, (peso, reps, rir) in enumerate(NON_FINITE):
+        base.loc[i * 5, ["Peso", "Reps", "RIR"]] = [peso, reps, rir]
+    app["_store_ingest_sheet"](base, full=True)
+    app["_store_meta_set"]("bootstrapped", True)
+    df = app["get_data"]()
+    assert app["_hist_parsed_for"](df)[0] is not None
+    fast = app["hist_row_metric"](df, name)
+    slow = df.apply(app["_ROW_METRIC_FNS"][name], axis=1)
+    pd.testing.assert_series_equal(fast.astype(float), slow.astype(float), check_names=False)
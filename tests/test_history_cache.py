@@ -0,0 +1,62 @@
+import pandas as pd
+
+
+def test_get_data_reads_store(store_history):
+    df = store_history["get_data"]()
+    assert len(df) == 300
+    assert list(df.columns) == store_history["SCHEMA_COLUMNS"]
+
+
+def test_failed_store_read_is_not_cached(store_history):
+    app = store_history
+    real = app["_store_read_frame"]
+    calls = {"n": 0}
+
+    def flaky(after_seq=0):
+        calls["n"] += 1
+        if calls["n"] == 1:
+            raise RuntimeError("database is locked")
+        return real(after_seq)
+
+    app["_store_read_frame"] = flaky
+    assert app["get_data"]().empty
+    df = app["get_data"]()
+    assert calls["n"] == 2
+    assert len(df) == 300
+
+
+def test_failed_store_read_keeps_previous_history(store_history):
+    app = store_history
+    before = app["get_data"]()
+    app["_store_insert_local"](before.iloc[:2].assign(Row_ID=["n1", "n2"]))
+
+    def broken(after_seq=0):
+        raise RuntimeError("disk I/O error")
+
+    real = app["_store_read_frame"]
+    app["_store_read_frame"] = broken
+    pd.testing.assert_frame_equal(app["get_data"](), before)
+    app["_store_read_frame"] = real
+    assert len(app["get_data"]()) == 302
+
+
+def test_full_pull_during_incremental_read_does_not_duplicate_rows(store_history):
+    app = store_history
+    sheet = app["get_data"]()
+    app["_store_insert_local"](sheet.iloc[:1].assign(Row_ID=["n1"]))
+    real = app["_store_read_frame"]
+    calls = []
+
+    def pull_in_between(after_seq=0):
+        if not calls:
+            # o worker faz um pull completo depois de o get_data decidir ler só o delta
+            app["_store_ingest_sheet"](sheet, full=True)
+        calls.append(after_seq)
+        return real(after_seq)
+
+    app["_store_read_frame"] = pull_in_between
+    df = app["get_data"]()
+    assert calls[0] > 0 and calls[-1] == 0
+    assert len(df) == 301 and df["Row_ID"].is_unique
+    app["_store_read_frame"] = real
+    assert len(app["get_data"]()) == 301
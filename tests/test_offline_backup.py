@@ -0,0 +1,62 @@
+import os
+
+import pandas as pd
+
+
+def _worker():
+    return {"pull_wanted": False, "profiles_wanted": False, "last_pull": 0.0, "last_push_err": "", "last_backup_err": ""}
+
+
+def _quiet_worker(app, sent):
+    app["_gs_breaker_probe_due"] = lambda: False
+    app["_history_snapshot_save"] = lambda worker: None
+
+    def push():
+        df, seqs, _ = app["_outbox_pending"]()
+        sent.extend(df["Row_ID"].tolist())
+        app["_outbox_advance"](max(seqs))
+        return True, ""
+
+    app["_sheet_push_pending"] = push
+
+
+def test_worker_imports_offline_backup_once(store_history):
+    app = store_history
+    df = app["get_data"]()
+    new = df.iloc[:2].assign(Row_ID=["off-1", "off-2"], Data="02/02/2025")
+    known = df.iloc[[10]]  # já no store (mesmo Row_ID)
+    legacy = df.iloc[[11]].assign(Row_ID="", Exercício="  " + df.iloc[11]["Exercício"] + " ")  # sem Row_ID, formatação diferente
+    pd.concat([new, known, new.iloc[[0]], legacy]).to_csv(app["BACKUP_PATH"], index=False)
+
+    sent = []
+    _quiet_worker(app, sent)
+    worker = _worker()
+    app["_sheet_sync_step"](worker)
+
+    assert worker["last_backup_err"] == ""
+    assert sent == ["off-1", "off-2"]
+    assert not os.path.exists(app["BACKUP_PATH"]) and os.path.exists(app["BACKUP_PATH"] + ".imported")
+    assert len(app["get_data"]()) == 302
+
+    app["_sheet_sync_step"](worker)  # nada de novo na volta seguinte
+    assert sent == ["off-1", "off-2"] and len(app["get_data"]()) == 302
+
+
+def test_failed_import_is_retried(store_history):
+    app = store_history
+    app["get_data"]().iloc[:1].assign(Row_ID="off-9").to_csv(app["BACKUP_PATH"], index=False)
+    sent = []
+    _quiet_worker(app, sent)
+    real = app["_store_insert_local"]
+
+    def locked(*a, **k):
+        raise RuntimeError("database is locked")
+
+    app["_store_insert_local"] = locked
+    worker = _worker()
+    app["_sheet_sync_step"](worker)
+    assert "locked" in worker["last_backup_err"] and sent == []
+
+    app["_store_insert_local"] = real
+    app["_sheet_sync_step"](worker)
+    assert worker["last_backup_err"] == "" and sent == ["off-9"]
@@ -0,0 +1,50 @@
+import os
+
+import pytest
+from synthetic_history import synthetic_history
+
+
+class LostAckWorksheet:
+    """Worksheet em memória cujo append entra mas devolve timeout (ack perdido)."""
+
+    def __init__(self, header):
+        self.values = [list(header)]
+        self.appends = 0
+
+    def append_rows(self, rows, value_input_option=None):
+        self.values.extend(list(r) for r in rows)
+        self.appends += 1
+        raise TimeoutError("Read timed out")
+
+    def batch_get(self, ranges):
+        start = int(ranges[0].split(":")[0][1:])
+        return [self.values[start - 1:]]
+
+    def col_values(self, col):
+        return [r[col - 1] if len(r) >= col else "" for r in self.values]
+
+    def update(self, cell, rows, value_input_option=None):
+        start = int(cell[1:])
+        while len(self.values) < start - 1 + len(rows):
+            self.values.append([])
+        self.values[start - 1:start - 1 + len(rows)] = [list(r) for r in rows]
+
+
+@pytest.mark.parametrize("pulled_rows", [0, 3])
+def test_fallback_does_not_rewrite_rows_that_landed(app, pulled_rows):
+    header = list(app["SCHEMA_COLUMNS"])
+    ws = LostAckWorksheet(header)
+    ws.values.extend([["x"] * len(header) for _ in range(pulled_rows)])
+    if pulled_rows:
+        app["_store_meta_set"](app["_sheet_state_key"](), {"rows": pulled_rows})
+    app["_gs_worksheet"] = lambda *a, **k: ws
+    app["_gs_sheet_header"] = lambda w: header
+
+    rows = synthetic_history(2, seed=3)
+    ok, err = app["safe_append_rows"](rows)
+
+    assert ok, err
+    assert ws.appends == 1
+    rid = header.index("Row_ID")
+    assert [r[rid] for r in ws.values[1 + pulled_rows:]] == rows["Row_ID"].tolist()
+    assert not os.path.exists("offline_backup.csv")
@@ -0,0 +1,21 @@
+from synthetic_history import synthetic_history
+
+
+def test_sync_status_error_is_scoped_to_profile(store_history):
+    app = store_history
+    rows = synthetic_history(4, seed=11)
+    rows["Perfil"] = ["Gui", "Gui", "Bruno", "Bruno"]
+    app["_store_insert_local"](rows)
+    store = app["_store"]()
+    with store["lock"]:
+        outbox = store["con"].execute(
+            f"SELECT o.seq, t.{app['_sql_ident']('Perfil')} FROM outbox o JOIN treinos t ON t.seq = o.treino_seq"
+        ).fetchall()
+    app["_outbox_mark_failed"]([s for s, p in outbox if p == "Gui"], "quota Gui")
+    app["_outbox_mark_failed"]([s for s, p in outbox if p == "Bruno"][:1], "timeout Bruno")
+
+    gui = app["sheet_sync_status"]("Gui")
+    bruno = app["sheet_sync_status"]("Bruno")
+    assert (gui["failed"], gui["last_error"]) == (2, "quota Gui")
+    assert (bruno["failed"], bruno["pending"], bruno["last_error"]) == (1, 1, "timeout Bruno")
+    assert app["sheet_sync_status"]()["last_error"] == "timeout Bruno"
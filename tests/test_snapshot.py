@@ -0,0 +1,93 @@
+import json
+import pickle
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+
+def _worker():
+    return {"snapshot_key": None, "snapshot_ts": 0.0, "snapshot_lock": threading.Lock()}
+
+
+def _profiles():
+    return pd.DataFrame({"Perfil": ["Gui", "Bruno"], "Criado_em": ["01/01/2024", None], "Plano_ID": ["Base", "Base"], "Ativo": [True, False]})
+
+
+def test_snapshot_round_trip_is_data_only(store_history):
+    app = store_history
+    df = app["get_data"]()
+    app["_profiles_shared_set"](_profiles(), ts=123.0)
+    app["_history_snapshot_save"](_worker())
+
+    with np.load(app["HISTORY_SNAPSHOT_PATH"], allow_pickle=False) as z:
+        head = json.loads(str(z["header"][()]))
+        assert all(z[k].dtype != object for k in z.files)
+    assert head["schema"] == app["HISTORY_SNAPSHOT_SCHEMA"]
+    assert head["rows"] == len(df)
+
+    snap = app["_snapshot_read"]()
+    pd.testing.assert_frame_equal(snap["history"]["df"], df)
+    pd.testing.assert_frame_equal(snap["profiles"]["df"], _profiles())
+    assert snap["profiles"]["ts"] == 123.0
+
+
+def test_snapshot_from_other_schema_is_ignored(store_history):
+    app = store_history
+    app["get_data"]()
+    app["_history_snapshot_save"](_worker())
+    app["HISTORY_SNAPSHOT_SCHEMA"] += 1
+    assert app["_snapshot_read"]() == {}
+
+
+def test_pickle_file_is_not_loaded(app):
+    with open(app["HISTORY_SNAPSHOT_PATH"], "wb") as f:
+        pickle.dump({"history": None}, f)
+    assert app["_snapshot_read"]() == {}
+
+
+def test_new_process_starts_from_snapshot_and_rebuilds_arrays(store_history):
+    app = store_history
+    before = app["get_data"]()
+    app["_history_snapshot_save"](_worker())
+
+    st.cache_resource.clear()  # processo novo: caches vazias, mesmo store e snapshot no disco
+    reads = []
+    real = app["_store_read_frame"]
+
+    def spy(after_seq=0):
+        reads.append(after_seq)
+        return real(after_seq)
+
+    app["_store_read_frame"] = spy
+    df = app["get_data"]()
+    assert reads and reads[0] > 0  # só o delta depois do snapshot
+    pd.testing.assert_frame_equal(df, before)
+    parsed, pos = app["_hist_parsed_for"](df)
+    assert parsed is not None and parsed["n"] == len(df)
+    pd.testing.assert_series_equal(app["hist_row_metric"](df, "tonnage"), df.apply(app["tonnage_row"], axis=1))
+
+
+def test_worker_rewrites_snapshot_at_most_once_per_interval(store_history):
+    app = store_history
+    app["get_data"]()
+    worker = _worker()
+    app["_history_snapshot_save"](worker)
+    first = worker["snapshot_key"]
+    assert first is not None
+
+    app["_store_insert_local"](app["get_data"]().iloc[:1].assign(Row_ID=["n1"]))
+    app["get_data"]()
+    app["_history_snapshot_save"](worker)
+    assert worker["snapshot_key"] == first
+
+    worker["snapshot_ts"] = time.time() - app["HISTORY_SNAPSHOT_MIN_INTERVAL_S"] - 1
+    app["_history_snapshot_save"](worker)
+    assert worker["snapshot_key"] != first
+
+    app["_store_insert_local"](app["get_data"]().iloc[:1].assign(Row_ID=["n2"]))
+    app["get_data"]()
+    app["_history_snapshot_save"](worker, force=True)  # saída do processo
+    assert app["_snapshot_read"]()["history"]["df"]["Row_ID"].iloc[-1] == "n2"
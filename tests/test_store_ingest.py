@@ -0,0 +1,41 @@
+from synthetic_history import synthetic_history
+
+
+def _sheet_rows(app):
+    df = app["_normalize_history_frame"](synthetic_history(30, iso_every=0).assign(Perfil="Gui"))
+    df.loc[5, "Data"] = ""
+    df.loc[6, "Data"] = None
+    return df
+
+
+def test_blank_sheet_dates_stay_blank(app):
+    sheet = _sheet_rows(app)
+    for _ in range(2):  # um re-pull completo não pode mexer na data
+        app["_store_ingest_sheet"](sheet, full=True)
+        app["_store_meta_set"]("bootstrapped", True)
+        df = app["get_data"]()
+        blank = df[df["Row_ID"].isin(sheet.loc[[5, 6], "Row_ID"])]
+        assert len(blank) == 2
+        assert blank["Data"].fillna("").eq("").all()
+        assert app["hist_dates"](blank).isna().all()
+
+    dated = sheet.drop(index=[5, 6])
+    app["_store_ingest_sheet"](dated, full=True)
+    expected = app["get_last_streak"](app["get_data"](), "Gui")
+    app["_store_ingest_sheet"](sheet, full=True)
+    df = app["get_data"]()
+    assert app["get_last_streak"](df, "Gui") == expected
+    today = app["_lisbon_today_date"]().strftime("%d/%m/%Y")
+    assert not df["Data"].eq(today).any()
+
+
+def test_sheet_checklist_and_lists_are_normalized(app):
+    sheet = _sheet_rows(app).astype(object)
+    sheet.at[0, "Cardio"] = "true"
+    sheet.at[0, "Peso"] = [80, 82.5]
+    app["_store_ingest_sheet"](sheet, full=True)
+    app["_store_meta_set"]("bootstrapped", True)
+    df = app["get_data"]()
+    row = df.set_index("Row_ID").loc[sheet.at[0, "Row_ID"]]
+    assert (row["Cardio"], row["Peso"]) == ("TRUE", "80,82.5")
+    assert df["Data"].iloc[7:].tolist() == sheet["Data"].iloc[7:].tolist()
@@ -0,0 +1,43 @@
+import logging
+import threading
+
+
+def _state():
+    return {"done": False, "ms": None, "steps": {}, "errors": [], "history_ready": threading.Event()}
+
+
+def test_warmup_logs_timings_and_failed_steps(store_history, caplog):
+    app = store_history
+
+    def no_sheet():
+        raise ConnectionError("sheet offline")
+
+    app["_profiles_warm"] = no_sheet
+    state = _state()
+    with caplog.at_level(logging.INFO, logger=app["LOGGER"].name):
+        app["_server_warmup_run"](state)
+
+    assert state["done"] and state["errors"] == ["perfis: sheet offline"]
+    failed = [r for r in caplog.records if r.levelno == logging.ERROR]
+    assert len(failed) == 1 and "perfis" in failed[0].getMessage()
+    assert failed[0].exc_info and failed[0].exc_info[0] is ConnectionError
+    timing = [r for r in caplog.records if r.levelno == logging.INFO]
+    assert len(timing) == 1 and "300 linhas" in timing[0].getMessage()
+
+
+def test_first_run_reuses_the_warmup_history_load(store_history):
+    app = store_history
+    gate = threading.Event()
+    app["_profiles_warm"] = lambda: gate.wait(5) and None  # resto do warmup ainda a correr
+    state = _state()
+    t = threading.Thread(target=app["_server_warmup_run"], args=(state,), daemon=True)
+    t.start()
+    try:
+        assert state["history_ready"].wait(5) and not state["done"]
+        misses = app["get_data_cache_stats"]()["misses"]
+        assert len(app["get_data"]()) == 300
+        assert app["get_data_cache_stats"]()["misses"] == misses == 1  # só a carga do warmup
+    finally:
+        gate.set()
+        t.join(5)
+    assert state["done"]